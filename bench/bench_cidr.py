@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark PrefixFilter lookups as the number of prefixes grows. Lookups
+use unique random addresses so the lookup cache does not hide the cost
+of the radix tree walk.
+"""
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tstat_transport.cidr import PrefixFilter  # pylint: disable=wrong-import-position
+
+
+def _random_v4(rand):
+    return socket.inet_ntoa(struct.pack('!I', rand.getrandbits(32)))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--lookups', metavar='N', type=int, dest='lookups',
+                        default=200000, help='Number of lookups per run.')
+    options = parser.parse_args()
+
+    rand = random.Random(42)
+    addrs = [_random_v4(rand) for _ in range(options.lookups)]
+
+    print('{0:>8} {1:>12} {2:>14}'.format('prefixes', 'lookups/s', 'usec/lookup'))
+
+    for count in (10, 100, 1000, 10000, 100000):
+        prefixes = ['{0}/{1}'.format(_random_v4(rand), rand.randint(8, 32))
+                    for _ in range(count)]
+        pfilter = PrefixFilter(include=prefixes[::2], exclude=prefixes[1::2])
+
+        start = time.time()
+        for i in addrs:
+            pfilter.lookup(i)
+        elapsed = time.time() - start
+
+        print('{0:>8} {1:>12.0f} {2:>14.2f}'.format(
+            count, options.lookups / elapsed, elapsed / options.lookups * 1e6))
+
+
+if __name__ == '__main__':
+    main()
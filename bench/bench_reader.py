@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the log reader: plain (memory-mapped) reads vs. streaming
+decompression + parse of the same log compressed with gzip, bzip2 and
+(if the zstandard module is installed) zstandard.
+
+The sample log is replicated until it is --size MB so the numbers are
+not dominated by setup costs.
+"""
+
+import argparse
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tstat_transport.format import CAPSULE_MAP  # pylint: disable=wrong-import-position
+from tstat_transport.reader import LogReader  # pylint: disable=wrong-import-position
+
+
+def _build_log(src, size_mb):
+    """Replicate the body of the src log up to size_mb."""
+    with open(src, 'rb') as fh:
+        lines = fh.read().splitlines(True)
+
+    header, body = lines[0], b''.join(lines[1:])
+    repeat = max(1, int(size_mb * 1024 * 1024 / max(len(body), 1)))
+
+    return header + body * repeat
+
+
+def _compressors():
+    ret = [('gz', gzip.compress), ('bz2', bz2.compress)]
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+        ret.append(('zst', zstandard.ZstdCompressor().compress))
+    except ImportError:
+        print('zstandard not installed - skipping .zst')
+    return ret
+
+
+def _time_read(path, log_type):
+    start = time.time()
+    rows = sum(1 for _ in LogReader(path, log_type, CAPSULE_MAP.get(log_type).COLUMNS))
+    return rows, time.time() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-l', '--log', metavar='FILE', type=str, dest='log',
+                        default='test_data/parse_data.out/log_tcp_complete',
+                        help='Sample log to replicate.')
+    parser.add_argument('-p', '--protocol', metavar='PROTO', type=str, dest='protocol',
+                        default='tcp', help='Log type of the sample log.')
+    parser.add_argument('-s', '--size', metavar='MB', type=int, dest='size',
+                        default=64, help='Size of the replicated log in MB.')
+    options = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        raw = _build_log(options.log, options.size)
+        mbytes = len(raw) / 1024.0 / 1024.0
+
+        plain = os.path.join(tmpdir, 'log_{0}_complete'.format(options.protocol))
+        with open(plain, 'wb') as fh:
+            fh.write(raw)
+
+        variants = [('plain', plain)]
+        for suffix, compress in _compressors():
+            path = plain + '.' + suffix
+            with open(path, 'wb') as fh:
+                fh.write(compress(raw))
+            variants.append((suffix, path))
+
+        print('{0:>6} {1:>10} {2:>10} {3:>12} {4:>10}'.format(
+            'input', 'on disk MB', 'seconds', 'rows/s', 'MB/s'))
+
+        for name, path in variants:
+            rows, elapsed = _time_read(path, options.protocol)
+            print('{0:>6} {1:>10.1f} {2:>10.2f} {3:>12.0f} {4:>10.1f}'.format(
+                name, os.path.getsize(path) / 1024.0 / 1024.0, elapsed,
+                rows / elapsed, mbytes / elapsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
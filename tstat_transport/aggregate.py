@@ -0,0 +1,216 @@
+"""
+Optional time-windowed aggregation of flows into rollup records.
+
+Capsules are grouped by a configurable key within fixed time windows,
+and one rollup record is emitted per group with the summed bits and
+packets, the min/avg/max rtt and the retransmit rate. Configured with
+the optional [aggregate] stanza:
+
+    [aggregate]
+    window = 600
+    key = src_ip, dst_ip, dst_port, protocol, direction
+    max_groups = 100000
+
+A window is closed and flushed once flows ending more than one window
+past it have been seen. If there are more than max_groups open groups,
+the oldest window is flushed early to keep memory bounded. Anything
+still open is flushed at the end of the run.
+
+The directories with flows in an open window are held() - they are not
+marked .processed until the window has been sent, so a failure or crash
+in the meantime reprocesses them rather than losing their flows.
+"""
+
+import collections
+import json
+
+from .common import TstatConfigException
+from .format import document_template
+
+KEY_FIELDS = ('src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol', 'direction')
+
+DEFAULT_KEY = ('src_ip', 'dst_ip', 'dst_port', 'protocol', 'direction')
+DEFAULT_WINDOW = 600
+DEFAULT_MAX_GROUPS = 100000
+
+
+class Rollup(object):
+    """Accumulated values of the flows in one group/window."""
+
+    def __init__(self, key_items, window_start, window, template):
+        self._key_items = key_items
+        self._template = template
+        self.window_start = window_start
+        self.window = window
+        self.flows = 0
+        self.bits = 0
+        self.packets = 0
+        self.rexmit_pkts = 0
+        self.rtt_flows = 0
+        self.rtt_min = None
+        self.rtt_max = None
+        self.rtt_sum = 0.0
+
+    def add(self, capsule):
+        """Add a capsule to the rollup. A sampled flow (see sample) is
+        counted sample_rate times."""
+        weight = capsule.sample_rate
+        self.flows += weight
+        self.bits += (capsule.num_bits or 0) * weight
+        self.packets += (capsule.num_packets or 0) * weight
+        self.rexmit_pkts += (capsule.rexmit_pkts or 0) * weight
+
+        rtt = capsule.rtt
+        if rtt is not None and rtt[1]:
+            self.rtt_flows += weight
+            self.rtt_sum += rtt[1] * weight
+            self.rtt_min = rtt[0] if self.rtt_min is None else min(self.rtt_min, rtt[0])
+            self.rtt_max = rtt[2] if self.rtt_max is None else max(self.rtt_max, rtt[2])
+
+    def to_json_packet(self):
+        """Generate the rollup document."""
+        values = collections.OrderedDict(
+            [
+                ('num_flows', self.flows),
+                ('num_bits', self.bits),
+                ('num_packets', self.packets),
+                ('bits_per_second', round(self.bits / float(self.window), 2)),
+                ('packets_per_second', round(self.packets / float(self.window), 2)),
+                ('rtt_min', self.rtt_min),
+                ('rtt_avg', round(self.rtt_sum / self.rtt_flows, 3) if self.rtt_flows else None),
+                ('rtt_max', self.rtt_max),
+                ('rexmit_rate', float(self.rexmit_pkts) / self.packets if self.packets else 0),
+            ]
+        )
+
+        meta = collections.OrderedDict(self._key_items)
+        meta['sensor_id'] = self._template.sensor_id
+        meta['instance_id'] = self._template.instance_id
+        meta['flow_type'] = self._template.flow_type
+
+        return collections.OrderedDict(
+            [
+                ('type', 'rollup'),
+                ('interval', self.window),
+                ('values', values),
+                ('meta', meta),
+                ('start', self.window_start),
+                ('end', self.window_start + self.window),
+            ]
+        )
+
+    def to_json_string(self):
+        """Return the document serialized to a JSON string."""
+        return json.dumps(self.to_json_packet())
+
+
+class Aggregator(object):
+    """Group capsules into Rollups by key and time window."""
+
+    def __init__(self, config, key=DEFAULT_KEY, window=DEFAULT_WINDOW,
+                 max_groups=DEFAULT_MAX_GROUPS):
+        self._config = config
+        self._key = tuple(key)
+        self._window = window
+        self._max_groups = max_groups
+        # window start -> {key: Rollup}
+        self._windows = dict()
+        # window start -> the owners (directories) of its flows
+        self._owners = dict()
+        self._groups = 0
+        self._watermark = 0
+        self.flows_in = 0
+        self.records_out = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an Aggregator from the [aggregate] config stanza. Returns
+        None if the stanza is not present."""
+        if 'aggregate' not in config.config.sections():
+            return None
+
+        opts = config.get_aggregate_opts()
+
+        key = tuple(x.strip() for x in opts.get('key', ', '.join(DEFAULT_KEY)).split(',')
+                    if x.strip())
+        bad = [x for x in key if x not in KEY_FIELDS]
+        if bad or not key:
+            raise TstatConfigException(
+                '[aggregate] key fields must be some of: {0}'.format(', '.join(KEY_FIELDS)))
+
+        try:
+            window = int(opts.get('window', DEFAULT_WINDOW))
+            max_groups = int(opts.get('max_groups', DEFAULT_MAX_GROUPS))
+        except ValueError:
+            raise TstatConfigException('[aggregate] window and max_groups must be integers')
+
+        if window <= 0 or max_groups <= 0:
+            raise TstatConfigException('[aggregate] window and max_groups must be positive')
+
+        return cls(config, key=key, window=window, max_groups=max_groups)
+
+    def _key_items(self, capsule):
+        meta = capsule.meta_map()
+        meta['protocol'] = capsule.protocol
+        meta['direction'] = capsule.direction
+        return tuple((x, meta.get(x)) for x in self._key)
+
+    def add(self, capsules, owner=None):
+        """Add a list of capsules, from the directory owner. Returns a list
+        of the Rollups for any windows that were closed as a result."""
+        for capsule in capsules:
+            self.flows_in += 1
+
+            window_start = capsule.start - capsule.start % self._window
+            groups = self._windows.setdefault(window_start, dict())
+            if owner is not None:
+                self._owners.setdefault(window_start, set()).add(owner)
+            key_items = self._key_items(capsule)
+
+            # the flows of each log type are rolled up apart
+            group = (capsule.FLOW_TYPE, key_items)
+            rollup = groups.get(group)
+            if rollup is None:
+                rollup = Rollup(key_items, window_start, self._window, document_template(
+                    capsule.protocol, capsule.direction, self._config, capsule.FLOW_TYPE))
+                groups[group] = rollup
+                self._groups += 1
+
+            rollup.add(capsule)
+            self._watermark = max(self._watermark, capsule.end)
+
+        ret = list()
+
+        # close the windows that flows are no longer expected for
+        for i in sorted(self._windows.keys()):
+            if i + self._window * 2 <= self._watermark:
+                ret += self._flush_window(i)
+
+        # and the oldest ones if we are holding too many groups
+        while self._groups > self._max_groups:
+            ret += self._flush_window(min(self._windows.keys()))
+
+        return ret
+
+    def _flush_window(self, window_start):
+        groups = self._windows.pop(window_start)
+        self._owners.pop(window_start, None)
+        self._groups -= len(groups)
+        self.records_out += len(groups)
+        return list(groups.values())
+
+    def flush(self):
+        """Close all of the open windows and return their Rollups."""
+        ret = list()
+        for i in sorted(self._windows.keys()):
+            ret += self._flush_window(i)
+        return ret
+
+    def held(self):
+        """The owners with flows in the windows that are still open."""
+        return set().union(*self._owners.values())
+
+    def stats(self):
+        """Return a summary of the aggregation."""
+        return 'aggregation: {i} flows in, {o} rollups out, {g} open groups'.format(
+            i=self.flows_in, o=self.records_out, g=self._groups)
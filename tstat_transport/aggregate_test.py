@@ -0,0 +1,113 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.aggregate import Aggregator
+from tstat_transport.common import ConfigurationCapsule, TstatParseException
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+def _config(directory='test_data', window=None):
+    ns = argparse.Namespace(verbose=False, transport='rabbit', directory=directory,
+                            debug=False, no_transport=True, sensor='SensorName',
+                            instance='instanceID', threshold=0)
+    config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+    if window is not None:
+        config.config.add_section('aggregate')
+        config.config.set('aggregate', 'window', window)
+    return config
+
+
+class FailingParse(TstatParse):
+    """A TstatParse whose sends fail once fail is set."""
+    fail = False
+
+    def _xport(self, objs, shard=None):
+        if self.fail:
+            return False, 'broker down'
+        return super(FailingParse, self)._xport(objs, shard)
+
+
+class TestAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.config = _config()
+        self.capsules = list()
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            self.capsules += capsule_factory(row, 'tcp', self.config)
+
+    def test_rollup(self):
+        aggregator = Aggregator(self.config, key=('protocol', 'direction'), window=3600)
+        closed = aggregator.add(self.capsules)
+        rollups = closed + aggregator.flush()
+
+        self.assertEqual(sum(x.flows for x in rollups), len(self.capsules))
+        self.assertEqual(sum(x.bits for x in rollups),
+                         sum(x.num_bits for x in self.capsules))
+
+        doc = rollups[0].to_json_packet()
+        self.assertEqual(doc['type'], 'rollup')
+        self.assertEqual(doc['end'] - doc['start'], 3600)
+        self.assertEqual(set(doc['meta'].keys()),
+                         set(['protocol', 'direction', 'sensor_id', 'instance_id', 'flow_type']))
+        self.assertTrue(doc['values']['rtt_min'] <= doc['values']['rtt_avg'] <= doc['values']['rtt_max'])
+
+    def test_bounded_groups(self):
+        aggregator = Aggregator(self.config, key=('src_ip', 'src_port', 'direction'),
+                                window=3600, max_groups=4)
+        closed = aggregator.add(self.capsules)
+        self.assertTrue(len(closed) > 0)
+        self.assertTrue(aggregator._groups <= 4)
+        rollups = closed + aggregator.flush()
+        self.assertEqual(sum(x.flows for x in rollups), len(self.capsules))
+
+    def test_held_directories(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        paths = [os.path.join(root, x) for x in ('a.out', 'b.out')]
+        for path in paths:
+            shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        config = _config(root, window='600')
+
+        def marked():
+            return [os.path.exists(os.path.join(x, TstatParse.COMPLETED)) for x in paths]
+
+        # the second directory fails to send, and the windows still open
+        # with the flows of the first are lost - so it is not marked either
+        parser = FailingParse(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.process_output(paths[0], [], os.listdir(paths[0]))
+            parser.fail = True
+            with self.assertRaises(TstatParseException):
+                parser.process_output(paths[1], [], os.listdir(paths[1]))
+        self.assertEqual(marked(), [False, False])
+
+        # both are marked once their windows have been sent
+        parser = TstatParse(config)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            for path in paths:
+                parser.process_output(path, [], os.listdir(path))
+            self.assertEqual(marked(), [False, False])
+            parser.finish()
+        self.assertEqual(marked(), [True, True])
+
+        docs = [x for i in out.getvalue().splitlines() for x in json.loads(i)]
+        self.assertEqual(sum(x['values']['num_flows'] for x in docs), len(self.capsules) * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+IPv4/IPv6 prefix filtering of flows.
+
+The include and exclude prefix lists from the optional [filter] config
+stanza are compiled once into a radix tree per address family. Each
+endpoint address is looked up by longest prefix match, so lookup cost
+depends on the address length and not on the number of prefixes, and a
+more specific prefix overrides a less specific one (e.g. include a /24
+out of an excluded /16).
+"""
+
+import functools
+import socket
+
+from .common import TstatConfigException
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+
+LOOKUP_CACHE_SIZE = 65536
+
+_FAMILIES = (
+    (socket.AF_INET, 32),
+    (socket.AF_INET6, 128),
+)
+
+
+def _parse_addr(addr):
+    """Return (family, bits, int value) for an address string, or None
+    if it is not a valid address."""
+    for family, bits in _FAMILIES:
+        try:
+            return family, bits, int.from_bytes(socket.inet_pton(family, addr), 'big')
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class RadixTree(object):
+    """
+    Binary radix tree mapping prefixes of a single address family to a
+    label. Nodes are [child_0, child_1, label] lists.
+    """
+
+    def __init__(self, bits):
+        self._bits = bits
+        self._root = [None, None, None]
+        self.prefixes = 0
+
+    def insert(self, value, length, label):
+        """Insert the prefix value/length."""
+        node = self._root
+        for i in range(length):
+            bit = (value >> (self._bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.prefixes += 1
+        node[2] = label
+
+    def lookup(self, value):
+        """Return the label of the longest prefix matching value, or
+        None if no prefix matches."""
+        node = self._root
+        label = node[2]
+        shift = self._bits - 1
+        while node is not None:
+            if node[2] is not None:
+                label = node[2]
+            if shift < 0:
+                break
+            node = node[(value >> shift) & 1]
+            shift -= 1
+        return label
+
+
+class PrefixFilter(object):
+    """
+    Decide if a flow should be exported based on its endpoint addresses.
+
+    A flow is dropped if either endpoint's longest matching prefix is an
+    exclude prefix. If there are any include prefixes, a flow is only
+    kept if at least one endpoint's longest matching prefix is an include
+    prefix.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self._trees = dict((family, RadixTree(bits)) for family, bits in _FAMILIES)
+        self._has_include = False
+
+        for label, prefixes in ((EXCLUDE, exclude), (INCLUDE, include)):
+            for i in prefixes:
+                self.add(i, label)
+
+        self.lookup = functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._lookup)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a filter from the [filter] config stanza. Returns None if
+        there are no prefixes configured."""
+        opts = config.get_filter_opts()
+
+        include = _split_prefixes(opts.get('include', ''))
+        exclude = _split_prefixes(opts.get('exclude', ''))
+
+        for key, target in (('include_file', include), ('exclude_file', exclude)):
+            if opts.get(key):
+                target.extend(_read_prefix_file(opts.get(key)))
+
+        if not include and not exclude:
+            return None
+
+        return cls(include, exclude)
+
+    def add(self, prefix, label):
+        """Add a prefix in CIDR notation with an INCLUDE or EXCLUDE label."""
+        addr, _, length = prefix.strip().partition('/')
+        parsed = _parse_addr(addr)
+
+        if parsed is None:
+            raise TstatConfigException('invalid prefix: {0}'.format(prefix))
+
+        family, bits, value = parsed
+
+        try:
+            length = int(length) if length else bits
+        except ValueError:
+            raise TstatConfigException('invalid prefix length: {0}'.format(prefix))
+
+        if not 0 <= length <= bits:
+            raise TstatConfigException('invalid prefix length: {0}'.format(prefix))
+
+        # mask off any host bits
+        value &= ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+
+        self._trees[family].insert(value, length, label)
+
+        if label == INCLUDE:
+            self._has_include = True
+
+    def _lookup(self, addr):
+        """Return the label for an address string. Wrapped in an lru_cache
+        since sensors see the same endpoints over and over."""
+        parsed = _parse_addr(addr)
+        if parsed is None:
+            return None
+        family, _, value = parsed
+        return self._trees[family].lookup(value)
+
+    def keep(self, c_ip, s_ip):
+        """Should the flow between c_ip and s_ip be exported?"""
+        c_label = self.lookup(c_ip)
+        s_label = self.lookup(s_ip)
+
+        if c_label == EXCLUDE or s_label == EXCLUDE:
+            return False
+
+        if self._has_include:
+            return c_label == INCLUDE or s_label == INCLUDE
+
+        return True
+
+    @property
+    def prefixes(self):
+        """Number of prefixes loaded."""
+        return sum(x.prefixes for x in self._trees.values())
+
+
+def _split_prefixes(value):
+    """Split a comma and/or whitespace separated list of prefixes."""
+    return [x for x in value.replace(',', ' ').split() if x]
+
+
+def _read_prefix_file(path):
+    """Read a file of prefixes - one or more per line, # comments."""
+    ret = list()
+    try:
+        with open(path, 'r') as fh:
+            for line in fh:
+                ret.extend(_split_prefixes(line.split('#')[0]))
+    except (IOError, OSError) as ex:
+        raise TstatConfigException('unable to read prefix file {0}: {1}'.format(path, str(ex)))
+    return ret
@@ -0,0 +1,45 @@
+import unittest
+
+from tstat_transport.cidr import EXCLUDE, INCLUDE, PrefixFilter
+from tstat_transport.common import TstatConfigException
+
+
+class TestPrefixFilter(unittest.TestCase):
+
+    def test_longest_prefix_match(self):
+        pfilter = PrefixFilter(include=['10.1.0.0/16', '2001:db8:1::/48'],
+                               exclude=['10.0.0.0/8', '10.1.2.3', '2001:db8::/32'])
+        self.assertEqual(pfilter.prefixes, 5)
+        self.assertEqual(pfilter.lookup('10.2.0.1'), EXCLUDE)
+        self.assertEqual(pfilter.lookup('10.1.9.9'), INCLUDE)
+        self.assertEqual(pfilter.lookup('10.1.2.3'), EXCLUDE)
+        self.assertEqual(pfilter.lookup('2001:db8:1::5'), INCLUDE)
+        self.assertEqual(pfilter.lookup('2001:db8:2::5'), EXCLUDE)
+        self.assertIsNone(pfilter.lookup('192.168.1.1'))
+        self.assertIsNone(pfilter.lookup('not-an-ip'))
+
+    def test_keep(self):
+        pfilter = PrefixFilter(include=['198.128.0.0/14'], exclude=['198.129.77.0/24'])
+        self.assertTrue(pfilter.keep('198.128.14.246', '8.8.8.8'))
+        self.assertTrue(pfilter.keep('8.8.8.8', '198.128.14.246'))
+        self.assertFalse(pfilter.keep('8.8.8.8', '1.1.1.1'))
+        self.assertFalse(pfilter.keep('198.128.14.246', '198.129.77.102'))
+
+        exclude_only = PrefixFilter(exclude=['192.168.0.0/16'])
+        self.assertTrue(exclude_only.keep('8.8.8.8', '1.1.1.1'))
+        self.assertFalse(exclude_only.keep('192.168.65.3', '1.1.1.1'))
+
+    def test_host_bits_and_default_route(self):
+        pfilter = PrefixFilter(exclude=['0.0.0.0/0'], include=['10.1.2.99/24'])
+        self.assertEqual(pfilter.lookup('10.1.2.1'), INCLUDE)
+        self.assertEqual(pfilter.lookup('11.1.2.1'), EXCLUDE)
+
+    def test_invalid_prefix(self):
+        with self.assertRaises(TstatConfigException):
+            PrefixFilter(include=['10.0.0.0/33'])
+        with self.assertRaises(TstatConfigException):
+            PrefixFilter(exclude=['bogus/8'])
+
+
+if __name__ == '__main__':
+    unittest.main()
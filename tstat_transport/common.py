@@ -2,10 +2,11 @@
 Custom superclasses, exceptions and common code for tstat_trasport package.
 """
 import configparser
+import copy
 import os
 from configparser import ConfigParser
 
-from .util import valid_hostname, log
+from .util import split_endpoints, valid_hostname, log
 
 PROTOCOLS = ('tcp', 'udp')
 
@@ -29,15 +30,16 @@ class TstatBase(object):  # pylint: disable=too-few-public-methods
         """Return the underlying logger."""
         return self._config.log
 
-    def _verbose_log(self, event, msg):
-        """Log events if running in verbose mode."""
+    def _verbose_log(self, event, msg, **fields):
+        """Log events if running in verbose mode. With fields, msg is a
+        template that is not rendered unless it is logged."""
         if self._options.verbose:
-            self._log(event, msg)
+            self._log(event, msg, **fields)
 
-    def _debug_log(self, event, msg):
+    def _debug_log(self, event, msg, **fields):
         """Log events if running in debug mode."""
         if self._options.debug:
-            self._log(event, msg)
+            self._log(event, msg, **fields)
 
 
 class TstatConfigException(Exception):
@@ -110,19 +112,32 @@ class ConfigurationCapsule(object):
                 t=self.options.transport)
             raise TstatConfigException(msg)
 
-        # is the hostname valid?
-        if not valid_hostname(self.get_cfg_val('host')):
-            msg = '{h} is not a valid hostname'.format(h=self.get_cfg_val('host'))
-            raise TstatConfigException(msg)
-
         # is the port an integer?
         try:
-            self.get_cfg_val('port', as_int=True)
+            port = self.get_cfg_val('port', as_int=True)
         except TstatConfigException:
             msg = 'port {0} is not a valid integer'.format(
                 self._config.get(self.options.transport, 'port'))
             raise TstatConfigException(msg)
 
+        # host can be a comma separated list of host[:port] brokers - are
+        # the hostnames valid?
+        try:
+            endpoints = split_endpoints(self.get_cfg_val('host'), port)
+        except ValueError:
+            msg = 'host {0} contains a port that is not a valid integer'.format(
+                self.get_cfg_val('host'))
+            raise TstatConfigException(msg)
+
+        if not endpoints:
+            raise TstatConfigException('"host" is empty in [{t}] config stanza'.format(
+                t=self.options.transport))
+
+        for host, _ in endpoints:
+            if not valid_hostname(host):
+                msg = '{h} is not a valid hostname'.format(h=host)
+                raise TstatConfigException(msg)
+
     # pylint: disable=missing-docstring
 
     def get_cfg_val(self, value, as_int=False, as_bool=False):
@@ -137,7 +152,7 @@ class ConfigurationCapsule(object):
                 return self._config.getboolean(self.options.transport, value)
             else:
                 return self._config.get(self.options.transport, value)
-        except ConfigParser.NoOptionError:
+        except (configparser.NoOptionError, configparser.NoSectionError):
             msg = '{0} config value not found'.format(value)
             raise TstatConfigException(msg)
         except ValueError:
@@ -166,6 +181,51 @@ class ConfigurationCapsule(object):
             return None
         return self._config_stanza_to_dict('ssl_options')
 
+    def get_filter_opts(self):
+        return self._config_stanza_to_dict('filter')
+
+    def get_enrich_opts(self):
+        return self._config_stanza_to_dict('enrich')
+
+    def get_aggregate_opts(self):
+        return self._config_stanza_to_dict('aggregate')
+
+    def get_heavy_hitters_opts(self):
+        return self._config_stanza_to_dict('heavy_hitters')
+
+    def get_dedup_opts(self):
+        return self._config_stanza_to_dict('dedup')
+
+    def get_rate_limit_opts(self):
+        return self._config_stanza_to_dict('rate_limit')
+
+    def get_lease_opts(self):
+        return self._config_stanza_to_dict('lease')
+
+    def get_projection_opts(self):
+        return self._config_stanza_to_dict('projection')
+
+    def get_export_opts(self):
+        return self._config_stanza_to_dict('export')
+
+    def get_quarantine_opts(self):
+        return self._config_stanza_to_dict('quarantine')
+
+    def get_logging_opts(self):
+        return self._config_stanza_to_dict('logging')
+
+    def get_logs_opts(self):
+        return self._config_stanza_to_dict('logs')
+
+    def get_summary_opts(self):
+        return self._config_stanza_to_dict('summary')
+
+    def get_cache_opts(self):
+        return self._config_stanza_to_dict('cache')
+
+    def get_sample_opts(self):
+        return self._config_stanza_to_dict('sample')
+
     # Some rabbit specific option calls to pass addional kwargs to
     # pika methods.
 
@@ -178,6 +238,19 @@ class ConfigurationCapsule(object):
     def options(self):
         return self._options
 
+    def for_root(self, directory, sensor=None, instance=None):
+        """Return a copy of the capsule for another tstat output root
+        (see tstat_send --root), with its own directory and, if given,
+        sensor and instance ids. The parsed config is shared."""
+        ret = copy.copy(self)
+        ret._options = copy.copy(self._options)  # pylint: disable=protected-access
+        ret.options.directory = directory
+        if sensor is not None:
+            ret.options.sensor = sensor
+        if instance is not None:
+            ret.options.instance = instance
+        return ret
+
     @property
     def log(self):
         return self._log
@@ -0,0 +1,269 @@
+"""
+Code to cull processed tstat output directories for tstat_cull - both by
+age and to bring disk usage back under a budget.
+
+Sizes of processed directories are kept in a persistent index so that
+the logs in every directory do not need to be stat'ed on every run.
+"""
+
+import concurrent.futures
+import datetime
+import json
+import os
+import re
+import shutil
+import time
+
+from .common import TstatParseException
+from .reader import LogReader, find_log
+from .util import _log
+
+STATE_FILE = '.processed'  # see TstatParse.COMPLETED
+INDEX_FILE = '.tstat_cull_index'
+
+# 2016_02_17_12_53.out
+_ISO_NAME = re.compile(r'(\d{4})_(\d{2})_(\d{2})_(\d{2})_(\d{2})')
+# 12_53_17_Feb_2016.out - tstat's own naming
+_TSTAT_NAME = re.compile(r'(\d{2})_(\d{2})_(\d{2})_([A-Za-z]{3})_(\d{4})')
+
+# the column with the first packet time (epoch ms) per log type
+FIRST_COLUMNS = (('tcp', 'first'), ('udp', 'c_first_abs'))
+
+
+class OutputDir(object):  # pylint: disable=too-few-public-methods
+    """A tstat output directory that is a candidate for removal."""
+
+    def __init__(self, path, processed, stamp, size):
+        self.path = path
+        self.processed = processed
+        # mtime of the state file if processed, otherwise the directory.
+        self.stamp = stamp
+        self.size = size
+
+    def __repr__(self):
+        return 'OutputDir({0}, processed={1}, size={2})'.format(
+            self.path, self.processed, self.size)
+
+
+def find_output_dirs(root):
+    """Generator of the paths of the .out directories under root. Does
+    not descend into the .out directories themselves."""
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+
+    for i in entries:
+        if not i.is_dir(follow_symlinks=False):
+            continue
+        if i.name.endswith('.out'):
+            yield os.path.abspath(i.path)
+        else:
+            for j in find_output_dirs(i.path):
+                yield j
+
+
+def dir_timestamp(path):
+    """Return the start time of an output directory in epoch seconds -
+    from the directory name if it is timestamped, otherwise from the
+    first flow in its logs. None if it can not be determined."""
+    name = os.path.basename(path)
+
+    match = _ISO_NAME.search(name)
+    if match:
+        return time.mktime(datetime.datetime(*[int(x) for x in match.groups()]).timetuple())
+
+    match = _TSTAT_NAME.search(name)
+    if match:
+        try:
+            return time.mktime(datetime.datetime.strptime(
+                ' '.join(match.groups()), '%H %M %d %b %Y').timetuple())
+        except ValueError:
+            pass
+
+    try:
+        files = os.listdir(path)
+    except OSError:
+        return None
+
+    for log_type, column in FIRST_COLUMNS:
+        name = find_log(files, 'log_{0}_complete'.format(log_type))
+        if name is None:
+            continue
+        try:
+            for row in LogReader(os.path.join(path, name), log_type, (column,)):
+                return row[column] / 1000.0
+        except TstatParseException:
+            continue
+
+    return None
+
+
+def dir_size(path):
+    """Disk space used by the files in a directory, in bytes."""
+    total = 0
+    for i in os.scandir(path):
+        try:
+            stat = i.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        total += stat.st_blocks * 512
+    return total
+
+
+class SizeIndex(object):
+    """
+    Persistent index of the sizes of processed directories, keyed on the
+    path and invalidated if the mtime of the directory or the state file
+    changes. Stored as JSON in the root of the tstat tree.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = dict()
+        self._seen = set()
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            with open(self._path, 'r') as fh:
+                self._entries = json.load(fh)
+        except (IOError, OSError, ValueError):
+            self._entries = dict()
+
+    def size(self, path, key):
+        """Return the size of a directory, from the index if the key
+        matches, otherwise by stat'ing the files in it."""
+        self._seen.add(path)
+        entry = self._entries.get(path)
+
+        if entry is not None and entry[0] == list(key):
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        size = dir_size(path)
+        self._entries[path] = [list(key), size]
+        return size
+
+    def forget(self, path):
+        """Drop a removed directory from the index."""
+        self._entries.pop(path, None)
+
+    def save(self):
+        """Write the index back out, dropping directories that no longer
+        exist. Written to a temp file and renamed into place."""
+        entries = dict((k, v) for k, v in self._entries.items() if k in self._seen)
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(entries, fh)
+        os.rename(tmp, self._path)
+
+
+def scan(root, index):
+    """Return a list of OutputDirs for all of the .out directories under
+    root, oldest first."""
+    ret = list()
+
+    for path in find_output_dirs(root):
+        try:
+            dir_mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+
+        try:
+            state_mtime = os.stat(os.path.join(path, STATE_FILE)).st_mtime
+        except OSError:
+            state_mtime = None
+
+        if state_mtime is None:
+            # still being written or waiting to be sent - don't cache.
+            ret.append(OutputDir(path, False, dir_mtime, dir_size(path)))
+        else:
+            size = index.size(path, (dir_mtime, state_mtime))
+            ret.append(OutputDir(path, True, state_mtime, size))
+
+    ret.sort(key=lambda x: x.stamp)
+
+    return ret
+
+
+def select_by_ttl(dirs, ttl, now=None):
+    """Return the processed directories whose state file is older than
+    ttl hours."""
+    now = now if now is not None else time.time()
+    return [x for x in dirs if x.processed and now - x.stamp >= ttl * 3600]
+
+
+def select_by_budget(dirs, to_free, include_unprocessed=False):
+    """
+    Return the oldest directories that need to be removed to free to_free
+    bytes. Unprocessed directories are only considered if
+    include_unprocessed is set, and the newest unprocessed directory
+    (presumably the one tstat is writing to) is never selected.
+    """
+    candidates = [x for x in dirs if x.processed]
+
+    if include_unprocessed:
+        unprocessed = [x for x in dirs if not x.processed]
+        candidates = sorted(candidates + unprocessed[:-1], key=lambda x: x.stamp)
+
+    ret = list()
+    freed = 0
+
+    for i in candidates:
+        if freed >= to_free:
+            break
+        ret.append(i)
+        freed += i.size
+
+    return ret
+
+
+def bytes_over_budget(root, dirs, max_size=None, max_usage=None):
+    """
+    Return how many bytes need to be freed to get the tree under max_size
+    bytes, and the filesystem under max_usage percent used - whichever
+    is larger.
+    """
+    over = 0
+
+    if max_size is not None:
+        over = max(over, sum(x.size for x in dirs) - max_size)
+
+    if max_usage is not None:
+        usage = shutil.disk_usage(root)
+        over = max(over, usage.used - int(usage.total * max_usage / 100.0))
+
+    return over
+
+
+def remove_dirs(dirs, workers=4, dry=False, index=None):
+    """Remove the directories with a pool of worker threads. Returns the
+    number of bytes freed."""
+
+    if dry:
+        for i in dirs:
+            _log('cull.remove', 'dry run, not removing {d}'.format(d=i.path))
+        return 0
+
+    def _remove(out_dir):
+        _log('cull.remove', 'removing {d}'.format(d=out_dir.path))
+        shutil.rmtree(out_dir.path)
+        return out_dir
+
+    freed = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_remove, x) for x in dirs]
+        for i in concurrent.futures.as_completed(futures):
+            try:
+                out_dir = i.result()
+            except OSError as ex:
+                _log('cull.remove.error', 'unable to remove: {0}'.format(str(ex)))
+                continue
+            freed += out_dir.size
+            if index is not None:
+                index.forget(out_dir.path)
+
+    return freed
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tstat_transport.cull import (
+    INDEX_FILE,
+    STATE_FILE,
+    SizeIndex,
+    remove_dirs,
+    scan,
+    select_by_budget,
+    select_by_ttl,
+)
+
+
+class TestCullMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        now = time.time()
+        # four processed directories an hour apart, and one still being written
+        for i in range(5):
+            path = os.path.join(self.root, '2020_06_11_1{0}_00.out'.format(i))
+            os.mkdir(path)
+            with open(os.path.join(path, 'log_tcp_complete'), 'wb') as fh:
+                fh.write(b'x' * 8192)
+            if i < 4:
+                state = os.path.join(path, STATE_FILE)
+                with open(state, 'w') as fh:
+                    fh.write('processed')
+                os.utime(state, (now - (5 - i) * 3600, now - (5 - i) * 3600))
+        self.index_path = os.path.join(self.root, INDEX_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_scan_and_index(self):
+        index = SizeIndex(self.index_path)
+        dirs = scan(self.root, index)
+        self.assertEqual(len(dirs), 5)
+        self.assertEqual([x.processed for x in dirs], [True] * 4 + [False])
+        self.assertEqual(index.misses, 4)
+        index.save()
+
+        index = SizeIndex(self.index_path)
+        self.assertEqual([x.size for x in scan(self.root, index)], [x.size for x in dirs])
+        self.assertEqual(index.hits, 4)
+        self.assertEqual(index.misses, 0)
+
+    def test_ttl(self):
+        dirs = scan(self.root, SizeIndex(self.index_path))
+        expired = select_by_ttl(dirs, 3)
+        self.assertEqual([os.path.basename(x.path) for x in expired],
+                         ['2020_06_11_10_00.out', '2020_06_11_11_00.out',
+                          '2020_06_11_12_00.out'])
+
+    def test_budget(self):
+        dirs = scan(self.root, SizeIndex(self.index_path))
+        size = dirs[0].size
+
+        selected = select_by_budget(dirs, size * 2)
+        self.assertEqual(selected, dirs[:2])
+
+        # never more than the processed directories...
+        self.assertEqual(select_by_budget(dirs, size * 100), dirs[:4])
+        # ...and never the newest unprocessed one
+        self.assertEqual(select_by_budget(dirs, size * 100, include_unprocessed=True),
+                         dirs[:4])
+
+    def test_remove(self):
+        index = SizeIndex(self.index_path)
+        dirs = scan(self.root, index)
+        freed = remove_dirs(dirs[:3], workers=2, index=index)
+        self.assertEqual(freed, sum(x.size for x in dirs[:3]))
+        self.assertEqual(len(scan(self.root, index)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+"""
+Optional index of flows that have already been sent, so that retries
+after a partial transport failure, or a directory being reprocessed, do
+not publish the same flows again.
+
+A flow is identified by its fingerprint - the 5-tuple, the first packet
+time and the direction. Fingerprints are kept in Bloom filters, one per
+time bucket of the first packet time, persisted to disk. Buckets older
+than the retention period (relative to the newest flow seen) expire, so
+disk and memory use are bounded. Configured with the optional [dedup]
+stanza:
+
+    [dedup]
+    path = /var/lib/tstat_transport/dedup
+    # flows per bucket and the target false positive rate at that size
+    capacity = 100000
+    error_rate = 0.001
+    # bucket size in seconds and retention in hours
+    bucket = 3600
+    retention = 48
+
+A false positive means a flow that has not been sent is skipped, so
+error_rate should be kept low. The estimated rate is reported.
+"""
+
+import hashlib
+import math
+import os
+import struct
+
+from .common import TstatConfigException
+
+_COUNT = struct.Struct('!Q')
+
+
+class BloomFilter(object):
+    """Fixed size Bloom filter using double hashing of a blake2b digest."""
+
+    def __init__(self, bits, hashes, data=None, count=0):
+        self.bits = bits
+        self.hashes = hashes
+        self.count = count
+        self._array = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        """Size a filter for capacity items at error_rate."""
+        bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        for i in self._positions(key):
+            if not self._array[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        """Add a key."""
+        for i in self._positions(key):
+            self._array[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def error_rate(self):
+        """Estimated false positive rate at the current fill."""
+        return (1 - math.exp(-self.hashes * self.count / float(self.bits))) ** self.hashes
+
+    def to_bytes(self):
+        return _COUNT.pack(self.count) + bytes(self._array)
+
+    @classmethod
+    def from_bytes(cls, bits, hashes, data):
+        """Load a filter written by to_bytes(). Returns None if it was
+        written with a different size."""
+        if len(data) != _COUNT.size + (bits + 7) // 8:
+            return None
+        return cls(bits, hashes, data[_COUNT.size:], _COUNT.unpack(data[:_COUNT.size])[0])
+
+
+class DedupIndex(object):
+    """Time bucketed, persistent Bloom filter index of sent flows."""
+
+    def __init__(self, path, capacity=100000, error_rate=0.001, bucket=3600, retention=48):
+        self._path = path
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bucket = bucket
+        self._retention = retention * 3600
+
+        template = BloomFilter.for_capacity(capacity, error_rate)
+        self._bits = template.bits
+        self._hashes = template.hashes
+
+        # bucket start -> BloomFilter
+        self._filters = dict()
+        # bucket starts with no file on disk, until add() creates them
+        self._absent = set()
+        self._dirty = set()
+        self._newest = 0
+
+        self.checked = 0
+        self.duplicates = 0
+
+        try:
+            os.makedirs(self._path, exist_ok=True)
+        except OSError as ex:
+            raise TstatConfigException('unable to create dedup path {0}: {1}'.format(
+                self._path, str(ex)))
+
+        for i in os.listdir(self._path):
+            if i.endswith('.bloom'):
+                try:
+                    self._newest = max(self._newest, int(i[:-6]))
+                except ValueError:
+                    continue
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a DedupIndex from the [dedup] config stanza. Returns None
+        if the stanza is not present."""
+        opts = config.get_dedup_opts()
+
+        if not opts.get('path'):
+            return None
+
+        try:
+            return cls(
+                opts.get('path'),
+                capacity=int(opts.get('capacity', 100000)),
+                error_rate=float(opts.get('error_rate', 0.001)),
+                bucket=int(opts.get('bucket', 3600)),
+                retention=int(opts.get('retention', 48)),
+            )
+        except ValueError:
+            raise TstatConfigException('[dedup] capacity, error_rate, bucket and retention '
+                                       'must be numeric')
+
+    def _file(self, bucket_start):
+        return os.path.join(self._path, '{0}.bloom'.format(bucket_start))
+
+    def _expired(self, bucket_start):
+        return bucket_start + self._bucket <= self._newest - self._retention
+
+    def _filter(self, first, create=False):
+        """Return the filter for the bucket a first packet time (in
+        ms) falls in, loading it from disk if need be. A bucket that is
+        not on disk is only looked for once."""
+        seconds = int(first / 1000)
+        bucket_start = seconds - seconds % self._bucket
+
+        if self._expired(bucket_start):
+            return None
+
+        bloom = self._filters.get(bucket_start)
+        if bloom is not None:
+            return bloom
+
+        bloom = None
+        if bucket_start not in self._absent:
+            try:
+                with open(self._file(bucket_start), 'rb') as fh:
+                    bloom = BloomFilter.from_bytes(self._bits, self._hashes, fh.read())
+            except (IOError, OSError):
+                pass
+
+        if bloom is None:
+            if not create:
+                self._absent.add(bucket_start)
+                return None
+            bloom = BloomFilter(self._bits, self._hashes)
+
+        self._absent.discard(bucket_start)
+        self._filters[bucket_start] = bloom
+        return bloom
+
+    def seen(self, capsule):
+        """Has the flow in the capsule already been sent?"""
+        self.checked += 1
+        bloom = self._filter(capsule.first)
+        if bloom is not None and capsule.fingerprint in bloom:
+            self.duplicates += 1
+            return True
+        return False
+
+    def add(self, capsules):
+        """Record capsules that have been sent. Anything without a
+        fingerprint (rollups etc) is ignored."""
+        for capsule in capsules:
+            fingerprint = getattr(capsule, 'fingerprint', None)
+            if fingerprint is None:
+                continue
+            bloom = self._filter(capsule.first, create=True)
+            if bloom is None:  # older than the retention period
+                continue
+            bloom.add(fingerprint)
+            seconds = int(capsule.first / 1000)
+            bucket_start = seconds - seconds % self._bucket
+            self._dirty.add(bucket_start)
+            self._newest = max(self._newest, bucket_start)
+
+    def save(self):
+        """Write the changed buckets to disk and expire old ones, both on
+        disk and in memory."""
+        for i in self._dirty:
+            bloom = self._filters.get(i)
+            if bloom is None:
+                continue
+            tmp = self._file(i) + '.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(bloom.to_bytes())
+            os.rename(tmp, self._file(i))
+        self._dirty = set()
+
+        for i in list(self._filters.keys()):
+            if self._expired(i):
+                del self._filters[i]
+        self._absent = set(x for x in self._absent if not self._expired(x))
+
+        for i in os.listdir(self._path):
+            try:
+                bucket_start = int(i[:-6]) if i.endswith('.bloom') else None
+            except ValueError:
+                continue
+            if bucket_start is not None and self._expired(bucket_start):
+                os.remove(os.path.join(self._path, i))
+
+    def error_rate(self):
+        """Highest estimated false positive rate of the loaded buckets."""
+        return max([x.error_rate() for x in self._filters.values()] or [0.0])
+
+    def stats(self):
+        """Return a summary."""
+        return 'dedup: {c} checked, {d} duplicates, {b} buckets loaded, ' \
+               'estimated false positive rate {e:.6f}'.format(
+                   c=self.checked, d=self.duplicates, b=len(self._filters),
+                   e=self.error_rate())
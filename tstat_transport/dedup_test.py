@@ -0,0 +1,101 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule
+from tstat_transport.dedup import BloomFilter, DedupIndex
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.reader import LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+TCP_LOG = 'test_data/parse_data.out/log_tcp_complete'
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory='test_data',
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        self.config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        self.rows = list(LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS))
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def __capsules__(self, dedup):
+        capsules = list()
+        for row in self.rows:
+            capsules += capsule_factory(row, 'tcp', self.config, dedup=dedup)
+        return capsules
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertTrue(all(str(i) in bloom for i in range(1000)))
+        false_positives = sum(1 for i in range(1000, 11000) if str(i) in bloom)
+        self.assertTrue(false_positives < 300)
+        self.assertAlmostEqual(bloom.error_rate(), 0.01, delta=0.005)
+
+        copy = BloomFilter.from_bytes(bloom.bits, bloom.hashes, bloom.to_bytes())
+        self.assertEqual(copy.count, 1000)
+        self.assertTrue('999' in copy)
+
+    def test_duplicates_skipped_across_runs(self):
+        dedup = DedupIndex(self.path, capacity=1000)
+        capsules = self.__capsules__(dedup)
+        self.assertTrue(len(capsules) > 0)
+
+        # only half of them made it out before a failure
+        sent = capsules[:len(capsules) // 2]
+        dedup.add(sent)
+        dedup.save()
+
+        dedup = DedupIndex(self.path, capacity=1000)
+        retry = self.__capsules__(dedup)
+        self.assertEqual(len(retry), len(capsules) - len(sent))
+        self.assertEqual(dedup.duplicates, len(sent))
+        self.assertEqual(set(x.fingerprint for x in retry),
+                         set(x.fingerprint for x in capsules[len(sent):]))
+
+    def test_expiry(self):
+        dedup = DedupIndex(self.path, capacity=1000, bucket=60, retention=1)
+        capsules = self.__capsules__(dedup)
+        dedup.add(capsules)
+
+        class Newer(object):
+            first = capsules[0].first + 3 * 3600 * 1000
+            fingerprint = 'newer'
+
+        dedup.add([Newer()])
+        dedup.save()
+
+        self.assertEqual(len(os.listdir(self.path)), 1)
+        self.assertEqual(len(self.__capsules__(DedupIndex(self.path, capacity=1000))),
+                         len(capsules))
+
+    def test_absent_buckets(self):
+        dedup = DedupIndex(self.path, capacity=1000)
+        capsules = self.__capsules__(dedup)
+        self.assertEqual(dedup.duplicates, 0)
+
+        # the buckets with no file are remembered rather than opened per flow
+        absent = set(dedup._absent)
+        self.assertTrue(absent)
+        self.assertEqual(dedup._filters, dict())
+
+        # until a flow is added to them
+        dedup.add(capsules)
+        self.assertEqual(dedup._absent, set())
+        self.assertEqual(len(self.__capsules__(dedup)), 0)
+        dedup.save()
+        self.assertEqual(len(os.listdir(self.path)), len(absent))
+
+
+if __name__ == '__main__':
+    unittest.main()
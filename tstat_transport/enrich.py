@@ -0,0 +1,127 @@
+"""
+Offline ASN/organization/country enrichment of the meta stanza.
+
+Lookups are done against local MaxMind format (.mmdb) database files
+opened in memory-mapped mode, so no network access is needed. Sensors see
+the same endpoints over and over, so the results are kept in a bounded
+LRU cache - already encoded to JSON - and the hit rate is reported.
+
+Configured with the optional [enrich] stanza:
+
+    [enrich]
+    asn_db = /usr/share/GeoIP/GeoLite2-ASN.mmdb
+    geo_db = /usr/share/GeoIP/GeoLite2-Country.mmdb
+    cache_size = 65536
+
+Requires the optional maxminddb module.
+"""
+
+import functools
+import json
+
+from .common import TstatConfigException
+
+CACHE_SIZE = 65536
+
+_encode = json.JSONEncoder().encode  # pylint: disable=invalid-name
+
+
+def open_database(path):
+    """Open a .mmdb database file memory-mapped."""
+    try:
+        import maxminddb  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise TstatConfigException(
+            'the maxminddb module is required for the [enrich] stanza')
+
+    try:
+        return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+    except (IOError, OSError, ValueError) as ex:
+        raise TstatConfigException('unable to open {0}: {1}'.format(path, str(ex)))
+
+
+class Enricher(object):
+    """
+    Look up the ASN, organization and country of an address.
+
+    asn_db and geo_db are objects with a get(address) method returning
+    the record dict, or None - i.e.: maxminddb.Reader instances.
+    """
+
+    def __init__(self, asn_db=None, geo_db=None, cache_size=CACHE_SIZE):
+        self._asn_db = asn_db
+        self._geo_db = geo_db
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build an Enricher from the [enrich] config stanza. Returns None
+        if no database files are configured."""
+        opts = config.get_enrich_opts()
+
+        if not opts.get('asn_db') and not opts.get('geo_db'):
+            return None
+
+        try:
+            cache_size = int(opts.get('cache_size', CACHE_SIZE))
+        except ValueError:
+            raise TstatConfigException('[enrich] cache_size must be an integer')
+
+        return cls(
+            asn_db=open_database(opts.get('asn_db')) if opts.get('asn_db') else None,
+            geo_db=open_database(opts.get('geo_db')) if opts.get('geo_db') else None,
+            cache_size=cache_size,
+        )
+
+    def _record(self, addr):
+        """Return the (key, value) pairs for an address."""
+        ret = list()
+
+        if self._asn_db is not None:
+            rec = self._safe_get(self._asn_db, addr) or dict()
+            ret.append(('asn', rec.get('autonomous_system_number')))
+            ret.append(('organization', rec.get('autonomous_system_organization')))
+
+        if self._geo_db is not None:
+            rec = self._safe_get(self._geo_db, addr) or dict()
+            ret.append(('country_code', (rec.get('country') or dict()).get('iso_code')))
+
+        return tuple(ret)
+
+    @staticmethod
+    def _safe_get(database, addr):
+        try:
+            return database.get(addr)
+        except ValueError:  # not a valid address
+            return None
+
+    def _lookup(self, addr):
+        """Return the pairs for an address plus the pre-encoded JSON meta
+        fragments for it as a source and as a destination."""
+        pairs = self._record(addr)
+        fragments = dict()
+
+        for side in ('src', 'dst'):
+            fragments[side] = ''.join(
+                ', "{s}_{k}": {v}'.format(s=side, k=k, v=_encode(v)) for k, v in pairs)
+
+        return pairs, fragments
+
+    def meta_items(self, src_ip, dst_ip):
+        """The enrichment fields for the meta stanza as (key, value) pairs."""
+        ret = [('src_' + k, v) for k, v in self.lookup(src_ip)[0]]
+        ret += [('dst_' + k, v) for k, v in self.lookup(dst_ip)[0]]
+        return ret
+
+    def meta_json(self, src_ip, dst_ip):
+        """The enrichment fields as a JSON fragment to splice into the
+        meta stanza."""
+        return self.lookup(src_ip)[1]['src'] + self.lookup(dst_ip)[1]['dst']
+
+    def stats(self):
+        """Return a summary of the lookup cache."""
+        info = self.lookup.cache_info()
+        total = info.hits + info.misses
+        return 'enrichment cache: {h} hits, {m} misses, {r:.1%} hit rate, {c} cached'.format(
+            h=info.hits, m=info.misses, r=float(info.hits) / total if total else 0.0,
+            c=info.currsize)
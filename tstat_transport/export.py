@@ -0,0 +1,257 @@
+"""
+Optional columnar export of the flows for bulk loading.
+
+The flows that pass the threshold (and filter/projection) are written, as
+well as being sent, with the same fields as the JSON documents -
+flattened to one column per values/meta field plus start, end and
+sample_rate (empty unless the flow was sampled - see sample). Rows
+are buffered per log type up to batch_rows, converted to a typed Arrow
+record batch and appended to a Parquet file, so memory use is bounded.
+Files are rolled by size or age. Configured with the optional [export]
+stanza:
+
+    [export]
+    path = /var/lib/tstat_transport/export
+    # parquet (the default) or json
+    format = parquet
+    # none, snappy, gzip, zstd, ... (for json only gzip)
+    compression = zstd
+    batch_rows = 10000
+    # roll to a new file at this size in MB or age in seconds
+    max_file_size = 256
+    max_file_age = 3600
+
+Parquet needs the optional pyarrow module. If it is not installed, a
+warning is logged and newline delimited JSON files are written instead.
+"""
+
+import gzip
+import os
+import time
+
+from .common import TstatConfigException
+from .schema import FLOAT, INT, STR
+
+FORMATS = ('parquet', 'json')
+
+# meta/top level columns that are not strings - the values columns have
+# the types of the format.Fields of the capsule
+_INT_COLUMNS = ('interval', 'src_port', 'dst_port', 'src_asn', 'dst_asn', 'start', 'end',
+                'sample_rate')
+
+
+def _load_pyarrow():
+    """Return the pyarrow module with pyarrow.parquet loaded, or None."""
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def flatten(doc):
+    """Flatten a flow document to (column, value) pairs."""
+    ret = [('type', doc.get('type')), ('interval', doc.get('interval'))]
+    ret += list(doc.get('values', dict()).items())
+    ret += list(doc.get('meta', dict()).items())
+    ret += [('start', doc.get('start')), ('end', doc.get('end')),
+            ('sample_rate', doc.get('sample_rate'))]
+    return ret
+
+
+def column_types(capsule, doc):
+    """The schema type of each column of flatten(doc) - for the values the
+    type of the format.Field of the capsule."""
+    fields = dict((x.name, x.type) for x in capsule.VALUE_FIELDS)
+    values = doc.get('values', dict())
+    ret = list()
+    for i, (name, _) in enumerate(flatten(doc)):
+        # the values follow type and interval
+        if 2 <= i < 2 + len(values):
+            ret.append(fields[name])
+        else:
+            ret.append(INT if name in _INT_COLUMNS else STR)
+    return ret
+
+
+def _cast(value, kind):
+    if value is None:
+        return None
+    if kind == INT:
+        return int(value)
+    if kind == FLOAT:
+        return float(value)
+    return str(value)
+
+
+class _Output(object):  # pylint: disable=too-few-public-methods
+    """The open file and row buffer of one log type."""
+
+    def __init__(self):
+        self.columns = None
+        self.types = None
+        self.rows = list()
+        self.writer = None
+        self.path = None
+        self.opened = 0
+
+
+class ColumnarExport(object):  # pylint: disable=too-many-instance-attributes
+    """Write capsules to rolling Parquet (or JSON) files per log type."""
+
+    def __init__(self, path, fmt='parquet', compression=None, batch_rows=10000,
+                 max_file_size=256, max_file_age=3600, log=None, clock=time.time):
+        self._path = path
+        self._compression = compression
+        self._batch_rows = batch_rows
+        self._max_bytes = max_file_size * 1000000
+        self._max_age = max_file_age
+        self._log = log
+        self._clock = clock
+        self._pa = _load_pyarrow() if fmt == 'parquet' else None
+
+        if fmt == 'parquet' and self._pa is None:
+            if log is not None:
+                log('export.init', 'pyarrow is not installed - exporting json instead of parquet')
+            fmt = 'json'
+
+        self.format = fmt
+        self._outputs = dict()
+        self._seq = 0
+        self.rows = 0
+        self.files = 0
+        self.bytes = 0
+
+        try:
+            os.makedirs(self._path, exist_ok=True)
+        except OSError as ex:
+            raise TstatConfigException('unable to create export path {0}: {1}'.format(
+                self._path, str(ex)))
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a ColumnarExport from the [export] config stanza. Returns
+        None if no path is set."""
+        opts = config.get_export_opts()
+
+        if not opts.get('path'):
+            return None
+
+        fmt = opts.get('format', 'parquet').strip()
+        if fmt not in FORMATS:
+            raise TstatConfigException('[export] format must be one of: {0}'.format(
+                ', '.join(FORMATS)))
+
+        compression = opts.get('compression', '').strip() or None
+        if compression == 'none':
+            compression = None
+
+        try:
+            batch_rows = int(opts.get('batch_rows', 10000))
+            max_file_size = float(opts.get('max_file_size', 256))
+            max_file_age = float(opts.get('max_file_age', 3600))
+        except ValueError:
+            raise TstatConfigException(
+                '[export] batch_rows, max_file_size and max_file_age must be numeric')
+
+        if batch_rows <= 0 or max_file_size <= 0 or max_file_age <= 0:
+            raise TstatConfigException(
+                '[export] batch_rows, max_file_size and max_file_age must be positive')
+
+        return cls(opts.get('path'), fmt=fmt, compression=compression, batch_rows=batch_rows,
+                   max_file_size=max_file_size, max_file_age=max_file_age, log=config.log)
+
+    def add(self, capsules):
+        """Buffer capsules, writing out a batch when one fills up."""
+        for capsule in capsules:
+            out = self._outputs.setdefault(capsule.log_type, _Output())
+            doc = capsule.to_json_packet()
+
+            if out.columns is None:
+                out.columns = [x[0] for x in flatten(doc)]
+                out.types = column_types(capsule, doc)
+
+            if self.format == 'json':
+                out.rows.append(capsule.to_json_string())
+            else:
+                out.rows.append(dict(flatten(doc)))
+
+            self.rows += 1
+            if len(out.rows) >= self._batch_rows:
+                self._write(capsule.log_type, out)
+
+    def _file_name(self, log_type):
+        self._seq += 1
+        suffix = '.parquet' if self.format == 'parquet' else '.json'
+        if self.format == 'json' and self._compression == 'gzip':
+            suffix += '.gz'
+        return os.path.join(self._path, '{p}-{t}-{s}-{n}{x}'.format(
+            p=log_type, t=time.strftime('%Y%m%dT%H%M%S', time.gmtime(self._clock())),
+            s=os.getpid(), n=self._seq, x=suffix))
+
+    def _open(self, log_type, out):
+        out.path = self._file_name(log_type)
+        out.opened = self._clock()
+        self.files += 1
+
+        if self.format == 'json':
+            if self._compression == 'gzip':
+                out.writer = gzip.open(out.path + '.tmp', 'wt')
+            else:
+                out.writer = open(out.path + '.tmp', 'w')
+        else:
+            out.writer = self._pa.parquet.ParquetWriter(
+                out.path + '.tmp', self._arrow_schema(out),
+                compression=self._compression or 'none')
+
+    def _arrow_schema(self, out):
+        types = {INT: self._pa.int64(), FLOAT: self._pa.float64(), STR: self._pa.string()}
+        return self._pa.schema([(x, types[t]) for x, t in zip(out.columns, out.types)])
+
+    def _write(self, log_type, out):
+        """Write out the buffered rows of a log type, rolling the file
+        first if it is too big or too old."""
+        if not out.rows:
+            return
+
+        if out.writer is not None and self._clock() - out.opened >= self._max_age:
+            self._close(out)
+
+        if out.writer is None:
+            self._open(log_type, out)
+
+        if self.format == 'json':
+            out.writer.write('\n'.join(out.rows) + '\n')
+            out.writer.flush()
+        else:
+            schema = self._arrow_schema(out)
+            batch = self._pa.RecordBatch.from_arrays(
+                [self._pa.array([_cast(row.get(x), t) for row in out.rows], type=f.type)
+                 for x, t, f in zip(out.columns, out.types, schema)],
+                schema=schema)
+            out.writer.write_table(self._pa.Table.from_batches([batch]))
+
+        out.rows = list()
+
+        if os.path.getsize(out.path + '.tmp') >= self._max_bytes:
+            self._close(out)
+
+    def _close(self, out):
+        """Close a file and move it into place."""
+        out.writer.close()
+        out.writer = None
+        os.rename(out.path + '.tmp', out.path)
+        self.bytes += os.path.getsize(out.path)
+
+    def close(self):
+        """Write out anything that is buffered and close the files."""
+        for log_type, out in self._outputs.items():
+            self._write(log_type, out)
+            if out.writer is not None:
+                self._close(out)
+
+    def stats(self):
+        """Return a summary."""
+        return 'export: {r} rows, {f} {t} files, {b} bytes written'.format(
+            r=self.rows, f=self.files, t=self.format, b=self.bytes)
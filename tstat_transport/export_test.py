@@ -0,0 +1,182 @@
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import (
+    ConfigurationCapsule, TstatConfigException, TstatParseException
+)
+from tstat_transport.export import ColumnarExport, _load_pyarrow, column_types, flatten
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.schema import FLOAT, INT, STR
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+def _config(directory='test_data'):
+    ns = argparse.Namespace(verbose=False, transport='rabbit', directory=directory,
+                            debug=False, no_transport=True, sensor='SensorName',
+                            instance='instanceID', threshold=0)
+    return ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingParse(TstatParse):
+    """A TstatParse whose sends fail once fail is set."""
+    fail = False
+
+    def _xport(self, objs, shard=None):
+        if self.fail:
+            return False, 'broker down'
+        return super(FailingParse, self)._xport(objs, shard)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.config = _config()
+        self.capsules = list()
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            self.capsules += capsule_factory(row, 'tcp', self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def files(self):
+        return sorted(x for x in os.listdir(self.path) if not x.endswith('.tmp'))
+
+    def test_column_types(self):
+        capsule = self.capsules[0]
+        doc = capsule.to_json_packet()
+        types = dict(zip([x[0] for x in flatten(doc)], column_types(capsule, doc)))
+        self.assertEqual(types['num_bits'], INT)
+        self.assertEqual(types['tcp_rexmit_pkts'], INT)
+        self.assertEqual(types['tcp_mss'], INT)
+        self.assertEqual(types['tcp_rexmit_rate'], FLOAT)
+        self.assertEqual(types['tcp_rtt_avg'], FLOAT)
+        self.assertEqual(types['src_port'], INT)
+        self.assertEqual(types['src_ip'], STR)
+        # every values field has the type of its format.Field
+        self.assertEqual([types[x.name] for x in TcpCapsule.VALUE_FIELDS],
+                         [x.type for x in TcpCapsule.VALUE_FIELDS])
+
+    def test_from_config(self):
+        self.assertIsNone(ColumnarExport.from_config(self.config))
+        self.config.config.add_section('export')
+        self.config.config.set('export', 'path', self.path)
+        self.config.config.set('export', 'format', 'json')
+        self.assertEqual(ColumnarExport.from_config(self.config).format, 'json')
+        self.config.config.set('export', 'format', 'csv')
+        with self.assertRaises(TstatConfigException):
+            ColumnarExport.from_config(self.config)
+
+    def test_json_batches_and_roll(self):
+        clock = Clock()
+        export = ColumnarExport(self.path, fmt='json', batch_rows=5, clock=clock)
+
+        export.add(self.capsules[:4])
+        # buffered - nothing written yet
+        self.assertEqual(os.listdir(self.path), [])
+        export.add(self.capsules[4:10])
+        self.assertEqual(len(export._outputs['tcp'].rows), 0)
+
+        # rolled by age
+        clock.now += 3600
+        export.add(self.capsules[10:])
+        export.close()
+
+        files = self.files()
+        self.assertEqual(len(files), 2)
+        lines = list()
+        for name in files:
+            with open(os.path.join(self.path, name)) as fh:
+                lines += fh.read().splitlines()
+        self.assertEqual(lines, [x.to_json_string() for x in self.capsules])
+        self.assertIn('{0} rows, 2 json files'.format(len(self.capsules)), export.stats())
+
+    def test_json_size_roll_gzip(self):
+        export = ColumnarExport(self.path, fmt='json', compression='gzip', batch_rows=10,
+                                max_file_size=0.0001)
+        export.add(self.capsules)
+        export.close()
+
+        files = self.files()
+        self.assertEqual(len(files), -(-len(self.capsules) // 10))
+        self.assertTrue(all(x.endswith('.json.gz') for x in files))
+        with gzip.open(os.path.join(self.path, files[0]), 'rt') as fh:
+            self.assertEqual(json.loads(fh.readline()), self.capsules[0].to_json_packet())
+
+    @unittest.skipIf(_load_pyarrow() is not None, 'pyarrow is installed')
+    def test_fallback(self):
+        self.assertEqual(ColumnarExport(self.path, fmt='parquet').format, 'json')
+
+    @unittest.skipUnless(_load_pyarrow() is not None, 'requires pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        export = ColumnarExport(self.path, compression='snappy', batch_rows=8)
+        export.add(self.capsules)
+        export.close()
+
+        table = pyarrow.parquet.read_table(os.path.join(self.path, self.files()[0]))
+        self.assertEqual(table.num_rows, len(self.capsules))
+        self.assertEqual(str(table.schema.field('num_bits').type), 'int64')
+        self.assertEqual(str(table.schema.field('src_ip').type), 'string')
+        self.assertEqual(table.column('num_bits').to_pylist(),
+                         [x.num_bits for x in self.capsules])
+
+    def test_replay(self):
+        config = _config()
+        config.config.add_section('export')
+        config.config.set('export', 'path', self.path)
+        self.assertIsNotNone(TstatParse(config)._export)
+
+        # the live run exported the flows already
+        config.options.replay = '..'
+        self.assertIsNone(TstatParse(config)._export)
+
+    def test_parser_failure(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        paths = [os.path.join(root, x) for x in ('a.out', 'b.out')]
+        for path in paths:
+            shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        config = _config(root)
+        config.config.add_section('export')
+        config.config.set('export', 'path', self.path)
+        config.config.set('export', 'format', 'json')
+        parser = FailingParse(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.process_output(paths[0], [], os.listdir(paths[0]))
+            parser.fail = True
+            with self.assertRaises(TstatParseException):
+                parser.process_output(paths[1], [], os.listdir(paths[1]))
+        parser.close()
+
+        # only the directory that was sent, and the file is closed
+        self.assertEqual(os.listdir(self.path), self.files())
+        with open(os.path.join(self.path, self.files()[0])) as fh:
+            self.assertEqual(len(fh.read().splitlines()), len(self.capsules))
+
+
+if __name__ == '__main__':
+    unittest.main()
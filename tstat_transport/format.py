@@ -6,13 +6,18 @@ i.e.: when direction is 'in', the source is the client and dest is the dest.
 """
 
 import collections
+import functools
+import json
+import operator
 import socket
-import warnings
 
-import six
+from .reader import BAD_RENDER
+from .schema import FLOAT, INT, SCHEMAS
 
 DIRECTIONS = ('in', 'out')
 
+_encode = json.JSONEncoder().encode  # pylint: disable=invalid-name
+
 
 class TstatFormatException(Exception):
     """Custom TstatFormat exception"""
@@ -30,123 +35,176 @@ class TstatFormatWarning(Warning):
     pass
 
 
-class EntryCapsuleBase(object):
-    """Base for the format capsule classes."""
+class DocumentTemplate(object):  # pylint: disable=too-few-public-methods
+    """
+    The parts of the flow document that are constant for a given
+    protocol/direction during a run, built once and pre-encoded so that
+    rendering a capsule only has to encode the per-flow values.
+    """
 
-    def __init__(self, row, protocol, direction, config):
-        self._row = self._sanitize_row(row)
-        self._protocol = protocol
-        self._direction = direction
-        self._prefixes = {'in': 'c_', 'out': 's_'}
-        self._config = config
+    def __init__(self, protocol, direction, sensor_id, instance_id, flow_type='tstat'):
+        self.protocol = protocol
+        self.direction = direction
+        self.sensor_id = sensor_id
+        self.instance_id = instance_id
+        self.flow_type = flow_type
 
-    @property
-    def header_trim(self):
-        """override in subclass - string to shave from keys from the
-        csv DictReader header."""
-        raise NotImplementedError
+        self.base_items = (
+            ('type', 'flow'),
+            ('interval', 600),
+        )
+        self.meta_items = (
+            ('protocol', protocol),
+            ('sensor_id', sensor_id),
+            ('instance_id', instance_id),
+            ('flow_type', flow_type),
+        )
 
-    def _sanitize_row(self, row):
-        """Remove any jank from the log headers so we have a dict with
-        'pure' key names stripped of garbage and the :nn index part.
+        # {"type": "flow", "interval": 600, "values":
+        self.head = _encode(collections.OrderedDict(self.base_items))[:-1] + ', "values": '
+        # , "protocol": "tcp", ... "flow_type": "tstat"}
+        self.meta_tail = ', ' + _encode(collections.OrderedDict(self.meta_items))[1:]
 
-        The headers start and look like this:
 
-        #15#c_ip:1 c_port:2 c_pkts_all:3
+@functools.lru_cache(maxsize=None)
+def _cached_template(protocol, direction, sensor, instance, flow_type):
+    """Build the DocumentTemplate for a protocol/direction/sensor/instance
+    and flow type."""
+    sensor_id = sensor if sensor is not None else socket.gethostname()
+    instance_id = instance if instance is not None else 0
+    return DocumentTemplate(protocol, direction, sensor_id, instance_id, flow_type)
 
-        If this finds a # character in one of the header keys, it
-        shaves everything before the right-most # character off. It is
-        presumed that this will impact the first c_ip:1 column but I
-        don't want to hard code that.
 
-        Then a split is done on ':' to produce a "pure" key.
+def document_template(protocol, direction, config, flow_type='tstat'):
+    """Return the shared DocumentTemplate for the current run."""
+    return _cached_template(protocol, direction,
+                            config.options.sensor, config.options.instance, flow_type)
 
-        Note that this also modifies the original dict produced by
-        csv.DictReader.
-        """
 
-        for k in list(row.keys()):
+def _both(*names):
+    """Expand names of directional columns to their c_ and s_ variants."""
+    return tuple(p + i for i in names for p in ('c_', 's_'))
 
-            if k.rfind('#') > -1:
-                key = k[k.rfind('#') + 1:]
-            else:
-                key = k
 
-            row[key.split(':')[0]] = row.pop(k)
+# A field of the values stanza - its name, the log columns it reads, a
+# function computing it from a capsule and its schema type. See
+# projection.Projection and export.ColumnarExport.
+Field = collections.namedtuple('Field', ['name', 'columns', 'get', 'type'])
+
+
+def _column_type(column):
+    """The schema type of a log column, from the built in tables."""
+    for types in SCHEMAS.values():
+        if column in types:
+            return types[column]
+    raise KeyError('no schema type for column {0}'.format(column))
+
+
+def _property_field(name, field_type, columns=()):
+    """A field computed by the capsule property of the same name."""
+    return Field(name, columns, operator.attrgetter(name), field_type)
+
+
+def _directional_field(name, column):
+    """A field read from the c_ or s_ column for the direction."""
+    return Field(name, _both(column),
+                 lambda capsule: capsule._directional_key(column),  # pylint: disable=protected-access
+                 _column_type('c_' + column))
+
+
+def _static_field(name, column):
+    """A field read from a column that is the same for both directions."""
+    return Field(name, (column,),
+                 lambda capsule: capsule._static_key(column),  # pylint: disable=protected-access
+                 _column_type(column))
+
+
+def _columns(core, fields):
+    """The core columns plus the ones the fields read, without repeats."""
+    ret = list(core)
+    for field in fields:
+        ret += [x for x in field.columns if x not in ret]
+    return tuple(ret)
+
+
+class EntryCapsuleBase(object):
+    """Base for the format capsule classes.
+
+    The row is a dict of already typed values as produced by
+    schema.LogSchema.convert() - see the COLUMNS class attribute.
+    """
 
-        return row
+    # override in subclass - the log type (see logtypes), the protocol
+    # and flow_type of the meta stanza, the column with the first packet
+    # time of the flow, the columns that are always read (for the meta
+    # stanza, threshold, times, etc), the fields of the values stanza and
+    # all of the log columns the capsule reads.
+    LOG_TYPE = None
+    PROTOCOL = None
+    FLOW_TYPE = 'tstat'
+    FIRST_COLUMN = None
+    CORE_COLUMNS = _both('ip', 'port')
+    VALUE_FIELDS = ()
+    COLUMNS = CORE_COLUMNS
+
+    def __init__(self, row, protocol, direction, config, enricher=None, projection=None):
+        self._row = row
+        self._protocol = protocol
+        self._direction = direction
+        self._prefixes = {'in': 'c_', 'out': 's_'}
+        self._prefix = self._prefixes.get(direction)
+        self._config = config
+        self._template = document_template(protocol, direction, config, self.FLOW_TYPE)
+        self._enricher = enricher
+        self._projection = projection
+        self._json = None
+        # 1 in sample_rate flows under the threshold were sent - see sample
+        self.sample_rate = 1
+
+    @classmethod
+    def flow_key(cls, row):
+        """Stable identifier of the flow (both directions) of a row - the
+        5-tuple and first packet time. See sample.FlowSampler."""
+        # called for every row, so the cheaper % formatting
+        return '%s|%s|%s|%s|%s|%s' % (
+            row.get('c_ip'), row.get('c_port'), row.get('s_ip'), row.get('s_port'),
+            cls.PROTOCOL, row.get(cls.FIRST_COLUMN))
 
     def _directional_key(self, key):
         """
         Returns the proper c_ or s_ variant from the row payload depending
-        on the direction that this instance is going. Casts numeric strings
-        to actual numeric values.
+        on the direction that this instance is going.
         """
-        key = '{d}{k}'.format(d=self._prefixes.get(self._direction), k=key)
-        return self._cast_to_numeric(self._row.get(key))
+        return self._row.get(self._prefix + key)
 
     def _static_key(self, key):
         """
         Return a "non-directional" value from the payload. Used to contrast
-        against _directional_key() and to have one entry point for casting.
-        Casts numeric strings to actual numeric values.
+        against _directional_key().
         """
-        return self._cast_to_numeric(self._row.get(key))
-
-    def _cast_to_numeric(self, val):  # pylint: disable=no-self-use
-        """Take the string values from the logs and attempt to cast them
-        to actual numeric types.
-        """
-
-        if isinstance(val, six.string_types):
-
-            try:
-                return int(val)
-            except ValueError:
-                pass
+        return self._row.get(key)
 
-            try:
-                return round(float(val), 3)
-            except ValueError:
-                pass
-
-            return val
-        else:
-            return val
-
-    def _base_document(self):
+    def _base_document(self, projection=None):
         """Generate the 'outer' structure of the object. Calls other
         methods to generate sub-documents."""
 
-        doc = collections.OrderedDict(
-            [
-                ('type', 'flow'),
-                ('interval', 600),
-                ('values', self._value_doc()),
-                ('meta', self._meta_doc()),
-                ('start', self.start),
-                ('end', self.end),
-            ]
-        )
+        doc = collections.OrderedDict(self._template.base_items)
+        doc['values'] = self._value_doc(projection)
+        doc['meta'] = self._meta_doc(projection)
+        doc['start'] = self.start
+        doc['end'] = self.end
+        if self.sample_rate != 1:
+            doc['sample_rate'] = self.sample_rate
 
         return doc
 
-    def _value_doc(self):
-        """Generate the base/shared value doc.
+    def _value_doc(self, projection=None):
+        """Generate the value doc from the VALUE_FIELDS of the subclass, or
+        just the ones selected by a projection.Projection."""
+        fields = self.VALUE_FIELDS if projection is None else \
+            projection.value_fields(self.LOG_TYPE)
 
-        Override this in the subclass to add in additional fields (ie: tcp logs)
-        """
-        doc = collections.OrderedDict(
-            [
-                ('duration', self.duration),
-                ('num_bits', self.num_bits),
-                ('num_packets', self.num_packets),
-                ('bits_per_second', self.bits_per_second),
-                ('packets_per_second', self.packets_per_second)
-            ]
-        )
-
-        return doc
+        return collections.OrderedDict((x.name, x.get(self)) for x in fields)
 
     def _meta_map(self):
         """
@@ -164,9 +222,10 @@ class EntryCapsuleBase(object):
                 dst_ip=self._static_key('c_ip'), dst_port=self._static_key('c_port'),
             )
 
-    def _meta_doc(self):
+    def _meta_doc(self, projection=None):
         """
-        Generate the meta sub-stanza.
+        Generate the meta sub-stanza, with just the keys selected by a
+        projection.Projection if one is passed.
         """
         meta_vals = self._meta_map()
 
@@ -176,15 +235,62 @@ class EntryCapsuleBase(object):
                 ('src_port', meta_vals.get('src_port')),
                 ('dst_ip', meta_vals.get('dst_ip')),
                 ('dst_port', meta_vals.get('dst_port')),
-                ('protocol', self._protocol),
-                ('sensor_id', self.sensor_id),
-                ('instance_id', self.instance_id),
-                ('flow_type', 'tstat'),
             ]
         )
+        if self._enricher is not None:
+            doc.update(self._enricher.meta_items(
+                meta_vals.get('src_ip'), meta_vals.get('dst_ip')))
+        doc.update(self._template.meta_items)
+
+        if projection is not None and projection.meta_keys(self.LOG_TYPE) is not None:
+            keys = projection.meta_keys(self.LOG_TYPE)
+            doc = collections.OrderedDict((k, v) for k, v in doc.items() if k in keys)
 
         return doc
 
+    def render_json(self, projection=None):
+        """Render the document as a JSON string, splicing the per-flow
+        values into the pre-encoded constant parts of the template. Not
+        cached - see to_json_string()."""
+        if projection is not None and projection.meta_keys(self.LOG_TYPE) is not None:
+            # the constant meta parts are projected too, so no shortcuts
+            return ''.join((
+                self._template.head,
+                _encode(self._value_doc(projection)),
+                ', "meta": ', _encode(self._meta_doc(projection)),
+                ', "start": ', _encode(self.start),
+                ', "end": ', _encode(self.end),
+                self._sample_json(),
+                '}',
+            ))
+
+        meta_vals = self._meta_map()
+
+        enrichment = ''
+        if self._enricher is not None:
+            enrichment = self._enricher.meta_json(
+                meta_vals.get('src_ip'), meta_vals.get('dst_ip'))
+
+        return ''.join((
+            self._template.head,
+            _encode(self._value_doc(projection)),
+            ', "meta": {"src_ip": ', _encode(meta_vals.get('src_ip')),
+            ', "src_port": ', _encode(meta_vals.get('src_port')),
+            ', "dst_ip": ', _encode(meta_vals.get('dst_ip')),
+            ', "dst_port": ', _encode(meta_vals.get('dst_port')),
+            enrichment,
+            self._template.meta_tail,
+            ', "start": ', _encode(self.start),
+            ', "end": ', _encode(self.end),
+            self._sample_json(),
+            '}',
+        ))
+
+    def _sample_json(self):
+        if self.sample_rate == 1:
+            return ''
+        return ', "sample_rate": ' + _encode(self.sample_rate)
+
     # Properties to subclass to handle variants in the fields.
     @property
     def num_bits(self):
@@ -213,77 +319,122 @@ class EntryCapsuleBase(object):
 
     @property
     def sensor_id(self):
-        if self._config.options.sensor is not None:
-            return self._config.options.sensor
-        else:
-            return socket.gethostname()
+        return self._template.sensor_id
 
     @property
     def instance_id(self):
-        if self._config.options.instance is not None:
-            return self._config.options.instance
-        else:
-            return 0
+        return self._template.instance_id
 
     def to_json_packet(self):
         """Public wrapper around document method. Primarily for compatability
         with TsdsParse/the original rendering classes."""
-        return self._base_document()
+        return self._base_document(self._projection)
+
+    def to_json_string(self):
+        """Return the document serialized to a JSON string. The result is
+        cached so the render done by capsule_factory() is reused when the
+        payload is sent."""
+        if self._json is None:
+            self._json = self.render_json(self._projection)
+        return self._json
 
     def rowdict(self):
         """Return the payload dict."""
         return self._row
 
+    def meta_map(self):
+        """Return the src/dst ip and port of the flow."""
+        return self._meta_map()
+
+    @property
+    def protocol(self):
+        """Get protocol."""
+        return self._protocol
+
+    @property
+    def direction(self):
+        """Get direction."""
+        return self._direction
+
+    @property
+    def log_type(self):
+        """Get the log type the capsule was read from."""
+        return self.LOG_TYPE
+
+    @property
+    def rtt(self):
+        """Get (min, avg, max) rtt - None for protocols without it."""
+        return None
+
+    @property
+    def first(self):
+        """override in subclass - get first packet time in ms."""
+        raise NotImplementedError
+
+    @property
+    def fingerprint(self):
+        """Stable identifier of the flow/direction - see dedup.DedupIndex.
+        The log type tells a flow in log_video_complete from the same flow
+        in log_tcp_complete."""
+        return '{c_ip}|{c_port}|{s_ip}|{s_port}|{p}|{d}|{f}'.format(
+            c_ip=self._static_key('c_ip'), c_port=self._static_key('c_port'),
+            s_ip=self._static_key('s_ip'), s_port=self._static_key('s_port'),
+            p=self.LOG_TYPE, d=self._direction, f=self.first)
+
+    @property
+    def rexmit_pkts(self):
+        """Get retransmitted packets - None for protocols without it."""
+        return None
+
 
 class TcpCapsule(EntryCapsuleBase):
     """Capsule for tcp log lines."""
 
-    def _value_doc(self):
-        """Subclass variant to add in the tcp-specific values."""
-        doc = super(TcpCapsule, self)._value_doc()
-        
-        #Calculate retransmit rate if we have both num_packets and restransmits
-        tcp_rexmit_pkts = self._directional_key('pkts_retx')
-        tcp_rexmit_rate = 0
-        if self.num_packets and tcp_rexmit_pkts:
-            tcp_rexmit_rate = float(tcp_rexmit_pkts)/self.num_packets
-        
-        val_doc = collections.OrderedDict(
-            [
-                ('tcp_rexmit_bytes', self._directional_key('bytes_retx')),
-                ('tcp_rexmit_pkts', tcp_rexmit_pkts),
-                ('tcp_rexmit_rate', tcp_rexmit_rate),
-                ('tcp_syn_cnt', self._directional_key('syn_cnt')),
-                ('tcp_rtt_avg', self._directional_key('rtt_avg')),
-                ('tcp_rtt_min', self._directional_key('rtt_min')),
-                ('tcp_rtt_max', self._directional_key('rtt_max')),
-                ('tcp_rtt_std', self._directional_key('rtt_std')),
-                ('tcp_pkts_rto', self._directional_key('pkts_rto')),
-                ('tcp_pkts_fs', self._directional_key('pkts_fs')),
-                ('tcp_pkts_reor', self._directional_key('pkts_reor')),
-                ('tcp_pkts_dup', self._directional_key('pkts_dup')),
-                ('tcp_pkts_unk', self._directional_key('pkts_unk')),
-                ('tcp_pkts_fc', self._directional_key('pkts_fc')),
-                ('tcp_pkts_unrto', self._directional_key('pkts_unrto')),
-                ('tcp_pkts_unfs', self._directional_key('pkts_unfs')),
-                ('tcp_cwin_min', self._directional_key('cwin_min')),
-                ('tcp_cwin_max', self._directional_key('cwin_max')),
-                ('tcp_out_seq_pkts', self._directional_key('pkts_ooo')),
-                ('tcp_window_scale', self._directional_key('win_scl')),
-                ('tcp_mss', self.tcp_mss),
-                ('tcp_max_seg_size', self._directional_key('mss_max')),
-                ('tcp_min_seg_size', self._directional_key('mss_min')),
-                ('tcp_win_max', self._directional_key('cwin_max')),
-                ('tcp_win_min', self._directional_key('cwin_min')),
-                ('tcp_initial_cwin', self._directional_key('cwin_ini')),
-                ('tcp_sack_cnt', self.sack_cnt),
-            ]
-        )
-
-        for k, v in list(val_doc.items()):
-            doc.update({k: v})
+    LOG_TYPE = 'tcp'
+    PROTOCOL = 'tcp'
+    FIRST_COLUMN = 'first'
+
+    CORE_COLUMNS = EntryCapsuleBase.CORE_COLUMNS + _both(
+        'bytes_uniq', 'pkts_data', 'pkts_retx', 'rtt_avg', 'rtt_min', 'rtt_max',
+    ) + ('first', 'last', 'durat')
+
+    VALUE_FIELDS = (
+        _property_field('duration', FLOAT),
+        _property_field('num_bits', INT),
+        _property_field('num_packets', INT),
+        _property_field('bits_per_second', FLOAT),
+        _property_field('packets_per_second', FLOAT),
+        _directional_field('tcp_rexmit_bytes', 'bytes_retx'),
+        _directional_field('tcp_rexmit_pkts', 'pkts_retx'),
+        _property_field('tcp_rexmit_rate', FLOAT),
+        _directional_field('tcp_syn_cnt', 'syn_cnt'),
+        _directional_field('tcp_rtt_avg', 'rtt_avg'),
+        _directional_field('tcp_rtt_min', 'rtt_min'),
+        _directional_field('tcp_rtt_max', 'rtt_max'),
+        _directional_field('tcp_rtt_std', 'rtt_std'),
+        _directional_field('tcp_pkts_rto', 'pkts_rto'),
+        _directional_field('tcp_pkts_fs', 'pkts_fs'),
+        _directional_field('tcp_pkts_reor', 'pkts_reor'),
+        _directional_field('tcp_pkts_dup', 'pkts_dup'),
+        _directional_field('tcp_pkts_unk', 'pkts_unk'),
+        _directional_field('tcp_pkts_fc', 'pkts_fc'),
+        _directional_field('tcp_pkts_unrto', 'pkts_unrto'),
+        _directional_field('tcp_pkts_unfs', 'pkts_unfs'),
+        _directional_field('tcp_cwin_min', 'cwin_min'),
+        _directional_field('tcp_cwin_max', 'cwin_max'),
+        _directional_field('tcp_out_seq_pkts', 'pkts_ooo'),
+        _directional_field('tcp_window_scale', 'win_scl'),
+        _property_field('tcp_mss', INT, _both('mss')),
+        _directional_field('tcp_max_seg_size', 'mss_max'),
+        _directional_field('tcp_min_seg_size', 'mss_min'),
+        # same columns as tcp_cwin_max/min - kept for existing consumers
+        _directional_field('tcp_win_max', 'cwin_max'),
+        _directional_field('tcp_win_min', 'cwin_min'),
+        _directional_field('tcp_initial_cwin', 'cwin_ini'),
+        Field('tcp_sack_cnt', _both('sack_cnt'), operator.attrgetter('sack_cnt'), INT),
+    )
 
-        return doc
+    COLUMNS = _columns(CORE_COLUMNS, VALUE_FIELDS)
 
     @property
     def duration(self):
@@ -310,6 +461,11 @@ class TcpCapsule(EntryCapsuleBase):
         """Get packets_per_second."""
         return (round(self._directional_key('pkts_data') / (self._static_key('durat') / 1000), 2)) if self._static_key('durat') != 0 else 0
 
+    @property
+    def first(self):
+        """Get first packet time in ms."""
+        return self._static_key('first')
+
     @property
     def start(self):
         """Get start."""
@@ -320,6 +476,24 @@ class TcpCapsule(EntryCapsuleBase):
         """Get end."""
         return int(self._static_key('last') / 1000)
 
+    @property
+    def rtt(self):
+        """Get (min, avg, max) rtt."""
+        return (self._directional_key('rtt_min'), self._directional_key('rtt_avg'),
+                self._directional_key('rtt_max'))
+
+    @property
+    def rexmit_pkts(self):
+        """Get retransmitted packets."""
+        return self._directional_key('pkts_retx')
+
+    @property
+    def tcp_rexmit_rate(self):
+        """Retransmit rate if we have both num_packets and retransmits."""
+        if self.num_packets and self.rexmit_pkts:
+            return float(self.rexmit_pkts) / self.num_packets
+        return 0
+
     @property
     def tcp_mss(self):
         """get the correct mss from the c_ and s_ values"""
@@ -342,6 +516,23 @@ class TcpCapsule(EntryCapsuleBase):
 class UdpCapsule(EntryCapsuleBase):
     """Capsule for udp log lines."""
 
+    LOG_TYPE = 'udp'
+    PROTOCOL = 'udp'
+    FIRST_COLUMN = 'c_first_abs'
+
+    CORE_COLUMNS = EntryCapsuleBase.CORE_COLUMNS + _both(
+        'bytes_all', 'pkts_all', 'durat', 'first_abs')
+
+    VALUE_FIELDS = (
+        _property_field('duration', FLOAT),
+        _property_field('num_bits', INT),
+        _property_field('num_packets', INT),
+        _property_field('bits_per_second', FLOAT),
+        _property_field('packets_per_second', FLOAT),
+    )
+
+    COLUMNS = _columns(CORE_COLUMNS, VALUE_FIELDS)
+
     @property
     def duration(self):
         """get duration."""
@@ -367,6 +558,11 @@ class UdpCapsule(EntryCapsuleBase):
         """Get packets_per_second."""
         return (round(self._directional_key('pkts_all') / (self._directional_key('durat') / 1000), 2)) if self._directional_key('durat') != 0 else 0
 
+    @property
+    def first(self):
+        """Get first packet time in ms."""
+        return self._directional_key('first_abs')
+
     @property
     def start(self):
         """Get start."""
@@ -378,35 +574,121 @@ class UdpCapsule(EntryCapsuleBase):
         return int(self.start + self.duration)
 
 
-def capsule_factory(row, protocol, config):
-    """Process both directions of the log row for a given protocol.
+class VideoCapsule(TcpCapsule):
+    """Capsule for log_video_complete lines - tcp flows carrying video,
+    with the tcp columns and the video ones."""
 
-    Will return a list of 0, 1 or 2 objects.
-    """
+    LOG_TYPE = 'video'
+    FLOW_TYPE = 'tstat_video'
 
-    capsule_map = dict(
-        tcp=TcpCapsule,
-        udp=UdpCapsule,
+    VALUE_FIELDS = TcpCapsule.VALUE_FIELDS + (
+        _static_field('video_duration', 'vd_dur'),
+        _static_field('video_rate', 'vd_rate_tot'),
+        _static_field('video_width', 'vd_width'),
+        _static_field('video_height', 'vd_height'),
     )
 
+    COLUMNS = _columns(TcpCapsule.CORE_COLUMNS, VALUE_FIELDS)
+
+
+class TcpNoCompleteCapsule(TcpCapsule):
+    """Capsule for log_tcp_nocomplete lines - tcp flows that were not
+    closed properly. The log only has the core tcp columns, so there is
+    no rtt or window data."""
+
+    LOG_TYPE = 'tcp_nocomplete'
+    FLOW_TYPE = 'tstat_nocomplete'
+
+    CORE_COLUMNS = EntryCapsuleBase.CORE_COLUMNS + _both(
+        'bytes_uniq', 'pkts_data', 'pkts_retx') + ('first', 'last', 'durat')
+
+    VALUE_FIELDS = (
+        _property_field('duration', FLOAT),
+        _property_field('num_bits', INT),
+        _property_field('num_packets', INT),
+        _property_field('bits_per_second', FLOAT),
+        _property_field('packets_per_second', FLOAT),
+        _directional_field('tcp_rexmit_bytes', 'bytes_retx'),
+        _directional_field('tcp_rexmit_pkts', 'pkts_retx'),
+        _property_field('tcp_rexmit_rate', FLOAT),
+        _directional_field('tcp_syn_cnt', 'syn_cnt'),
+        _directional_field('tcp_out_seq_pkts', 'pkts_ooo'),
+    )
+
+    COLUMNS = _columns(CORE_COLUMNS, VALUE_FIELDS)
+
+    @property
+    def rtt(self):
+        """No rtt in the log."""
+        return None
+
+
+# log type -> capsule class, see logtypes.register()
+CAPSULE_MAP = dict(
+    tcp=TcpCapsule,
+    udp=UdpCapsule,
+    video=VideoCapsule,
+    tcp_nocomplete=TcpNoCompleteCapsule,
+)
+
+
+def capsule_factory(row, log_type, config, enricher=None, dedup=None, projection=None,
+                    bad_row=None, summary=None, sampler=None):
+    """Process both directions of the (typed) log row for a given log type.
+    If an enrich.Enricher is passed, the meta stanza is enriched with it.
+    If a dedup.DedupIndex is passed, flows that have already been sent are
+    skipped before they are rendered. If a projection.Projection is passed,
+    only the fields it selects are rendered.
+
+    A row that fails to render is passed once to bad_row(reason, detail)
+    if it is given (ie: to quarantine it), otherwise it is logged. If a
+    summary.DirectorySummary is passed, both directions are counted in it
+    whether or not they pass the threshold. If a sample.FlowSampler is
+    passed, the directions under the threshold of the rows it picks are
+    returned too, with their sample_rate set.
+
+    Will return a list of 0, 1 or 2 objects.
+    """
+
     ret = list()
+    reported = False
+    capsule_class = CAPSULE_MAP.get(log_type)
+    sampled = sampler is not None and sampler.keep(capsule_class.flow_key(row))
 
     for i in DIRECTIONS:
-        capsule = capsule_map.get(protocol)(row, protocol, i, config)
+        capsule = capsule_class(row, capsule_class.PROTOCOL, i, config, enricher, projection)
 
         try:
+            if summary is not None:
+                summary.add(capsule)
+
+            if capsule.num_bits < (config.options.threshold * 8000000):  # MB -> bits
+                if not sampled:
+                    continue
+                capsule.sample_rate = sampler.rate
+
+            if dedup is not None and dedup.seen(capsule):
+                continue
+
             # Render the whole payload to catch malformed log
             # entries. Example: a log with a duplicate header line in it
             # which will cause division errors etc etc etc.
-            capsule.to_json_packet()
+            capsule.to_json_string()
         except TypeError as ex:
-            msg = 'Unable to render capsule with TypeError/payload: {t} {p}'.format(
-                t=str(ex), p=capsule.rowdict())
-            warnings.warn(msg, TstatFormatWarning, stacklevel=2)
-            config.log('capsule_factory.warn', msg)
+            if reported:
+                continue
+            reported = True
+            if bad_row is not None:
+                bad_row(BAD_RENDER, 'TypeError: {0}'.format(str(ex)))
+            else:
+                config.log('capsule_factory.warn',
+                           'Unable to render capsule with TypeError/payload: {t} {p}'.format(
+                               t=str(ex), p=capsule.rowdict()))
             continue
 
-        if capsule.num_bits >= (config.options.threshold * 8000000):  # MB -> bits
-            ret.append(capsule)
+        if capsule.sample_rate != 1:
+            sampler.flows += 1
+
+        ret.append(capsule)
 
     return ret
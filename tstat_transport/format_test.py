@@ -0,0 +1,79 @@
+import argparse
+import csv
+import json
+import unittest
+
+from tstat_transport.common import (
+    ConfigurationCapsule
+)
+from tstat_transport.util import _log
+
+from tstat_transport.enrich import Enricher
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.schema import LogSchema
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+TCP_LOG = 'test_data/parse_data.out/log_tcp_complete'
+
+
+class TestFormatMethods(unittest.TestCase):
+
+    def __load__config__(self, **kwargs):
+        opts = dict(verbose=False, transport='rabbit', directory='test_data', debug=False,
+                    no_transport=True, sensor='SensorName', instance='instanceID',
+                    threshold=0)
+        opts.update(kwargs)
+        ns = argparse.Namespace(**opts)
+        return ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+
+    def __capsules__(self, config, enricher=None):
+        capsules = list()
+        with open(TCP_LOG, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter=' ', quoting=csv.QUOTE_NONE)
+            schema = LogSchema('tcp', next(reader), TcpCapsule.COLUMNS)
+            for values in reader:
+                capsules += capsule_factory(schema.convert(values), 'tcp', config, enricher)
+        return capsules
+
+    def test_json_string_matches_document(self):
+        capsules = self.__capsules__(self.__load__config__())
+        self.assertTrue(len(capsules) > 0)
+        for capsule in capsules:
+            rendered = json.loads(capsule.to_json_string())
+            self.assertEqual(rendered, json.loads(json.dumps(capsule.to_json_packet())))
+            self.assertEqual(list(rendered.keys()),
+                             ['type', 'interval', 'values', 'meta', 'start', 'end'])
+
+    def test_template_constants(self):
+        capsule = self.__capsules__(self.__load__config__())[0]
+        meta = json.loads(capsule.to_json_string())['meta']
+        self.assertEqual(meta['sensor_id'], 'SensorName')
+        self.assertEqual(meta['instance_id'], 'instanceID')
+        self.assertEqual(meta['protocol'], 'tcp')
+        self.assertEqual(meta['flow_type'], 'tstat')
+
+    def test_enrichment(self):
+        asn_db = {'192.168.65.3': {'autonomous_system_number': 64512,
+                                   'autonomous_system_organization': 'Test Org'}}
+        geo_db = {'192.168.65.3': {'country': {'iso_code': 'US'}}}
+        enricher = Enricher(asn_db=asn_db, geo_db=geo_db)
+
+        capsules = self.__capsules__(self.__load__config__(), enricher)
+        for capsule in capsules:
+            rendered = json.loads(capsule.to_json_string())
+            self.assertEqual(rendered, json.loads(json.dumps(capsule.to_json_packet())))
+
+        meta = json.loads(capsules[0].to_json_string())['meta']
+        side = 'src' if meta['src_ip'] == '192.168.65.3' else 'dst'
+        other = 'dst' if side == 'src' else 'src'
+        self.assertEqual(meta[side + '_asn'], 64512)
+        self.assertEqual(meta[side + '_organization'], 'Test Org')
+        self.assertEqual(meta[side + '_country_code'], 'US')
+        self.assertIsNone(meta[other + '_asn'])
+
+        info = enricher.lookup.cache_info()
+        self.assertTrue(info.hits > info.misses)
+
+
+if __name__ == '__main__':
+    unittest.main()
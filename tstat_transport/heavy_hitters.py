@@ -0,0 +1,241 @@
+"""
+Optional heavy-hitter mode: only export the top N flows.
+
+The flows that pass the threshold are ranked by num_bits or by
+bits_per_second, and only the top N per directory (or per time window)
+are exported, along with a "remainder" record per flow type summing up
+the rest. The threshold is applied by format.capsule_factory as the rows
+are read, before this stage sees them, so the ranking and the remainder
+only cover the flows over the threshold (plus any sampled ones - see
+sample) - the remainder is not the total of the flows under the top N.
+summary.Summarizer counts every flow. Each directory/window holds a fixed size heap, so memory use
+and the number of messages per sensor are predictable. Configured with
+the optional [heavy_hitters] stanza:
+
+    [heavy_hitters]
+    count = 100
+    by = bits
+    # 0 for per directory, otherwise a window in seconds
+    window = 0
+
+A window is flushed once flows ending more than one window past it have
+been seen, and no more than MAX_WINDOWS are held open - the oldest are
+flushed early beyond that. As with [aggregate], the directories with
+flows in an open window are held() and not marked .processed until it
+has been sent.
+"""
+
+import collections
+import heapq
+import itertools
+import json
+
+from .common import TstatConfigException
+from .format import document_template
+
+RANK_BY = ('bits', 'rate')
+
+# the most windows held open at once
+MAX_WINDOWS = 4
+
+
+class Remainder(object):
+    """Summary of the flows over the threshold that did not make the top N."""
+
+    def __init__(self, config, count, rank_by, window):
+        self._config = config
+        self._count = count
+        self._rank_by = rank_by
+        self._window = window
+        self._template = None
+        self.flows = 0
+        self.bits = 0
+        self.packets = 0
+        self.start = None
+        self.end = None
+
+    def add(self, capsule):
+        """Add a capsule to the remainder. A sampled flow (see sample) is
+        counted sample_rate times."""
+        if self._template is None:
+            self._template = document_template(
+                capsule.protocol, capsule.direction, self._config, capsule.FLOW_TYPE)
+        weight = capsule.sample_rate
+        self.flows += weight
+        self.bits += (capsule.num_bits or 0) * weight
+        self.packets += (capsule.num_packets or 0) * weight
+        self.start = capsule.start if self.start is None else min(self.start, capsule.start)
+        self.end = capsule.end if self.end is None else max(self.end, capsule.end)
+
+    def to_json_packet(self):
+        """Generate the remainder document."""
+        return collections.OrderedDict(
+            [
+                ('type', 'remainder'),
+                ('interval', self._window or 600),
+                ('values', collections.OrderedDict(
+                    [
+                        ('num_flows', self.flows),
+                        ('num_bits', self.bits),
+                        ('num_packets', self.packets),
+                    ]
+                )),
+                ('meta', collections.OrderedDict(
+                    [
+                        ('top_n', self._count),
+                        ('ranked_by', self._rank_by),
+                        ('sensor_id', self._template.sensor_id),
+                        ('instance_id', self._template.instance_id),
+                        ('flow_type', self._template.flow_type),
+                    ]
+                )),
+                ('start', self.start),
+                ('end', self.end),
+            ]
+        )
+
+    def to_json_string(self):
+        """Return the document serialized to a JSON string."""
+        return json.dumps(self.to_json_packet())
+
+
+class _TopN(object):  # pylint: disable=too-few-public-methods
+    """Fixed size min-heap of the top N capsules plus a remainder per
+    flow type."""
+
+    def __init__(self, config, count, rank_by, window):
+        self._config = config
+        self._count = count
+        self._rank_by = rank_by
+        self._window = window
+        self._heap = list()
+        self._seq = itertools.count()
+        # flow type -> Remainder
+        self.remainders = dict()
+
+    def push(self, score, capsule):
+        entry = (score, next(self._seq), capsule)
+        if len(self._heap) < self._count:
+            heapq.heappush(self._heap, entry)
+            return
+        if entry > self._heap[0]:
+            entry = heapq.heapreplace(self._heap, entry)
+
+        dropped = entry[2]
+        remainder = self.remainders.get(dropped.FLOW_TYPE)
+        if remainder is None:
+            remainder = self.remainders[dropped.FLOW_TYPE] = Remainder(
+                self._config, self._count, self._rank_by, self._window)
+        remainder.add(dropped)
+
+    def records(self):
+        """The top N capsules, largest first, and a remainder for each
+        flow type that flows were dropped from."""
+        return [x[2] for x in sorted(self._heap, reverse=True)] + \
+            list(self.remainders.values())
+
+
+class HeavyHitters(object):
+    """Keep the top N capsules per directory or per time window."""
+
+    def __init__(self, config, count=100, rank_by='bits', window=0, max_windows=MAX_WINDOWS):
+        self._config = config
+        self._count = count
+        self._rank_by = rank_by
+        self._window = window
+        self._max_windows = max_windows
+        # window start (or None for per directory) -> _TopN
+        self._windows = dict()
+        # window start -> the owners (directories) of its flows
+        self._owners = dict()
+        self._watermark = 0
+        self.flows_in = 0
+        self.records_out = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a HeavyHitters from the [heavy_hitters] config stanza.
+        Returns None if the stanza is not present."""
+        if 'heavy_hitters' not in config.config.sections():
+            return None
+
+        opts = config.get_heavy_hitters_opts()
+
+        try:
+            count = int(opts.get('count', 100))
+            window = int(opts.get('window', 0))
+        except ValueError:
+            raise TstatConfigException('[heavy_hitters] count and window must be integers')
+
+        rank_by = opts.get('by', 'bits').strip()
+        if rank_by not in RANK_BY:
+            raise TstatConfigException(
+                '[heavy_hitters] by must be one of: {0}'.format(', '.join(RANK_BY)))
+
+        if count <= 0 or window < 0:
+            raise TstatConfigException('[heavy_hitters] count must be positive, window 0 or more')
+
+        return cls(config, count=count, rank_by=rank_by, window=window)
+
+    def _score(self, capsule):
+        if self._rank_by == 'rate':
+            return capsule.bits_per_second
+        return capsule.num_bits
+
+    def add(self, capsules, owner=None):
+        """Add the capsules from the directory owner. Returns the records
+        for the directory, or for any windows that were closed as a
+        result."""
+        for capsule in capsules:
+            self.flows_in += 1
+
+            if self._window:
+                window_start = capsule.start - capsule.start % self._window
+                self._watermark = max(self._watermark, capsule.end)
+            else:
+                window_start = None
+
+            top = self._windows.get(window_start)
+            if top is None:
+                top = _TopN(self._config, self._count, self._rank_by, self._window)
+                self._windows[window_start] = top
+
+            top.push(self._score(capsule), capsule)
+            if owner is not None and self._window:
+                self._owners.setdefault(window_start, set()).add(owner)
+
+        if not self._window:
+            return self.flush()
+
+        ret = list()
+        for i in sorted(self._windows.keys()):
+            if i + self._window * 2 <= self._watermark:
+                ret += self._flush_window(i)
+
+        # and the oldest ones beyond the lookback
+        while len(self._windows) > self._max_windows:
+            ret += self._flush_window(min(self._windows.keys()))
+
+        return ret
+
+    def _flush_window(self, window_start):
+        self._owners.pop(window_start, None)
+        ret = self._windows.pop(window_start).records()
+        self.records_out += len(ret)
+        return ret
+
+    def flush(self):
+        """Return the records for all of the open windows."""
+        ret = list()
+        for i in sorted(self._windows.keys(), key=lambda x: x or 0):
+            ret += self._flush_window(i)
+        return ret
+
+    def held(self):
+        """The owners with flows in the windows that are still open."""
+        return set().union(*self._owners.values())
+
+    def stats(self):
+        """Return a summary."""
+        return 'heavy hitters: {i} flows in, {o} records out'.format(
+            i=self.flows_in, o=self.records_out)
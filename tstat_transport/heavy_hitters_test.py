@@ -0,0 +1,139 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatParseException
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.heavy_hitters import HeavyHitters, Remainder
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+def _config(directory='test_data', **opts):
+    ns = argparse.Namespace(verbose=False, transport='rabbit', directory=directory,
+                            debug=False, no_transport=True, sensor='SensorName',
+                            instance='instanceID', threshold=0)
+    config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+    if opts:
+        config.config.add_section('heavy_hitters')
+        for k, v in opts.items():
+            config.config.set('heavy_hitters', k, v)
+    return config
+
+
+class FailingParse(TstatParse):
+    """A TstatParse whose sends fail once fail is set."""
+    fail = False
+
+    def _xport(self, objs, shard=None):
+        if self.fail:
+            return False, 'broker down'
+        return super(FailingParse, self)._xport(objs, shard)
+
+
+class TestHeavyHitters(unittest.TestCase):
+
+    def setUp(self):
+        self.config = _config()
+        self.capsules = list()
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            self.capsules += capsule_factory(row, 'tcp', self.config)
+
+    def test_top_n_per_directory(self):
+        top = HeavyHitters(self.config, count=5)
+        records = top.add(self.capsules)
+
+        self.assertEqual(len(records), 6)
+        flows, remainder = records[:5], records[5]
+        self.assertIsInstance(remainder, Remainder)
+
+        expected = sorted((x.num_bits for x in self.capsules), reverse=True)[:5]
+        self.assertEqual([x.num_bits for x in flows], expected)
+        self.assertEqual(remainder.flows, len(self.capsules) - 5)
+        self.assertEqual(remainder.bits + sum(expected),
+                         sum(x.num_bits for x in self.capsules))
+        self.assertEqual(remainder.to_json_packet()['type'], 'remainder')
+        self.assertEqual(top.flush(), [])
+
+    def test_no_remainder(self):
+        top = HeavyHitters(self.config, count=len(self.capsules), rank_by='rate')
+        records = top.add(self.capsules)
+        self.assertEqual(len(records), len(self.capsules))
+        self.assertEqual([x.bits_per_second for x in records],
+                         sorted((x.bits_per_second for x in self.capsules), reverse=True))
+
+    def test_windowed(self):
+        top = HeavyHitters(self.config, count=3, window=60)
+        records = top.add(self.capsules) + top.flush()
+        flows = [x for x in records if not isinstance(x, Remainder)]
+        remainders = [x for x in records if isinstance(x, Remainder)]
+        self.assertEqual(len(flows) + sum(x.flows for x in remainders), len(self.capsules))
+
+    def test_held_windows(self):
+        top = HeavyHitters(self.config, count=3, window=600)
+        top.add(self.capsules, 'a.out')
+        self.assertEqual(top.held(), set(['a.out']))
+        top.flush()
+        self.assertEqual(top.held(), set())
+
+        # per directory, nothing is held
+        top = HeavyHitters(self.config, count=3)
+        top.add(self.capsules, 'a.out')
+        self.assertEqual(top.held(), set())
+
+    def test_max_windows(self):
+        top = HeavyHitters(self.config, count=3, window=600, max_windows=1)
+        records = top.add(self.capsules)
+        self.assertEqual(len(top._windows), 1)
+        records += top.flush()
+        remainders = [x for x in records if isinstance(x, Remainder)]
+        self.assertEqual(len(records) - len(remainders) + sum(x.flows for x in remainders),
+                         len(self.capsules))
+
+    def test_held_directories(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        paths = [os.path.join(root, x) for x in ('a.out', 'b.out')]
+        for path in paths:
+            shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        config = _config(root, count='3', window='600')
+
+        def marked():
+            return [os.path.exists(os.path.join(x, TstatParse.COMPLETED)) for x in paths]
+
+        # the second directory fails to send - the first still has flows
+        # in the open windows, so is not marked either
+        parser = FailingParse(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.process_output(paths[0], [], os.listdir(paths[0]))
+            parser.fail = True
+            with self.assertRaises(TstatParseException):
+                parser.process_output(paths[1], [], os.listdir(paths[1]))
+        self.assertEqual(marked(), [False, False])
+
+        parser = TstatParse(config)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            for path in paths:
+                parser.process_output(path, [], os.listdir(path))
+            parser.finish()
+        self.assertEqual(marked(), [True, True])
+
+        docs = [x for i in out.getvalue().splitlines() for x in json.loads(i)]
+        self.assertEqual(sum(x['values']['num_flows'] if x.get('type') == 'remainder' else 1
+                             for x in docs), len(self.capsules) * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Optional leases on tstat output directories, so that several tstat_send
+processes - on one or more hosts sharing the storage - can split up the
+work without processing the same directory twice.
+
+A worker claims a directory by creating a lock file in it with O_EXCL,
+which only one worker can do. While the directory is being processed a
+heartbeat thread touches the lock file; a lock file that has not been
+touched for ttl seconds belongs to a worker that has died, and can be
+taken over. Configured with the optional [lease] stanza:
+
+    [lease]
+    # seconds without a heartbeat before a lease can be taken over
+    ttl = 300
+    # seconds between heartbeats - defaults to a third of the ttl
+    heartbeat = 100
+
+The lock file holds the owner (host:pid by default) for diagnosis.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .common import TstatConfigException
+
+LEASE_FILE = '.tstat_lease'
+
+
+class Lease(object):
+    """A claimed directory. The heartbeat runs until release()."""
+
+    def __init__(self, path, token, heartbeat):
+        self.path = path
+        self.token = token
+        self.lost = False
+        self._heartbeat = heartbeat
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name='lease-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self._heartbeat):
+            self.renew()
+
+    def held(self):
+        """Is the lock file still ours?"""
+        try:
+            with open(self.path) as fh:
+                return json.load(fh).get('token') == self.token
+        except (IOError, OSError, ValueError):
+            return False
+
+    def renew(self):
+        """Touch the lock file. Returns False if the lease has been lost
+        - taken over by another worker after a missed heartbeat."""
+        if self.lost or not self.held():
+            self.lost = True
+            return False
+        try:
+            os.utime(self.path, None)
+        except OSError:
+            self.lost = True
+            return False
+        return True
+
+    def release(self):
+        """Stop the heartbeat and remove the lock file if it is still ours."""
+        self._stop.set()
+        self._thread.join()
+        if self.held():
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class LeaseManager(object):
+    """Claim leases on directories."""
+
+    def __init__(self, ttl=300, heartbeat=None, owner=None, clock=time.time):
+        self._ttl = ttl
+        self._heartbeat = heartbeat or ttl / 3.0
+        self._owner = owner or '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self._clock = clock
+        self.claimed = 0
+        self.contended = 0
+        self.reclaimed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a LeaseManager from the [lease] config stanza. Returns None
+        if the stanza is not present."""
+        if 'lease' not in config.config.sections():
+            return None
+
+        opts = config.get_lease_opts()
+
+        try:
+            ttl = float(opts.get('ttl', 300))
+            heartbeat = float(opts['heartbeat']) if opts.get('heartbeat') else None
+        except ValueError:
+            raise TstatConfigException('[lease] ttl and heartbeat must be numeric')
+
+        if ttl <= 0 or (heartbeat is not None and not 0 < heartbeat < ttl):
+            raise TstatConfigException('[lease] ttl must be positive and heartbeat less than ttl')
+
+        return cls(ttl=ttl, heartbeat=heartbeat, owner=opts.get('owner'))
+
+    def _create(self, path, token):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(dict(owner=self._owner, token=token, claimed=self._clock()), fh)
+        return True
+
+    def _expired(self, path):
+        try:
+            return os.stat(path).st_mtime + self._ttl < self._clock()
+        except FileNotFoundError:
+            return True
+
+    def _take_over(self, path):
+        """Remove an expired lock file. The rename is atomic, so only one
+        of the workers racing to take it over succeeds."""
+        stale = '{0}.{1}'.format(path, uuid.uuid4().hex)
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return
+
+        # another worker got there first and this is its new lock file -
+        # put it back if nothing has replaced it in the meantime.
+        if not self._expired(stale):
+            try:
+                os.link(stale, path)
+            except OSError:
+                pass
+            os.remove(stale)
+            return
+
+        os.remove(stale)
+        self.reclaimed += 1
+
+    def claim(self, directory):
+        """Claim a directory. Returns a Lease, or None if another worker
+        holds it."""
+        path = os.path.join(directory, LEASE_FILE)
+        token = uuid.uuid4().hex
+
+        if not self._create(path, token):
+            if not self._expired(path):
+                self.contended += 1
+                return None
+            self._take_over(path)
+            if not self._create(path, token):
+                self.contended += 1
+                return None
+
+        self.claimed += 1
+        return Lease(path, token, self._heartbeat)
+
+    def stats(self):
+        """Return a summary."""
+        return 'leases: {c} claimed, {o} held by other workers, {r} expired and taken over'.format(
+            c=self.claimed, o=self.contended, r=self.reclaimed)
@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatParseWarning
+from tstat_transport.lease import LEASE_FILE, LeaseManager
+from tstat_transport.parse import TstatParse
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+
+DIRS = 20
+
+
+def _claim_all(root, results):
+    """Worker process - claim whatever it can and hold on to it."""
+    manager = LeaseManager(ttl=60)
+    won = list()
+    for i in range(DIRS):
+        lease = manager.claim(os.path.join(root, '{0}.out'.format(i)))
+        if lease is not None:
+            won.append(i)
+    results.put(won)
+
+
+def _take_over(path):
+    """Another worker takes the lease on the directory path over."""
+    with open(os.path.join(path, LEASE_FILE), 'w') as fh:
+        json.dump(dict(owner='other', token='other'), fh)
+
+
+class LosingParse(TstatParse):
+    """A parser that loses the lease on each directory while reading it."""
+
+    def _process_logs(self, logs, summary=None):
+        _take_over(os.path.dirname(logs[0][1]))
+        return super(LosingParse, self)._process_logs(logs, summary)
+
+
+class TestLeases(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for i in range(DIRS):
+            os.mkdir(os.path.join(self.root, '{0}.out'.format(i)))
+        self.path = os.path.join(self.root, '0.out')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def config(self, window=None):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        config.config.add_section('lease')
+        config.config.set('lease', 'ttl', '60')
+        if window is not None:
+            config.config.add_section('aggregate')
+            config.config.set('aggregate', 'window', window)
+        return config
+
+    def test_claim_release(self):
+        one = LeaseManager(ttl=60, owner='one')
+        two = LeaseManager(ttl=60, owner='two')
+
+        lease = one.claim(self.path)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(two.claim(self.path))
+        self.assertIsNone(one.claim(self.path))
+        self.assertTrue(lease.renew())
+
+        lease.release()
+        self.assertFalse(os.path.exists(os.path.join(self.path, LEASE_FILE)))
+        lease = two.claim(self.path)
+        self.assertIsNotNone(lease)
+        lease.release()
+        self.assertIn('1 claimed, 1 held by other workers', two.stats())
+
+    def test_expired_lease(self):
+        crashed = LeaseManager(ttl=60).claim(self.path)
+        crashed._stop.set()  # the worker died - no more heartbeats
+        old = time.time() - 120
+        os.utime(crashed.path, (old, old))
+
+        manager = LeaseManager(ttl=60)
+        lease = manager.claim(self.path)
+        self.assertIsNotNone(lease)
+        self.assertEqual(manager.reclaimed, 1)
+
+        # the old owner finds out and does not remove the new lock
+        self.assertFalse(crashed.renew())
+        self.assertTrue(crashed.lost)
+        crashed.release()
+        self.assertTrue(lease.held())
+        lease.release()
+
+    def test_heartbeat(self):
+        lease = LeaseManager(ttl=0.3, heartbeat=0.05).claim(self.path)
+        time.sleep(0.6)
+        # kept fresh by the heartbeat
+        self.assertIsNone(LeaseManager(ttl=0.3).claim(self.path))
+        lease.release()
+
+    def test_processes(self):
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_claim_all, args=(self.root, results))
+                   for _ in range(4)]
+        for i in workers:
+            i.start()
+        won = list()
+        for _ in workers:
+            won += results.get(timeout=30)
+        for i in workers:
+            i.join()
+
+        # every directory was claimed by exactly one process
+        self.assertEqual(sorted(won), list(range(DIRS)))
+
+    def test_parser(self):
+        config = self.config()
+        parser = TstatParse(config)
+
+        path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        # held by another worker - skipped
+        lease = LeaseManager(ttl=60).claim(path)
+        parser.process_output(path, [], os.listdir(path))
+        self.assertFalse(os.path.exists(os.path.join(path, '.processed')))
+
+        lease.release()
+        parser.process_output(path, [], os.listdir(path))
+        self.assertTrue(os.path.exists(os.path.join(path, '.processed')))
+        self.assertFalse(os.path.exists(os.path.join(path, LEASE_FILE)))
+
+    def test_lost_before_send(self):
+        config = self.config()
+        path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        parser = LosingParse(config)
+        out = io.StringIO()
+        with self.assertWarns(TstatParseWarning), contextlib.redirect_stdout(out):
+            parser.process_output(path, [], os.listdir(path))
+
+        # nothing sent or marked, and the new owner's lock is left alone
+        self.assertEqual((parser.records_sent, out.getvalue()), (0, ''))
+        self.assertFalse(os.path.exists(os.path.join(path, '.processed')))
+        with open(os.path.join(path, LEASE_FILE)) as fh:
+            self.assertEqual(json.load(fh)['owner'], 'other')
+
+    def test_lost_before_marking(self):
+        config = self.config(window='600')
+        path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        # the open windows hold the directory - and its lease - until finish()
+        parser = TstatParse(config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.process_output(path, [], os.listdir(path))
+            self.assertTrue(os.path.exists(os.path.join(path, LEASE_FILE)))
+            _take_over(path)
+            with self.assertWarns(TstatParseWarning):
+                parser.finish()
+
+        self.assertFalse(os.path.exists(os.path.join(path, '.processed')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Registry of the tstat log types that can be exported.
+
+Each log type declares the file it is read from, the types of its
+columns (see schema.SCHEMAS) and the capsule class that formats its rows
+(see format.CAPSULE_MAP). The ones to export are enabled with the
+optional [logs] stanza - by default only the tcp and udp logs are:
+
+    [logs]
+    types = tcp, udp, video
+
+Another log type can be added with register() - ie: for log_mm_complete,
+whose layout depends on how tstat was built.
+"""
+
+import collections
+
+from .common import PROTOCOLS, TstatConfigException
+from .format import CAPSULE_MAP, TcpCapsule, TcpNoCompleteCapsule, UdpCapsule, VideoCapsule
+from .schema import SCHEMAS, TCP_TYPES, UDP_TYPES, VIDEO_TYPES
+
+LogType = collections.namedtuple('LogType', ['name', 'filename', 'types', 'capsule'])
+
+LOG_TYPES = collections.OrderedDict()
+
+DEFAULT_TYPES = PROTOCOLS
+
+
+def register(name, filename, types, capsule):
+    """Register a log type. types is a dict of column -> schema type, and
+    capsule a format.EntryCapsuleBase subclass with LOG_TYPE set to name."""
+    if capsule.LOG_TYPE != name:
+        raise ValueError('{0}.LOG_TYPE must be {1}'.format(capsule.__name__, name))
+
+    LOG_TYPES[name] = LogType(name, filename, types, capsule)
+    SCHEMAS[name] = types
+    CAPSULE_MAP[name] = capsule
+
+
+register('tcp', 'log_tcp_complete', TCP_TYPES, TcpCapsule)
+register('udp', 'log_udp_complete', UDP_TYPES, UdpCapsule)
+register('video', 'log_video_complete', VIDEO_TYPES, VideoCapsule)
+register('tcp_nocomplete', 'log_tcp_nocomplete', TCP_TYPES, TcpNoCompleteCapsule)
+
+
+def enabled(config):
+    """Return the LogTypes enabled by the [logs] config stanza, in the
+    order they are listed."""
+    names = config.get_logs_opts().get('types')
+    if names is None:
+        names = DEFAULT_TYPES
+    else:
+        names = [x.strip() for x in names.split(',') if x.strip()]
+
+    bad = [x for x in names if x not in LOG_TYPES]
+    if bad or not names:
+        raise TstatConfigException('[logs] types must be some of: {0}'.format(
+            ', '.join(LOG_TYPES)))
+
+    return [LOG_TYPES[x] for x in names]
@@ -0,0 +1,154 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException
+from tstat_transport.format import CAPSULE_MAP, TcpCapsule, VideoCapsule, capsule_factory
+from tstat_transport.logtypes import LOG_TYPES, enabled, register
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+
+VIDEO_VALUES = dict(vd_type_cont='1', vd_type_pay='2', yt_id16_46='-', yt_itag='18',
+                    vd_dur='213.5', vd_rate_tot='1200', vd_width='1280', vd_height='720',
+                    yt_id11='-', yt_seek='0', yt_red_mode='0', yt_red_cnt='0',
+                    yt_mobile='0', yt_stream='0')
+
+
+def rewrite(src, template, dest, extra=None):
+    """Write the rows of the src log with the header of the template log."""
+    with open(template) as fh:
+        header = fh.readline().split()
+    with open(src) as fh:
+        src_header = [x.split('#')[-1].split(':')[0] for x in fh.readline().split()]
+        rows = [dict(zip(src_header, x.split()), **(extra or dict())) for x in fh]
+
+    names = [x.split('#')[-1].split(':')[0] for x in header]
+    with open(dest, 'w') as fh:
+        fh.write(' '.join(header) + '\n')
+        for row in rows:
+            fh.write(' '.join(row[x] for x in names) + '\n')
+    return len(rows)
+
+
+class TestLogTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, self.path, ignore=shutil.ignore_patterns('.processed'))
+
+        tcp = os.path.join(LOG_DIR, 'log_tcp_complete')
+        self.rows = rewrite(tcp, os.path.join(LOG_DIR, 'log_video_complete'),
+                            os.path.join(self.path, 'log_video_complete'), VIDEO_VALUES)
+        rewrite(tcp, os.path.join(LOG_DIR, 'log_tcp_nocomplete'),
+                os.path.join(self.path, 'log_tcp_nocomplete'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def config(self, types=None, **stanzas):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        if types is not None:
+            stanzas['logs'] = dict(types=types)
+        for section, opts in stanzas.items():
+            config.config.add_section(section)
+            for k, v in opts.items():
+                config.config.set(section, k, v)
+        return config
+
+    def run_parser(self, config):
+        """Process the directory and finish, returning the documents sent."""
+        parser = TstatParse(config)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.process_output(self.path, [], os.listdir(self.path))
+            parser.finish()
+        return [x for i in out.getvalue().splitlines() for x in json.loads(i)]
+
+    def test_registry(self):
+        self.assertEqual([x.name for x in enabled(self.config())], ['tcp', 'udp'])
+        self.assertEqual([x.filename for x in enabled(self.config('video, tcp'))],
+                         ['log_video_complete', 'log_tcp_complete'])
+        self.assertIs(LOG_TYPES['video'].capsule, CAPSULE_MAP['video'])
+
+        with self.assertRaises(TstatConfigException):
+            enabled(self.config('tcp, chat'))
+        with self.assertRaises(ValueError):
+            register('mm', 'log_mm_complete', dict(), TcpCapsule)
+
+    def test_video(self):
+        path = os.path.join(self.path, 'log_video_complete')
+        row = next(iter(LogReader(path, 'video', VideoCapsule.COLUMNS)))
+        capsule = capsule_factory(row, 'video', self.config())[0]
+
+        doc = json.loads(capsule.to_json_string())
+        self.assertEqual(capsule.protocol, 'tcp')
+        self.assertEqual(doc['meta']['protocol'], 'tcp')
+        self.assertEqual(doc['meta']['flow_type'], 'tstat_video')
+        self.assertEqual(doc['values']['video_width'], 1280)
+        self.assertEqual(doc['values']['video_duration'], 213.5)
+        self.assertIn('tcp_rtt_avg', doc['values'])
+
+    def test_parser(self):
+        parser = TstatParse(self.config('tcp, udp, video, tcp_nocomplete'))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.process_output(self.path, [], os.listdir(self.path))
+
+        docs = [x for i in out.getvalue().splitlines() for x in json.loads(i)]
+        flow_types = [x['meta']['flow_type'] for x in docs]
+
+        # the logs are read concurrently, but sent in the order listed
+        self.assertEqual(flow_types, sorted(flow_types, key=['tstat', 'tstat_video',
+                                                             'tstat_nocomplete'].index))
+        self.assertEqual(flow_types.count('tstat_video'), self.rows * 2)
+        self.assertEqual(flow_types.count('tstat_nocomplete'), self.rows * 2)
+
+        nocomplete = [x for x in docs if x['meta']['flow_type'] == 'tstat_nocomplete']
+        self.assertNotIn('tcp_rtt_avg', nocomplete[0]['values'])
+        self.assertTrue(os.path.exists(os.path.join(self.path, '.processed')))
+
+    def test_rollup_flow_types(self):
+        docs = self.run_parser(self.config('tcp, video, tcp_nocomplete',
+                                           aggregate=dict(key='protocol')))
+
+        flows = dict()
+        for doc in docs:
+            flows[doc['meta']['flow_type']] = \
+                flows.get(doc['meta']['flow_type'], 0) + doc['values']['num_flows']
+        self.assertEqual(flows, dict(tstat=self.rows * 2, tstat_video=self.rows * 2,
+                                     tstat_nocomplete=self.rows * 2))
+
+    def test_remainder_flow_types(self):
+        docs = self.run_parser(self.config('tcp, video, tcp_nocomplete',
+                                           heavy_hitters=dict(count='5')))
+
+        remainders = dict((x['meta']['flow_type'], x['values']['num_flows'])
+                          for x in docs if x['type'] == 'remainder')
+        self.assertEqual(sorted(remainders.keys()), ['tstat', 'tstat_nocomplete', 'tstat_video'])
+        self.assertEqual(sum(remainders.values()), self.rows * 6 - 5)
+
+    def test_summary_flow_types(self):
+        docs = self.run_parser(self.config('tcp, video, tcp_nocomplete', summary=dict()))
+        summaries = [x for x in docs if x['type'] == 'summary']
+
+        self.assertEqual([(list(x['values']), x['meta']['flow_type']) for x in summaries],
+                         [(['tcp'], 'tstat'), (['video'], 'tstat_video'),
+                          (['tcp_nocomplete'], 'tstat_nocomplete')])
+
+
+if __name__ == '__main__':
+    unittest.main()
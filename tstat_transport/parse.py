@@ -3,22 +3,34 @@ Classes to parse and encapsulate data from the tstat logs.
 """
 from __future__ import print_function
 
-import csv
-import json
 import os
 import sys
 import warnings
 
 from .common import (
-    PROTOCOLS,
     TstatBase,
+    TstatConfigException,
     TstatParseException,
     TstatParseWarning,
     TstatTransportException,
 )
 
+from .aggregate import Aggregator
+from .cidr import PrefixFilter
+from .dedup import DedupIndex
+from .enrich import Enricher
+from .export import ColumnarExport
+from .heavy_hitters import HeavyHitters
+from .lease import LeaseManager
+from .logtypes import enabled as enabled_log_types
+from .projection import Projection
+from .quarantine import Quarantine
+from .rowcache import CachedReader, RowCache
+from .sample import FlowSampler
+from .summary import Summarizer
 from .transport import TRANSPORT_MAP
-from .format import capsule_factory
+from .format import CAPSULE_MAP, capsule_factory
+from .reader import BAD_RENDER, LogReader, find_log, log_candidates, read_concurrently
 
 
 class TstatParse(TstatBase):
@@ -29,15 +41,104 @@ class TstatParse(TstatBase):
     size, then feed the results to the underlying transfer mechanism (rabbit,
     http, etc).
     """
-    LOG_PATTERN = 'log_{0}_complete'
     COMPLETED = '.processed'
     SLICE_SIZE = 100
+    REPLAY_SLICE_SIZE = 1000
 
-    def __init__(self, config_capsule):
+    # loaded once per process and shared by the parsers for each root
+    SHARED = ('_filter', '_enricher', '_projection', '_export', '_dedup', '_leases',
+              '_quarantine', '_cache', '_sampler', '_transport')
+
+    def __init__(self, config_capsule, shared=None):
         super(TstatParse, self).__init__(config_capsule)
         self._tstat_dir = self._validate_path(self._options.directory)
         self._has_data = False
-        self._protocols = PROTOCOLS
+        self.records_sent = 0
+        # directories that have been sent but still have flows in an open
+        # window of the stage -> their lease (or None)
+        self._held = dict()
+
+        try:
+            self._log_types = enabled_log_types(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        # --replay backfills with bigger slices, and leaves the live
+        # processing state (.processed files, [dedup] index) alone.
+        self._replay = getattr(self._options, 'replay', None) is not None
+        self._slice_size = self.REPLAY_SLICE_SIZE if self._replay else self.SLICE_SIZE
+
+        # the stage and summary are per root as their records carry the
+        # sensor/instance
+        try:
+            self._stage = self._load_stage()
+            self._summarizer = Summarizer.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        if shared is None:
+            self._load_shared()
+        else:
+            # another root in the same process (tstat_send --root) - use
+            # the same transport connections, dedup index, etc.
+            for i in self.SHARED:
+                setattr(self, i, getattr(shared, i))
+
+    def _load_shared(self):
+        """Load the filter, enrichment, dedup index, leases, quarantine, row
+        cache, sampler and transport."""
+        try:
+            self._filter = PrefixFilter.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException('unable to load [filter] prefixes: {0}'.format(str(ex)))
+
+        try:
+            self._enricher = Enricher.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException('unable to load [enrich] databases: {0}'.format(str(ex)))
+
+        try:
+            self._projection = Projection.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        # the live run exported the flows - a replay would write them again.
+        try:
+            self._export = None if self._replay else ColumnarExport.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException('unable to set up [export]: {0}'.format(str(ex)))
+
+        try:
+            self._dedup = None if self._replay else DedupIndex.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException('unable to load [dedup] index: {0}'.format(str(ex)))
+
+        # a replay does not write .processed, so does not need to claim
+        # the directories either.
+        try:
+            self._leases = None if self._replay else LeaseManager.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        # a replay only logs the bad rows - the live run quarantined them.
+        try:
+            self._quarantine = Quarantine(filename=None) if self._replay else \
+                Quarantine.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        try:
+            self._cache = RowCache.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException('unable to set up [cache]: {0}'.format(str(ex)))
+
+        try:
+            self._sampler = FlowSampler.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatParseException(str(ex))
+
+        if self._filter is not None:
+            self._log('parse.init', 'loaded {0} filter prefixes'.format(self._filter.prefixes))
 
         try:
             self._transport = TRANSPORT_MAP.get(self._options.transport)(self._config)
@@ -46,6 +147,19 @@ class TstatParse(TstatBase):
                 t=self._options.transport, e=str(ex))
             raise TstatParseException(msg)
 
+    def _load_stage(self):
+        """Load the optional stage that reduces the capsules from each
+        directory to the records that are sent - [aggregate] rollups or
+        [heavy_hitters] top N. Only one can be configured."""
+        stages = [x for x in (Aggregator.from_config(self._config),
+                              HeavyHitters.from_config(self._config)) if x is not None]
+
+        if len(stages) > 1:
+            raise TstatConfigException(
+                'only one of the [aggregate] and [heavy_hitters] stanzas can be set')
+
+        return stages[0] if stages else None
+
     def _fix_path(self, path, *args):  # pylint: disable=no-self-use
         """normalize and absolute-ize a path or set of path components"""
         return os.path.abspath(
@@ -75,95 +189,283 @@ class TstatParse(TstatBase):
         return spath
 
     def _get_log(self, log_path, log_type):
-        """Get path to the output log to process. Return none if
-        it does not exist."""
-        try:
-            return self._validate_path(log_path, self.LOG_PATTERN.format(log_type))
-        except TstatParseException:
-            return None
+        """Get path to the output log of a logtypes.LogType to process - the
+        plain log, or a compressed one if the directory has been compressed.
+        Return none if it does not exist."""
+        for i in log_candidates(log_type.filename):
+            try:
+                return self._validate_path(log_path, i)
+            except TstatParseException:
+                continue
+        return None
+
+    def _read_log(self, path, log_type, bad_row=None):
+        """Return a LogReader yielding the typed rows that the capsule
+        class for the log type needs. Bad rows are skipped and passed to
+        bad_row. With a [cache], the rows come from it if the log has been
+        read before."""
+        if self._projection is not None:
+            columns = self._projection.columns(log_type)
+        else:
+            columns = CAPSULE_MAP.get(log_type).COLUMNS
 
-    def _check_row(self, rowdict):  # pylint: disable=no-self-use
-        """Make sure that the csv DictReader returned a valid row.
-        Some logs have a bogus last line. If any of the values are
-        None, the entire row is considered non-valid.
-
-        Similarly, check the keys for None values as well. If a log line
-        is malformed - like if it is too long due to some kind of
-        append error - the DictReader will generate a key of None.
-        That will also mark the line as non-valid.
-        """
-        valid = True
-        for k, v in list(rowdict.items()):
-            if k is None or v is None:
-                valid = False
-                break
-        return valid
+        reader = LogReader(path, log_type, columns, bad_row=bad_row)
+
+        if self._cache is not None:
+            return self._cache.reader(path, log_type, columns, reader)
+        return reader
 
     def process_output(self, root, _, files):
-        """Process the logs in a single tstat output directory."""
+        """Process the logs in a single tstat output directory. Returns
+        False if it was skipped - not an output directory, already
+        processed or leased to another worker."""
 
         # is this a tstat output directory?
         if not root.endswith('.out'):
-            return
+            return False
 
         # does it contain any logs?
         logs_found = False
 
-        for i in self._protocols:
-            if self.LOG_PATTERN.format(i) in files:
+        for i in self._log_types:
+            if find_log(files, i.filename) is not None:
                 logs_found = True
                 break
 
         if not logs_found:
-            return
+            return False
 
         log_path = self._validate_path(root)
 
-        # has this directory been processed already?
-        if self._get_state(log_path) is None:
+        # has this directory been processed already? a replay only skips
+        # processed directories if asked to, and does not mark them.
+        replay_all = self._replay and not getattr(self._options, 'respect_processed', False)
+        if not replay_all and self._get_state(log_path) is None:
             # self._debug_log('process_output.done', 'skipping: {0}'.format(log_path))
-            return
+            return False
 
-        # try to process both logs
-        payload = list()
+        if self._leases is None:
+            return self._process_dir(log_path)
 
-        for i in self._protocols:
-            if self._get_log(log_path, i) is None:
-                self.warn('No {0} log at path: {1} - skipping'.format(i, log_path))
+        # claim the directory so other tstat_send processes skip it, and
+        # check it was not finished by one of them in the meantime.
+        lease = self._leases.claim(log_path)
+        if lease is None:
+            self._verbose_log('process_output.leased', 'claimed elsewhere: {0}'.format(log_path))
+            return False
+
+        # a processed directory keeps its lease until it is marked done
+        processed = False
+        try:
+            if self._get_state(log_path) is not None:
+                processed = self._process_dir(log_path, lease)
+        finally:
+            if not processed:
+                lease.release()
+
+        return processed
+
+    def _check_lease(self, log_path, lease):
+        """Renew the lease on a directory before sending it or marking it
+        done. Returns False, with a warning, if another worker has taken
+        it over."""
+        if lease is None or lease.renew():
+            return True
+
+        msg = 'lease lost, abandoning: {0}'.format(log_path)
+        self._log('process_output.warn', msg)
+        self.warn(msg)
+        return False
+
+    def _process_dir(self, log_path, lease=None):
+        """Process the logs in a directory and mark it done once none of
+        its flows are held by the stage. Returns False if the directory
+        was abandoned as its lease was lost before it was sent."""
+
+        # try to process all of the enabled logs
+        logs = list()
+
+        for i in self._log_types:
+            path = self._get_log(log_path, i)
+            if path is None:
+                self.warn('No {0} log at path: {1} - skipping'.format(i.name, log_path))
                 continue
-            else:
-                self._log('process_output.run',
-                          'processing: {0}'.format(self._get_log(log_path, i)))
-
-                with open(self._get_log(log_path, i), 'r') as(csvfile):
-                    reader = csv.DictReader(csvfile, delimiter=' ', quoting=csv.QUOTE_NONE)
-                    for row in reader:
-                        # validate the row before we proceed
-                        if not self._check_row(row):
-                            self._log('process_output.warn',
-                                      'bad row in {0}: {1}'.format(self._get_log(log_path, i), row))
-                            self.warn('bad row in {0}: {1}'.format(self._get_log(log_path, i), row))
-                            continue
-                        # looks good
-                        payload += capsule_factory(row, i, self._config)
+            self._log('process_output.run', 'processing: {path}', path=path)
+            logs.append((i.name, path))
+
+        summary = None
+        if self._summarizer is not None:
+            summary = self._summarizer.open(log_path, [name for name, _ in logs])
+
+        payload = self._process_logs(logs, summary)
+
+        if self._enricher is not None:
+            self._verbose_log('process_output.enrich', self._enricher.stats())
+
+        if self._projection is not None:
+            self._verbose_log('process_output.projection', self._projection.stats())
+
+        # the worker that took the lease over processes the directory
+        if not self._check_lease(log_path, lease):
+            return False
+
+        capsules = payload
+
+        # replace the flows with the records of any windows that have closed
+        if self._stage is not None:
+            payload = self._stage.add(payload, log_path)
+            self._verbose_log('process_output.stage', self._stage.stats())
 
         # try to process and mark that directory done if the
         # processing is successful
         try:
             self._process_payload(payload)
 
-            with open(self._get_state(log_path), 'w') as fh:
-                fh.write('processed')
+            # the summary of all of the flows goes in a message of its own,
+            # on the shard of the directory
+            if summary is not None and summary.flows:
+                records = summary.records()
+                self._process_slice(records, self._transport.shard_for(records[0]))
+                self._summarizer.close(summary)
+                self._verbose_log('process_output.summary', self._summarizer.stats())
+
+            # only the flows of a directory that was sent, so a retry does
+            # not export them twice
+            if self._export is not None:
+                self._export.add(capsules)
+
+            self._held[log_path] = lease
+            self._mark_processed()
 
         except TstatParseException as ex:
             self._log('process_output.error', 'Payload processing failed: {0}'.format(str(ex)))
             raise TstatParseException(
                 'Error sending to transport [{0}]: {1}'.format(self._options.transport, str(ex)))
 
+        finally:
+            # persist the slices that did make it, even on failure
+            if self._dedup is not None:
+                self._dedup.save()
+                self._verbose_log('process_output.dedup', self._dedup.stats())
+
+        return True
+
+    def _mark_processed(self):
+        """Write the state file of the directories that have been sent and
+        have no flows left in an open window of the stage, and release
+        their leases. Until then a failure or crash leaves them to be
+        processed again, rather than losing the flows held."""
+        held = self._stage.held() if self._stage is not None else set()
+
+        for log_path in [x for x in self._held if x not in held]:
+            lease = self._held.pop(log_path)
+            try:
+                if not self._replay and self._check_lease(log_path, lease):
+                    with open(self._fix_path(log_path, self.COMPLETED), 'w') as fh:
+                        fh.write('processed')
+            finally:
+                if lease is not None:
+                    lease.release()
+
+    def _process_logs(self, logs, summary=None):
+        """Return the capsules for the rows of a list of (log type, path)
+        logs, in that order. The logs are read concurrently and their rows
+        handled here as they come in - and counted in the summary.
+        Bad rows are written to the quarantine file, and summarized once
+        the logs are done."""
+        bad = dict((name, self._quarantine.open(path)) for name, path in logs)
+        capsules = dict((name, list()) for name, _ in logs)
+        current = [None, None]
+
+        def bad_render(reason, detail):
+            bad[current[0]](reason, current[1], detail)
+
+        readers = [(name, self._read_log(path, name, bad[name])) for name, path in logs]
+
+        # replace the rows quarantined by an earlier read of the logs - the
+        # bad rows are left out of the cache, so only the render ones of
+        # a log read back from it come round again
+        for name, reader in readers:
+            bad[name].clear((BAD_RENDER,) if isinstance(reader, CachedReader) else None)
+
+        try:
+            for name, row, line in read_concurrently(readers):
+                if self._filter is not None and \
+                        not self._filter.keep(row.get('c_ip'), row.get('s_ip')):
+                    continue
+                current[0], current[1] = name, line
+                ret = capsule_factory(row, name, self._config, self._enricher,
+                                      self._dedup, self._projection, bad_render, summary,
+                                      self._sampler)
+                if self._projection is not None:
+                    for capsule in ret:
+                        self._projection.measure(capsule)
+                capsules[name] += ret
+        finally:
+            for name, _ in logs:
+                msg = self._quarantine.close(bad[name])
+                if msg is not None:
+                    self._log('process_output.quarantine', msg)
+                    self.warn(msg)
+
+        return [x for name, _ in logs for x in capsules[name]]
+
+    def finish(self, report=True):
+        """Called after the walk. Sends anything that is still being held
+        by the aggregation/heavy hitter stage and marks its directories
+        done, and logs the transport stats unless report is False."""
+        try:
+            if self._stage is not None:
+                self._process_payload(self._stage.flush())
+                self._mark_processed()
+        except TstatParseException as ex:
+            raise TstatParseException(
+                'Error sending to transport [{0}]: {1}'.format(self._options.transport, str(ex)))
+        finally:
+            if self._stage is not None and self._dedup is not None:
+                self._dedup.save()
+            self.close()
+            if report:
+                self.report()
+
+    def close(self):
+        """Close the export files and the transport connections, and release
+        the leases of any directories still held by the stage, without
+        sending anything - they are left to be processed again. Done by
+        finish(), and on the error paths where finish() is not called. The
+        transport reconnects if it is used again (ie: by another root
+        sharing it)."""
+        if self._export is not None:
+            self._export.close()
+
+        for lease in self._held.values():
+            if lease is not None:
+                lease.release()
+        self._held.clear()
+
+        self._transport.close()
+
+    def report(self):
+        """Log the stats of the transport and the other shared parts."""
+        if self._transport.stats() is not None:
+            self._log('finish.transport', self._transport.stats())
+        if self._leases is not None:
+            self._log('finish.leases', self._leases.stats())
+        if self._projection is not None:
+            self._log('finish.projection', self._projection.stats())
+        if self._export is not None:
+            self._log('finish.export', self._export.stats())
+        if self._quarantine.rows:
+            self._log('finish.quarantine', self._quarantine.stats())
+        if self._cache is not None:
+            self._log('finish.cache', self._cache.stats())
+        if self._sampler is not None:
+            self._log('finish.sample', self._sampler.stats())
+
     def _slice_payload(self, payload):
         """Generate a list of smaller lists to keep the writes to the remote
         message queue sane."""
-        return [payload[x:x + self.SLICE_SIZE] for x in range(0, len(payload), self.SLICE_SIZE)]  # pylint: disable=line-too-long
+        return [payload[x:x + self._slice_size] for x in range(0, len(payload), self._slice_size)]  # pylint: disable=line-too-long
 
     def _process_payload(self, payload):
         """Ship the payload off in appropriately sized blasts."""
@@ -172,23 +474,42 @@ class TstatParse(TstatBase):
 
             self._has_data = True
 
-            for i in self._slice_payload(payload):
+            for shard, objs in self._partition_payload(payload):
+                for i in self._slice_payload(objs):
+                    self._process_slice(i, shard)
+        else:
+            self._log('_process_payload.done', 'no payload')
+
+    def _partition_payload(self, payload):
+        """Split the payload up by transport shard, keeping the original
+        order within each shard."""
+        if self._transport.shards == 1:
+            return [(None, payload)]
+
+        shards = dict()
+        for i in payload:
+            shards.setdefault(self._transport.shard_for(i), list()).append(i)
+
+        return sorted(shards.items())
 
-                status, err = self._xport(i)
+    def _process_slice(self, objs, shard):
+        """Send a single slice."""
+        status, err = self._xport(objs, shard)
 
-                if status:
-                    self._verbose_log('_process_payload.run', 'successfully processed slice')
-                else:
-                    self._log('_process_payload.error', 'error processing slice: {0}'.format(err))
-                    raise TstatParseException(err)
+        if status:
+            self._verbose_log('_process_payload.run', 'successfully processed slice of {records} '
+                              'records', records=len(objs))
+            self.records_sent += len(objs)
+            if self._dedup is not None and not self._options.no_transport:
+                self._dedup.add(objs)
         else:
-            self._log('_process_payload.done', 'no payload')
+            self._log('_process_payload.error', 'error processing slice: {0}'.format(err))
+            raise TstatParseException(err)
 
     def _get_json_string(self, objs):  # pylint: disable=no-self-use
-        ret = [x.to_json_packet() for x in objs]
-        return json.dumps(ret, indent=4)
+        return '[' + ', '.join([x.to_json_string() for x in objs]) + ']'
 
-    def _xport(self, objs):
+    def _xport(self, objs, shard=None):
         """Send a measured list of objects to message queue."""
 
         p_load = self._get_json_string(objs)
@@ -204,7 +525,7 @@ class TstatParse(TstatBase):
             return status, err
 
         try:
-            self._transport.set_payload(p_load)
+            self._transport.set_payload(p_load, shard)
             self._transport.send()
 
         except TstatTransportException as ex:
@@ -213,6 +534,12 @@ class TstatParse(TstatBase):
 
         return status, err
 
+    @property
+    def held(self):
+        """The number of directories that have been sent, but still have
+        flows in an open window of the stage."""
+        return len(self._held)
+
     @property
     def has_data(self):
         """Has the walker seen data?"""
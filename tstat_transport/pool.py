@@ -0,0 +1,162 @@
+"""
+Pool of connections to a set of broker endpoints.
+
+Publishes are spread round robin across the healthy endpoints. An
+endpoint whose connection fails is ejected and is only re-admitted once
+a new connection to it succeeds, with exponential backoff between the
+attempts. Per endpoint publish counts and throughput are kept.
+
+The pool does not know anything about the underlying protocol - it is
+handed a connect(endpoint) callable that returns a (connection, channel)
+tuple, and a tuple of the exception types that mean the connection to
+an endpoint has failed.
+"""
+
+import time
+
+from .common import TstatTransportException
+
+
+class BrokerEndpoint(object):  # pylint: disable=too-many-instance-attributes
+    """A single broker and the state of the connection to it."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.channel = None
+        self.retry_at = 0
+        self.backoff = 0
+        self.failures = 0
+        self.messages = 0
+        self.bytes = 0
+        self.publish_time = 0.0
+        self.last_error = None
+        self.closed = False
+
+    @property
+    def healthy(self):
+        """Is there an open connection to the endpoint?"""
+        return self.channel is not None
+
+    def __str__(self):
+        return '{0}:{1}'.format(self.host, self.port)
+
+    def stats(self):
+        """Return a summary of the traffic sent to the endpoint."""
+        rate = self.bytes / self.publish_time / 1048576.0 if self.publish_time else 0.0
+        return '{e} {s}: {m} messages, {b} bytes, {r:.2f} MB/s, {f} failures'.format(
+            e=self, s='up' if self.healthy else 'closed' if self.closed else 'down',
+            m=self.messages, b=self.bytes,
+            r=rate, f=self.failures)
+
+
+class BrokerPool(object):
+    """Round robin pool of BrokerEndpoints with failover."""
+
+    def __init__(self, endpoints, connect, connection_errors=(Exception,),
+                 min_backoff=1.0, max_backoff=60.0, clock=time.time, log=None):
+        self.endpoints = [BrokerEndpoint(host, port) for host, port in endpoints]
+        self._connect = connect
+        self._connection_errors = connection_errors
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+        self._log = log
+        self._next = 0
+
+    def connect_all(self):
+        """Try to connect to every endpoint. Returns the number of healthy
+        endpoints."""
+        for i in self.endpoints:
+            self._admit(i)
+        return len(self.healthy())
+
+    def healthy(self):
+        """Return the healthy endpoints."""
+        return [x for x in self.endpoints if x.healthy]
+
+    def _admit(self, endpoint):
+        """Health check an endpoint by opening a new connection to it."""
+        try:
+            endpoint.connection, endpoint.channel = self._connect(endpoint)
+        except self._connection_errors as ex:  # pylint: disable=catching-non-exception
+            self.eject(endpoint, ex)
+            return False
+
+        endpoint.backoff = 0
+        endpoint.closed = False
+        if self._log is not None:
+            self._log('pool.admit', 'broker {0} admitted'.format(endpoint))
+        return True
+
+    def eject(self, endpoint, err):
+        """Take an endpoint out of rotation until its backoff expires."""
+        endpoint.failures += 1
+        endpoint.last_error = str(err)
+        endpoint.backoff = min(self._max_backoff,
+                               endpoint.backoff * 2 if endpoint.backoff else self._min_backoff)
+        endpoint.retry_at = self._clock() + endpoint.backoff
+
+        if endpoint.connection is not None:
+            try:
+                endpoint.connection.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+        endpoint.connection = None
+        endpoint.channel = None
+
+        if self._log is not None:
+            self._log('pool.eject', 'broker {0} ejected for {1}s: {2}'.format(
+                endpoint, endpoint.backoff, str(err)))
+
+    def _candidates(self):
+        """Endpoints to try for the next publish in round robin order -
+        the healthy ones, and any ejected ones whose backoff has expired
+        and that reconnect."""
+        count = len(self.endpoints)
+        start = self._next
+        self._next = (self._next + 1) % count
+
+        for i in [self.endpoints[(start + x) % count] for x in range(count)]:
+            if i.healthy or (i.retry_at <= self._clock() and self._admit(i)):
+                yield i
+
+    def publish(self, publish, size=0):
+        """
+        Call publish(channel) on the next healthy endpoint, failing over
+        to the others on a connection error. Other exceptions are passed
+        through. Returns the endpoint that was used.
+        """
+        for endpoint in self._candidates():
+            start = self._clock()
+            try:
+                publish(endpoint.channel)
+            except self._connection_errors as ex:  # pylint: disable=catching-non-exception
+                self.eject(endpoint, ex)
+                continue
+            endpoint.publish_time += self._clock() - start
+            endpoint.messages += 1
+            endpoint.bytes += size
+            return endpoint
+
+        raise TstatTransportException('no healthy brokers available: {0}'.format(
+            ', '.join('{0} ({1})'.format(x, x.last_error) for x in self.endpoints)))
+
+    def close(self):
+        """Close all of the connections. An endpoint is reconnected if the
+        pool is used again."""
+        for i in self.endpoints:
+            if i.connection is not None:
+                try:
+                    i.connection.close()
+                except Exception:  # pylint: disable=broad-except
+                    pass
+                i.closed = True
+            i.connection = None
+            i.channel = None
+
+    def stats(self):
+        """Return a summary for each endpoint."""
+        return '; '.join(x.stats() for x in self.endpoints)
@@ -0,0 +1,161 @@
+import unittest
+
+from tstat_transport.common import TstatTransportException
+from tstat_transport.pool import BrokerPool
+from tstat_transport.util import split_endpoints
+
+
+class BrokerDown(Exception):
+    pass
+
+
+class Refused(Exception):
+    pass
+
+
+class StandInBroker(object):
+    """Local stand-in for a broker - records what is published to it
+    and can be taken down and brought back up."""
+
+    def __init__(self):
+        self.up = True
+        self.received = list()
+        self.connects = 0
+
+    def channel(self):
+        broker = self
+
+        class Channel(object):
+            def publish(self, body):
+                if not broker.up:
+                    raise BrokerDown('connection reset')
+                broker.received.append(body)
+
+        return Channel()
+
+
+class Connection(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestBrokerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.brokers = dict(a=StandInBroker(), b=StandInBroker(), c=StandInBroker())
+        self.clock = Clock()
+        self.pool = BrokerPool(
+            [('a', 5672), ('b', 5672), ('c', 5672)], self.connect,
+            connection_errors=(BrokerDown,), min_backoff=1, max_backoff=8, clock=self.clock)
+
+    def connect(self, endpoint):
+        broker = self.brokers[endpoint.host]
+        broker.connects += 1
+        if not broker.up:
+            raise BrokerDown('connection refused')
+        return Connection(), broker.channel()
+
+    def send(self, body):
+        return self.pool.publish(lambda ch: ch.publish(body), len(body))
+
+    def test_round_robin(self):
+        self.assertEqual(self.pool.connect_all(), 3)
+        for i in range(9):
+            self.send('m{0}'.format(i))
+        for broker in self.brokers.values():
+            self.assertEqual(len(broker.received), 3)
+        for endpoint in self.pool.endpoints:
+            self.assertEqual(endpoint.messages, 3)
+            self.assertEqual(endpoint.bytes, 6)
+        self.assertIn('a:5672 up: 3 messages', self.pool.stats())
+
+    def test_failover(self):
+        self.pool.connect_all()
+        self.brokers['b'].up = False
+
+        for i in range(6):
+            self.send('m{0}'.format(i))
+
+        # nothing lost, b was ejected on its first failure
+        self.assertEqual(len(self.brokers['a'].received) + len(self.brokers['c'].received), 6)
+        self.assertEqual([x.host for x in self.pool.healthy()], ['a', 'c'])
+        self.assertEqual(self.pool.endpoints[1].failures, 1)
+
+    def test_backoff_and_readmit(self):
+        self.pool.connect_all()
+        self.brokers['b'].up = False
+        for i in range(3):
+            self.send('m')
+        b = self.pool.endpoints[1]
+        self.assertEqual(b.backoff, 1)
+        connects = self.brokers['b'].connects
+
+        # not retried until the backoff expires
+        self.send('m')
+        self.assertEqual(self.brokers['b'].connects, connects)
+
+        # still down - the backoff doubles, capped at max_backoff
+        for expected in (2, 4, 8, 8):
+            self.clock.now = b.retry_at
+            for i in range(3):
+                self.send('m')
+            self.assertEqual(b.backoff, expected)
+
+        # back up - readmitted once a reconnect succeeds
+        self.brokers['b'].up = True
+        self.clock.now = b.retry_at
+        for i in range(3):
+            self.send('m')
+        self.assertTrue(b.healthy)
+        self.assertEqual(b.backoff, 0)
+        self.assertEqual(len(self.brokers['b'].received), 1)
+
+    def test_close(self):
+        self.pool.connect_all()
+        self.send('m')
+        self.pool.close()
+        self.assertEqual(self.pool.healthy(), [])
+        self.assertIn('a:5672 closed: 1 messages', self.pool.stats())
+
+        # reconnected if it is used again
+        self.send('m')
+        self.assertEqual(self.brokers['b'].connects, 2)
+        self.assertIn('b:5672 up: 1 messages', self.pool.stats())
+
+    def test_all_down(self):
+        for broker in self.brokers.values():
+            broker.up = False
+        self.assertEqual(self.pool.connect_all(), 0)
+        with self.assertRaises(TstatTransportException):
+            self.send('m')
+
+    def test_other_errors_pass_through(self):
+        self.pool.connect_all()
+
+        def refuse(channel):
+            raise Refused('unroutable')
+
+        with self.assertRaises(Refused):
+            self.pool.publish(refuse)
+        self.assertEqual(len(self.pool.healthy()), 3)
+
+    def test_split_endpoints(self):
+        self.assertEqual(split_endpoints('localhost', 5672), [('localhost', 5672)])
+        self.assertEqual(split_endpoints('a:5671, b ,[::1]:5673,::1', 5672),
+                         [('a', 5671), ('b', 5672), ('::1', 5673), ('::1', 5672)])
+        with self.assertRaises(ValueError):
+            split_endpoints('a:amqp', 5672)
+
+
+if __name__ == '__main__':
+    unittest.main()
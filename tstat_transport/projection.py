@@ -0,0 +1,184 @@
+"""
+Optional projection of the fields that are sent.
+
+Include and/or exclude lists of field names can be given per log type
+for the values stanza, and for the meta stanza. They are compiled once
+into the fields to render and the log columns to read, so an excluded
+field is never read from the log, converted or computed. Configured with
+the optional [projection] stanza:
+
+    [projection]
+    tcp_values_include = num_bits, bits_per_second, tcp_rtt_avg, tcp_rexmit_rate
+    udp_values_exclude = packets_per_second
+    # for all of the log types unless there is a specific one
+    meta_exclude = instance_id, flow_type
+
+The columns needed for the meta stanza, the threshold, the start/end
+times and the aggregation stages are always read. The bytes saved per
+flow are estimated from a sample of the flows: the meta keys they drop
+are rendered, but the values they drop are never read, so each is taken
+to be as long as the average value that is rendered.
+"""
+
+import json
+
+from .common import TstatConfigException
+from .format import CAPSULE_MAP
+
+SECTIONS = ('values', 'meta')
+
+META_KEYS = ('src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol', 'sensor_id',
+             'instance_id', 'flow_type')
+
+ENRICH_KEYS = tuple(s + k for s in ('src_', 'dst_')
+                    for k in ('asn', 'organization', 'country_code'))
+
+_encode = json.JSONEncoder().encode  # pylint: disable=invalid-name
+
+# measure one in this many flows to estimate the saving
+SAMPLE_EVERY = 100
+
+# the estimated length of a dropped value when no values are rendered
+VALUE_BYTES = 8
+
+
+def _names(value):
+    return [x.strip() for x in value.replace('\n', ',').split(',') if x.strip()]
+
+
+def _select(names, include, exclude, section):
+    """Apply include/exclude lists to names, keeping their order."""
+    bad = [x for x in (include or list()) + (exclude or list()) if x not in names]
+    if bad:
+        raise TstatConfigException(
+            '[projection] unknown {0} fields: {1} - valid fields are: {2}'.format(
+                section, ', '.join(bad), ', '.join(names)))
+
+    return [x for x in names
+            if (include is None or x in include) and (exclude is None or x not in exclude)]
+
+
+class Projection(object):
+    """The fields to render and the columns to read per protocol."""
+
+    def __init__(self, rules):
+        """rules is a dict of (protocol, section) -> (include, exclude),
+        where include and exclude are lists of names or None."""
+        self._value_fields = dict()
+        self._dropped = dict()
+        self._meta_keys = dict()
+        self._columns = dict()
+
+        for protocol, capsule in CAPSULE_MAP.items():
+            include, exclude = rules.get((protocol, 'values'), (None, None))
+            selected = _select([x.name for x in capsule.VALUE_FIELDS], include, exclude,
+                               'values')
+            fields = tuple(x for x in capsule.VALUE_FIELDS if x.name in selected)
+            self._value_fields[protocol] = fields
+            self._dropped[protocol] = tuple(x.name for x in capsule.VALUE_FIELDS
+                                            if x.name not in selected)
+
+            columns = list(capsule.CORE_COLUMNS)
+            for field in fields:
+                columns += [x for x in field.columns if x not in columns]
+            self._columns[protocol] = tuple(columns)
+
+            include, exclude = rules.get((protocol, 'meta'), (None, None))
+            if include is None and exclude is None:
+                self._meta_keys[protocol] = None
+            else:
+                self._meta_keys[protocol] = frozenset(
+                    _select(list(META_KEYS + ENRICH_KEYS), include, exclude, 'meta'))
+
+        self.flows = 0
+        self.sampled = 0
+        self.full_bytes = 0
+        self.projected_bytes = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a Projection from the [projection] config stanza. Returns
+        None if the stanza is not present."""
+        if 'projection' not in config.config.sections():
+            return None
+
+        opts = config.get_projection_opts()
+        valid = ['{0}{1}_{2}'.format(p, s, k) for p in [''] + [x + '_' for x in CAPSULE_MAP]
+                 for s in SECTIONS for k in ('include', 'exclude')]
+        bad = [x for x in opts if x not in valid]
+        if bad:
+            raise TstatConfigException('[projection] unknown options: {0}'.format(', '.join(bad)))
+
+        # the lists for both protocols can name fields of either
+        all_values = set(x.name for i in CAPSULE_MAP.values() for x in i.VALUE_FIELDS)
+
+        rules = dict()
+        for protocol, capsule in CAPSULE_MAP.items():
+            for section in SECTIONS:
+                lists = list()
+                for kind in ('include', 'exclude'):
+                    value = opts.get('{0}_{1}_{2}'.format(protocol, section, kind))
+                    shared = opts.get('{0}_{1}'.format(section, kind))
+                    if value is None and shared is not None and section == 'values':
+                        _select(sorted(all_values), _names(shared), None, section)
+                        mine = [x.name for x in capsule.VALUE_FIELDS]
+                        value = ', '.join(x for x in _names(shared) if x in mine)
+                    elif value is None:
+                        value = shared
+                    lists.append(_names(value) if value is not None else None)
+                rules[(protocol, section)] = tuple(lists)
+
+        return cls(rules)
+
+    def value_fields(self, protocol):
+        """The format.Fields of the values stanza to render."""
+        return self._value_fields[protocol]
+
+    def meta_keys(self, protocol):
+        """The keys of the meta stanza to render, or None for all."""
+        return self._meta_keys[protocol]
+
+    def columns(self, protocol):
+        """The log columns to read."""
+        return self._columns[protocol]
+
+    def measure(self, capsule):
+        """Count a rendered capsule, measuring a sample of them to estimate
+        the bytes saved."""
+        self.flows += 1
+        if self.flows % SAMPLE_EVERY != 1:
+            return
+        self.sampled += 1
+        projected = len(capsule.to_json_string())
+        self.projected_bytes += projected
+        self.full_bytes += projected + self._dropped_bytes(capsule)
+
+    def _dropped_bytes(self, capsule):
+        """Estimate the JSON bytes of what the projection drops from capsule.
+        The columns of the dropped values may not have been read, so their
+        getters can not be called."""
+        protocol = capsule.LOG_TYPE
+        doc = capsule.to_json_packet()
+
+        widths = [len(_encode(x)) for x in doc['values'].values()]
+        width = sum(widths) / float(len(widths)) if widths else VALUE_BYTES
+        # ', "name": value' per dropped value
+        ret = sum(len(_encode(x)) + 4 + width for x in self._dropped[protocol])
+
+        if self._meta_keys[protocol] is not None:
+            full = capsule._meta_doc()  # pylint: disable=protected-access
+            ret += len(_encode(full)) - len(_encode(doc['meta']))
+        return ret
+
+    def saved_per_flow(self):
+        """Estimated (bytes, fraction) saved per flow."""
+        if not self.sampled:
+            return 0.0, 0.0
+        saved = (self.full_bytes - self.projected_bytes) / float(self.sampled)
+        return saved, saved * self.sampled / self.full_bytes
+
+    def stats(self):
+        """Return a summary."""
+        saved, fraction = self.saved_per_flow()
+        return 'projection: {f} flows, about {b:.0f} bytes ({p:.1%}) saved per flow'.format(
+            f=self.flows, b=saved, p=fraction)
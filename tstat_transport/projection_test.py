@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException
+from tstat_transport.format import TcpCapsule, UdpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.projection import Projection
+from tstat_transport.reader import LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+class TestProjection(unittest.TestCase):
+
+    def __load__config__(self, directory='test_data', **opts):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=directory,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        config.config.add_section('projection')
+        for k, v in opts.items():
+            config.config.set('projection', k, v)
+        return config
+
+    def __capsules__(self, config, projection):
+        capsules = list()
+        for row in LogReader(TCP_LOG, 'tcp', projection.columns('tcp')):
+            capsules += capsule_factory(row, 'tcp', config, projection=projection)
+        return capsules
+
+    def test_no_stanza(self):
+        config = self.__load__config__()
+        config.config.remove_section('projection')
+        self.assertIsNone(Projection.from_config(config))
+
+    def test_include(self):
+        config = self.__load__config__(
+            tcp_values_include='num_bits, tcp_rtt_avg, tcp_rexmit_rate')
+        projection = Projection.from_config(config)
+
+        # the columns only needed by the excluded fields are not read
+        columns = projection.columns('tcp')
+        self.assertIn('c_rtt_avg', columns)
+        self.assertNotIn('c_cwin_max', columns)
+        self.assertNotIn('c_sack_cnt', columns)
+        self.assertTrue(len(columns) < len(TcpCapsule.COLUMNS))
+        self.assertEqual(projection.columns('udp'), UdpCapsule.COLUMNS)
+
+        capsules = self.__capsules__(config, projection)
+        self.assertTrue(capsules)
+        for capsule in capsules:
+            doc = json.loads(capsule.to_json_string())
+            self.assertEqual(list(doc['values'].keys()),
+                             ['num_bits', 'tcp_rexmit_rate', 'tcp_rtt_avg'])
+            self.assertEqual(doc, json.loads(json.dumps(capsule.to_json_packet())))
+            # unchanged meta stanza
+            self.assertEqual(doc['meta']['sensor_id'], 'SensorName')
+
+    def test_exclude_and_meta(self):
+        config = self.__load__config__(
+            values_exclude='tcp_win_max, tcp_win_min', meta_exclude='instance_id, flow_type')
+        projection = Projection.from_config(config)
+        self.assertIn('c_cwin_max', projection.columns('tcp'))
+
+        for capsule in self.__capsules__(config, projection):
+            doc = json.loads(capsule.to_json_string())
+            self.assertNotIn('tcp_win_max', doc['values'])
+            self.assertIn('tcp_cwin_max', doc['values'])
+            self.assertEqual(list(doc['meta'].keys()),
+                             ['src_ip', 'src_port', 'dst_ip', 'dst_port', 'protocol',
+                              'sensor_id'])
+            self.assertEqual(doc, json.loads(json.dumps(capsule.to_json_packet())))
+            projection.measure(capsule)
+
+        saved, fraction = projection.saved_per_flow()
+        self.assertTrue(saved > 0 and 0 < fraction < 1)
+        self.assertIn('saved per flow', projection.stats())
+
+    def test_parser(self):
+        # the sampled flows are measured without the columns that are not read
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+
+        config = self.__load__config__(root, tcp_values_include='num_bits, tcp_rtt_avg')
+        parser = TstatParse(config)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.process_output(path, [], os.listdir(path))
+
+        docs = [x for i in out.getvalue().splitlines() for x in json.loads(i)]
+        self.assertEqual(len(docs), 44)
+        for doc in docs:
+            self.assertEqual(list(doc['values'].keys()), ['num_bits', 'tcp_rtt_avg'])
+
+        self.assertEqual(parser._projection.sampled, 1)
+        saved, fraction = parser._projection.saved_per_flow()
+        self.assertTrue(saved > 0 and 0.5 < fraction < 1)
+
+    def test_unknown_fields(self):
+        with self.assertRaises(TstatConfigException):
+            Projection.from_config(self.__load__config__(tcp_values_include='tcp_nope'))
+        with self.assertRaises(TstatConfigException):
+            Projection.from_config(self.__load__config__(tcp_value_include='num_bits'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+Quarantine of the bad rows in the tstat logs.
+
+A corrupt log - a duplicated header line, a truncated last line, append
+errors - can have thousands of bad rows. Rather than logging each one,
+they are written verbatim to a quarantine file in the output directory
+(buffered, one line per row prefixed with the reason code and the log
+name), and a single summary with the counts per reason and a few
+example rows is logged per log file. The rows of a log that is read
+again - a directory retried after a failure - replace the ones it had
+(see QuarantineFile.clear). Configured with the optional
+[quarantine] stanza:
+
+    [quarantine]
+    # written in each output directory - empty to only log the counts
+    file = .quarantine
+    # example rows logged per reason per log file
+    examples = 3
+    # bytes buffered before writing to the quarantine file
+    buffer_size = 65536
+
+The reason codes are those of reader.LogReader (length, value) and
+format.capsule_factory (render).
+"""
+
+import os
+import threading
+
+from .common import TstatConfigException
+
+QUARANTINE_FILE = '.quarantine'
+
+# example rows are cut down to this many bytes
+EXAMPLE_LENGTH = 200
+
+
+def _example(reason, line, detail):
+    if len(line) > EXAMPLE_LENGTH:
+        line = line[:EXAMPLE_LENGTH] + b'...'
+    return '{r}: {l} ({d})'.format(r=reason, l=line.decode('utf-8', 'replace'), d=detail)
+
+
+def _drop_rows(path, log_name, reasons):
+    """Remove the rows of log_name from the quarantine file at path, or
+    only those with one of reasons."""
+    try:
+        with open(path, 'rb') as fh:
+            lines = fh.readlines()
+    except FileNotFoundError:
+        return
+
+    keep = [x for x in lines if x.split(b'\t', 2)[1:2] != [log_name] or
+            (reasons is not None and x.split(b'\t', 1)[0] not in reasons)]
+    if len(keep) == len(lines):
+        return
+
+    if not keep:
+        os.remove(path)
+        return
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(b''.join(keep))
+    os.replace(tmp, path)
+
+
+class QuarantineFile(object):
+    """
+    The bad rows of a single log. Called as the LogReader bad_row
+    callable - bad_row(reason, line, detail). The logs of a directory are
+    read concurrently, so the writes to the shared file hold a lock.
+    """
+
+    def __init__(self, path, log_path, examples, buffer_size, lock=None):
+        self.path = path
+        self.log_path = log_path
+        self.counts = dict()
+        self.examples = list()
+        self._log_name = os.path.basename(log_path).encode('utf-8')
+        self._max_examples = examples
+        self._buffer_size = buffer_size
+        self._buffer = list()
+        self._buffered = 0
+        self._lock = lock or threading.Lock()
+
+    def __call__(self, reason, line, detail):
+        with self._lock:
+            self._add(reason, line, detail)
+
+    def _add(self, reason, line, detail):
+        count = self.counts.get(reason, 0)
+        self.counts[reason] = count + 1
+
+        if count < self._max_examples:
+            self.examples.append(_example(reason, line, detail))
+
+        if self.path is None:
+            return
+
+        self._buffer.append(b'\t'.join([reason.encode('utf-8'), self._log_name, line]) + b'\n')
+        self._buffered += len(line)
+
+        if self._buffered >= self._buffer_size:
+            self._flush()
+
+    def clear(self, reasons=None):
+        """Drop the rows already in the quarantine file for the log - from
+        an earlier read of it - or only those with one of reasons."""
+        if self.path is None:
+            return
+
+        if reasons is not None:
+            reasons = [x.encode('utf-8') for x in reasons]
+        with self._lock:
+            _drop_rows(self.path, self._log_name, reasons)
+
+    @property
+    def rows(self):
+        """Number of bad rows."""
+        return sum(self.counts.values())
+
+    def flush(self):
+        """Append the buffered rows to the quarantine file."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        with open(self.path, 'ab') as fh:
+            fh.write(b''.join(self._buffer))
+
+        self._buffer = list()
+        self._buffered = 0
+
+    def summary(self):
+        """Return a message with the counts and examples."""
+        msg = '{n} bad rows in {p} ({c})'.format(
+            n=self.rows, p=self.log_path,
+            c=', '.join('{0}: {1}'.format(k, v) for k, v in sorted(self.counts.items())))
+        if self.path is not None:
+            msg += ' - quarantined to {0}'.format(self.path)
+        return msg + ' - examples: ' + '; '.join(self.examples)
+
+
+class Quarantine(object):
+    """Hand out a QuarantineFile per log and keep the totals."""
+
+    def __init__(self, filename=QUARANTINE_FILE, examples=3, buffer_size=65536):
+        self._filename = filename
+        self._examples = examples
+        self._buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self.logs = 0
+        self.rows = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a Quarantine from the [quarantine] config stanza. The
+        defaults are used if it is not present."""
+        opts = config.get_quarantine_opts()
+
+        try:
+            examples = int(opts.get('examples', 3))
+            buffer_size = int(opts.get('buffer_size', 65536))
+        except ValueError:
+            raise TstatConfigException('[quarantine] examples and buffer_size must be integers')
+
+        if examples < 0 or buffer_size <= 0:
+            raise TstatConfigException(
+                '[quarantine] examples can not be negative and buffer_size must be positive')
+
+        return cls(filename=opts.get('file', QUARANTINE_FILE).strip() or None,
+                   examples=examples, buffer_size=buffer_size)
+
+    def open(self, log_path):
+        """Return a QuarantineFile for a log. The quarantine file is in the
+        same directory."""
+        path = None
+        if self._filename is not None:
+            path = os.path.join(os.path.dirname(log_path), self._filename)
+        return QuarantineFile(path, log_path, self._examples, self._buffer_size, self._lock)
+
+    def close(self, qfile):
+        """Write out the rest of a QuarantineFile. Returns its summary, or
+        None if there were no bad rows."""
+        qfile.flush()
+
+        if not qfile.rows:
+            return None
+
+        self.logs += 1
+        self.rows += qfile.rows
+        return qfile.summary()
+
+    def stats(self):
+        """Return a summary."""
+        return 'quarantine: {r} bad rows in {l} logs'.format(r=self.rows, l=self.logs)
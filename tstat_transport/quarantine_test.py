@@ -0,0 +1,152 @@
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException, TstatParseWarning
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.quarantine import QUARANTINE_FILE, Quarantine
+from tstat_transport.reader import BAD_LENGTH, BAD_RENDER, BAD_VALUE, LogReader
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, self.path, ignore=shutil.ignore_patterns('.processed'))
+
+        with open(TCP_LOG, 'rb') as fh:
+            self.lines = fh.read().splitlines()
+
+        # duplicated header line, a line that is too long and a truncated
+        # last line.
+        with open(os.path.join(self.path, 'log_tcp_complete'), 'wb') as fh:
+            fh.write(b'\n'.join(self.lines[:3] + [self.lines[0], self.lines[3] + b' 1'] +
+                                self.lines[4:]))
+            fh.write(b'\n' + self.lines[5][:40])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def config(self):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        return ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+
+    def quarantined(self):
+        with open(os.path.join(self.path, QUARANTINE_FILE), 'rb') as fh:
+            return [x.split(b'\t', 2) for x in fh.read().splitlines()]
+
+    def test_buffered(self):
+        quarantine = Quarantine(examples=1, buffer_size=len(self.lines[0]) * 2)
+        log_path = os.path.join(self.path, 'log_tcp_complete')
+        bad = quarantine.open(log_path)
+
+        for i in range(3):
+            bad(BAD_LENGTH, self.lines[0], 'wrong number of values')
+        bad(BAD_VALUE, self.lines[1], 'bad value')
+
+        # the first two went out when the buffer filled
+        self.assertEqual(len(self.quarantined()), 2)
+
+        summary = quarantine.close(bad)
+        self.assertEqual(self.quarantined()[3], [BAD_VALUE.encode(), b'log_tcp_complete',
+                                                 self.lines[1]])
+        self.assertIn('4 bad rows', summary)
+        self.assertIn('length: 3, value: 1', summary)
+        self.assertEqual(summary.count(' (wrong number of values)'), 1)
+        self.assertEqual(quarantine.stats(), 'quarantine: 4 bad rows in 1 logs')
+
+        # nothing bad, nothing to say
+        self.assertIsNone(quarantine.close(quarantine.open(log_path)))
+
+    def test_retried(self):
+        quarantine = Quarantine()
+        udp = quarantine.open(os.path.join(self.path, 'log_udp_complete'))
+        udp(BAD_VALUE, self.lines[2], 'bad value')
+        quarantine.close(udp)
+
+        for _ in range(2):
+            bad = quarantine.open(os.path.join(self.path, 'log_tcp_complete'))
+            bad.clear()
+            bad(BAD_LENGTH, self.lines[0], 'wrong number of values')
+            bad(BAD_VALUE, self.lines[1], 'bad value')
+            quarantine.close(bad)
+
+        # the second read replaced the rows of the first, and left the
+        # other log's alone
+        self.assertEqual([x[:2] for x in self.quarantined()],
+                         [[BAD_VALUE.encode(), b'log_udp_complete'],
+                          [BAD_LENGTH.encode(), b'log_tcp_complete'],
+                          [BAD_VALUE.encode(), b'log_tcp_complete']])
+
+        # only the render rows of a log read back from the cache
+        bad = quarantine.open(os.path.join(self.path, 'log_tcp_complete'))
+        bad.clear([BAD_RENDER, BAD_VALUE])
+        self.assertEqual(len(self.quarantined()), 2)
+
+        quarantine.open(os.path.join(self.path, 'log_udp_complete')).clear()
+        quarantine.open(os.path.join(self.path, 'log_tcp_complete')).clear()
+        self.assertFalse(os.path.exists(os.path.join(self.path, QUARANTINE_FILE)))
+
+    def test_log_only(self):
+        quarantine = Quarantine(filename=None)
+        bad = quarantine.open(os.path.join(self.path, 'log_tcp_complete'))
+        bad(BAD_LENGTH, b'x' * 1000, 'wrong number of values')
+
+        summary = quarantine.close(bad)
+        self.assertNotIn('quarantined', summary)
+        self.assertLess(len(summary), 400)
+        self.assertFalse(os.path.exists(os.path.join(self.path, QUARANTINE_FILE)))
+
+    def test_config(self):
+        config = self.config()
+        config.config.add_section('quarantine')
+        config.config.set('quarantine', 'file', '')
+        config.config.set('quarantine', 'examples', '5')
+        self.assertIsNone(Quarantine.from_config(config).open(TCP_LOG).path)
+
+        config.config.set('quarantine', 'buffer_size', '0')
+        with self.assertRaises(TstatConfigException):
+            Quarantine.from_config(config)
+
+    def test_render(self):
+        reader = LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS)
+        row = dict(next(iter(reader)), c_bytes_uniq=None, s_bytes_uniq=None)
+
+        bad = list()
+        ret = capsule_factory(row, 'tcp', self.config(), bad_row=lambda r, d: bad.append(r))
+        self.assertEqual(ret, list())
+        # reported once for the row, not once per direction
+        self.assertEqual(bad, [BAD_RENDER])
+
+    def test_parser(self):
+        parser = TstatParse(self.config())
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            parser.process_output(self.path, [], os.listdir(self.path))
+
+        self.assertTrue(os.path.exists(os.path.join(self.path, '.processed')))
+        self.assertEqual(sorted(x[0].decode() for x in self.quarantined()),
+                         sorted([BAD_VALUE, BAD_LENGTH, BAD_LENGTH]))
+        self.assertIn([BAD_VALUE.encode(), b'log_tcp_complete', self.lines[0]],
+                      self.quarantined())
+
+        # one warning for the log rather than one per row
+        caught = [x for x in caught if issubclass(x.category, TstatParseWarning)]
+        self.assertEqual(len(caught), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Optional rate limiting of the messages sent by the transport.
+
+Token buckets cap the messages and bytes per second, so catching up on a
+backlog after an outage does not swamp a shared broker. On top of the
+configured rates the limiter backs off on its own: if the publish
+confirm latency goes over a target, or the broker sends a
+connection.blocked notification, the rates are halved (down to a floor)
+and then ramped back up while the latency stays under the target.
+Configured with the optional [rate_limit] stanza:
+
+    [rate_limit]
+    # either or both of these
+    messages = 200
+    bytes = 5000000
+    # seconds worth of tokens that can be sent in a burst
+    burst = 1
+    # confirm latency in seconds above which the rate is backed off
+    confirm_latency = 0.5
+    # the lowest fraction of the configured rates to back off to
+    min_factor = 0.1
+
+The time spent throttled and the achieved rate are reported.
+"""
+
+import time
+
+from .common import TstatConfigException
+
+# fraction of the configured rate added back per publish under the target
+RAMP_UP = 0.05
+
+
+class TokenBucket(object):
+    """Token bucket that can go into debt for an item bigger than the
+    burst - the caller waits for the debt to be paid off instead."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.capacity = rate * burst
+        self._tokens = self.capacity
+        self._last = now
+
+    def delay(self, amount, factor, now):
+        """Take amount tokens, refilling at rate * factor. Returns the
+        seconds to wait before the tokens are actually available."""
+        rate = self.rate * factor
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * rate)
+        self._last = now
+        self._tokens -= amount
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / rate
+
+
+class RateLimiter(object):  # pylint: disable=too-many-instance-attributes
+    """Message and byte rate limits with adaptive backoff."""
+
+    def __init__(self, messages=None, size=None, burst=1.0, confirm_latency=None,
+                 min_factor=0.1, clock=time.time, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        now = clock()
+        self._message_bucket = TokenBucket(messages, burst, now) if messages else None
+        self._byte_bucket = TokenBucket(size, burst, now) if size else None
+        self._confirm_latency = confirm_latency
+        self._min_factor = min_factor
+        self._blocked = False
+        self.factor = 1.0
+        self.backoffs = 0
+        self.throttled = 0.0
+        self.messages = 0
+        self.bytes = 0
+        self._start = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a RateLimiter from the [rate_limit] config stanza. Returns
+        None if neither messages or bytes are set."""
+        opts = config.get_rate_limit_opts()
+
+        if not opts.get('messages') and not opts.get('bytes'):
+            return None
+
+        try:
+            messages = float(opts.get('messages') or 0)
+            size = float(opts.get('bytes') or 0)
+            burst = float(opts.get('burst', 1))
+            latency = float(opts['confirm_latency']) if opts.get('confirm_latency') else None
+            min_factor = float(opts.get('min_factor', 0.1))
+        except ValueError:
+            raise TstatConfigException('[rate_limit] values must be numeric')
+
+        if messages < 0 or size < 0 or burst <= 0 or not 0 < min_factor <= 1:
+            raise TstatConfigException(
+                '[rate_limit] rates must be positive and min_factor between 0 and 1')
+
+        return cls(messages=messages, size=size, burst=burst, confirm_latency=latency,
+                   min_factor=min_factor)
+
+    def acquire(self, size):
+        """Wait until a message of size bytes can be sent."""
+        now = self._clock()
+        if self._start is None:
+            self._start = now
+
+        wait = 0.0
+        if self._message_bucket is not None:
+            wait = self._message_bucket.delay(1, self.factor, now)
+        if self._byte_bucket is not None:
+            wait = max(wait, self._byte_bucket.delay(size, self.factor, now))
+
+        if wait > 0:
+            self.throttled += wait
+            self._sleep(wait)
+
+        self.messages += 1
+        self.bytes += size
+
+    def _back_off(self):
+        self.factor = max(self._min_factor, self.factor / 2)
+        self.backoffs += 1
+
+    def observe(self, latency):
+        """Feed back the confirm latency of a publish."""
+        if self._blocked:
+            return
+        if self._confirm_latency is not None and latency > self._confirm_latency:
+            self._back_off()
+        elif self.factor < 1:
+            self.factor = min(1.0, self.factor + RAMP_UP)
+
+    def blocked(self):
+        """The broker sent connection.blocked - drop to the floor rate."""
+        self._blocked = True
+        self.factor = self._min_factor
+        self.backoffs += 1
+
+    def unblocked(self):
+        """The broker sent connection.unblocked - ramp back up."""
+        self._blocked = False
+
+    def rate(self):
+        """The achieved (messages, bytes) per second."""
+        if self._start is None:
+            return 0.0, 0.0
+        elapsed = self._clock() - self._start
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return self.messages / elapsed, self.bytes / elapsed
+
+    def stats(self):
+        """Return a summary."""
+        messages, size = self.rate()
+        return 'rate limit: {m:.1f} msgs/s, {b:.0f} bytes/s, {t:.2f}s throttled, ' \
+               '{o} backoffs, at {f:.0%} of configured rate'.format(
+                   m=messages, b=size, t=self.throttled, o=self.backoffs, f=self.factor)
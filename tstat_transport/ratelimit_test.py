@@ -0,0 +1,103 @@
+import argparse
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatTransportException
+from tstat_transport.ratelimit import RateLimiter
+from tstat_transport.transport import RabbitMQTransport
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+
+
+class Clock(object):
+    """Fake clock - sleeping just moves the time on."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def limiter(self, **kwargs):
+        self.clock = Clock()
+        return RateLimiter(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_message_rate(self):
+        limiter = self.limiter(messages=10, burst=1)
+        for i in range(110):
+            limiter.acquire(100)
+        # the first second is the burst, then 10/s
+        self.assertAlmostEqual(self.clock.now - 1000.0, 10.0, places=3)
+        self.assertAlmostEqual(limiter.throttled, 10.0, places=3)
+        self.assertAlmostEqual(limiter.rate()[0], 11.0, places=3)
+
+    def test_byte_rate(self):
+        limiter = self.limiter(size=1000, burst=1)
+        for i in range(5):
+            limiter.acquire(1000)
+        self.assertAlmostEqual(self.clock.now - 1000.0, 4.0, places=3)
+        # bigger than the burst - waits for the debt
+        limiter.acquire(3000)
+        self.assertAlmostEqual(self.clock.now - 1000.0, 7.0, places=3)
+
+    def test_adaptive(self):
+        limiter = self.limiter(messages=100, confirm_latency=0.5, min_factor=0.1)
+        limiter.observe(0.1)
+        self.assertEqual(limiter.factor, 1.0)
+        limiter.observe(1.0)
+        self.assertEqual(limiter.factor, 0.5)
+        for i in range(5):
+            limiter.observe(1.0)
+        self.assertEqual(limiter.factor, 0.1)
+        limiter.observe(0.1)
+        self.assertAlmostEqual(limiter.factor, 0.15)
+
+        # a throttled bucket refills more slowly
+        limiter = self.limiter(messages=10, burst=1, confirm_latency=0.5)
+        for i in range(10):
+            limiter.acquire(1)
+        limiter.observe(1.0)
+        start = self.clock.now
+        for i in range(5):
+            limiter.acquire(1)
+        self.assertAlmostEqual(self.clock.now - start, 1.0, places=3)
+
+    def test_blocked(self):
+        limiter = self.limiter(messages=100, min_factor=0.2)
+        limiter.blocked()
+        self.assertEqual(limiter.factor, 0.2)
+        # no ramp up while blocked
+        limiter.observe(0.0)
+        self.assertEqual(limiter.factor, 0.2)
+        limiter.unblocked()
+        limiter.observe(0.0)
+        self.assertAlmostEqual(limiter.factor, 0.25)
+        self.assertIn('1 backoffs', limiter.stats())
+
+    def test_config(self):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory='test_data',
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        self.assertIsNone(RateLimiter.from_config(config))
+
+        config.config.add_section('rate_limit')
+        config.config.set('rate_limit', 'messages', '50')
+        config.config.set('rate_limit', 'confirm_latency', '0.25')
+        transport = RabbitMQTransport(config)
+        self.assertIsNotNone(transport._limiter)
+        self.assertIn('rate limit:', transport.stats())
+
+        config.config.set('rate_limit', 'bytes', 'lots')
+        with self.assertRaises(TstatTransportException):
+            RabbitMQTransport(config)
+
+
+if __name__ == '__main__':
+    unittest.main()
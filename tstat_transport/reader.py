@@ -0,0 +1,250 @@
+"""
+Memory-mapped reader for the tstat logs.
+
+The logs are scanned line by line at the bytes level. Only the columns
+the capsule classes need are converted (and in the case of strings,
+decoded), the rest of every line is never turned into python strings.
+
+Compressed logs (gzip, bzip2 and zstandard) are decompressed on the fly
+in chunks rather than being mapped.
+"""
+
+import bz2
+import gzip
+import io
+import itertools
+import mmap
+import os
+import queue
+import threading
+
+from .common import TstatParseException
+from .schema import INFER_ROWS, LogSchema, TstatSchemaException
+
+# suffixes of compressed logs, in the order they are looked for.
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.zst')
+
+CHUNK_SIZE = 1024 * 1024
+
+# rows handed over at a time, and batches buffered per reader, by
+# read_concurrently()
+BATCH_ROWS = 500
+QUEUE_DEPTH = 4
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# reason codes passed to the bad_row callback
+BAD_LENGTH = 'length'
+BAD_VALUE = 'value'
+# a row that converts but fails to render - see format.capsule_factory
+BAD_RENDER = 'render'
+
+
+def log_candidates(name):
+    """All of the filenames a log may be found under."""
+    return (name,) + tuple(name + x for x in COMPRESSED_SUFFIXES)
+
+
+def find_log(files, name):
+    """Return the first filename in files that is the named log, plain
+    or compressed. Return None if there isn't one."""
+    for i in log_candidates(name):
+        if i in files:
+            return i
+    return None
+
+
+def compression(fh):
+    """Sniff the magic bytes at the start of an open file and return the
+    compression type, or None if it is a plain log."""
+    magic = fh.read(4)
+    fh.seek(0)
+
+    if magic.startswith(GZIP_MAGIC):
+        return 'gz'
+    elif magic.startswith(BZIP2_MAGIC):
+        return 'bz2'
+    elif magic.startswith(ZSTD_MAGIC):
+        return 'zst'
+    return None
+
+
+def _decompressed(fh, kind):
+    """Wrap an open file in a streaming decompressor."""
+    if kind == 'gz':
+        return io.BufferedReader(gzip.GzipFile(fileobj=fh, mode='rb'), CHUNK_SIZE)
+    elif kind == 'bz2':
+        return io.BufferedReader(bz2.BZ2File(fh, mode='rb'), CHUNK_SIZE)
+
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise TstatParseException(
+            'zstandard module is required to read {0}'.format(fh.name))
+
+    return io.BufferedReader(
+        zstandard.ZstdDecompressor().stream_reader(fh, read_size=CHUNK_SIZE), CHUNK_SIZE)
+
+
+class LogReader(object):
+    """
+    Iterate over the typed rows of a single tstat log.
+
+    The header line is turned into a LogSchema limited to columns. Lines
+    that do not match it - a bogus last line that is too short, a line
+    that is too long due to some kind of append error, a duplicated header
+    line - are skipped and passed to the optional bad_row callable as
+    bad_row(reason, line, detail). The raw line of the last row yielded
+    is kept in line.
+    """
+
+    def __init__(self, path, log_type, columns, bad_row=None):
+        self._path = path
+        self._log_type = log_type
+        self._columns = columns
+        self._bad_row = bad_row
+        self.schema = None
+        self.rows = 0
+        self.bad_rows = 0
+        self.line = None
+
+    def _lines(self, source):
+        """Generator of the lines in the mapped or decompressed file,
+        newline removed."""
+        for line in iter(source.readline, b''):
+            yield line.rstrip(b'\r\n')
+
+    def _report(self, reason, line, detail):
+        self.bad_rows += 1
+        if self._bad_row is not None:
+            self._bad_row(reason, line, detail)
+
+    def __iter__(self):
+        with open(self._path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return
+
+            kind = compression(fh)
+            if kind is not None:
+                with _decompressed(fh, kind) as source:
+                    for row in self._scan(self._lines(source)):
+                        yield row
+                return
+
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+                for row in self._scan(self._lines(mapped)):
+                    yield row
+            finally:
+                mapped.close()
+
+    def _scan(self, lines):
+        header = next(lines, None)
+        if header is None:
+            return
+
+        self.schema = LogSchema(
+            self._log_type, header.decode('utf-8', 'replace').split(' '), self._columns)
+
+        sample = list(itertools.islice(lines, INFER_ROWS))
+        if self.schema.pending:
+            split = [x.split(b' ') for x in sample]
+            self.schema.infer([x for x in split if self.schema.valid_length(x)])
+
+        first_error = None
+
+        for line in itertools.chain(sample, lines):
+            values = line.split(b' ')
+
+            if not self.schema.valid_length(values):
+                self._report(BAD_LENGTH, line, 'wrong number of values')
+                continue
+
+            try:
+                row = self.schema.convert(values)
+            except ValueError as ex:
+                first_error = first_error or str(ex)
+                self._report(BAD_VALUE, line, str(ex))
+                continue
+
+            self.rows += 1
+            self.line = line
+            yield row
+
+        # every row failing conversion means the column types have changed
+        # rather than a few damaged lines.
+        if first_error and not self.rows:
+            msg = 'schema drift: no rows in {p} match the {t} schema - {e}'.format(
+                p=self._path, t=self._log_type, e=first_error)
+            raise TstatSchemaException(msg)
+
+
+def read_concurrently(readers, batch_rows=BATCH_ROWS, depth=QUEUE_DEPTH):
+    """
+    Read several logs at once - each LogReader in its own thread. readers
+    is a list of (key, LogReader) and (key, row, line) is yielded for
+    every row, where line is the raw line of the row. The rows of each
+    log are in order, but those of different logs are interleaved. An
+    exception raised by a reader is raised here, and the threads are
+    stopped if the caller stops iterating.
+    """
+    if len(readers) == 1:
+        key, reader = readers[0]
+        for row in reader:
+            yield key, row, reader.line
+        return
+
+    batches = queue.Queue(maxsize=depth * len(readers))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(key, reader):
+        batch = list()
+        try:
+            for row in reader:
+                batch.append((row, reader.line))
+                if len(batch) >= batch_rows:
+                    if not put((key, batch, None)):
+                        return
+                    batch = list()
+            put((key, batch, None))
+        except Exception as ex:  # pylint: disable=broad-except
+            put((key, None, ex))
+        finally:
+            put((key, None, None))
+
+    threads = [threading.Thread(target=read, args=x, name='log-reader-{0}'.format(x[0]))
+               for x in readers]
+    for i in threads:
+        i.daemon = True
+        i.start()
+
+    try:
+        running = len(threads)
+        while running:
+            key, batch, error = batches.get()
+            if error is not None:
+                raise error
+            if batch is None:
+                running -= 1
+                continue
+            for row, line in batch:
+                yield key, row, line
+    finally:
+        stop.set()
+        for i in threads:
+            i.join()
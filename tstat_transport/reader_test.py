@@ -0,0 +1,112 @@
+import bz2
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from tstat_transport.format import TcpCapsule, UdpCapsule
+from tstat_transport.reader import BAD_LENGTH, BAD_VALUE, LogReader, find_log, read_concurrently
+from tstat_transport.schema import LogSchema, TstatSchemaException
+
+TCP_LOG = 'test_data/parse_data.out/log_tcp_complete'
+UDP_LOG = 'test_data/parse_data.out/log_udp_complete'
+
+
+class TestReaderMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_csv(self):
+        with open(TCP_LOG, 'r') as csvfile:
+            reader = csv.reader(csvfile, delimiter=' ', quoting=csv.QUOTE_NONE)
+            schema = LogSchema('tcp', next(reader), TcpCapsule.COLUMNS)
+            expected = [schema.convert(x) for x in reader]
+
+        rows = list(LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS))
+        self.assertEqual(rows, expected)
+
+    def test_bad_rows(self):
+        with open(TCP_LOG, 'rb') as fh:
+            lines = fh.read().splitlines()
+
+        path = os.path.join(self.tmpdir, 'log_tcp_complete')
+        with open(path, 'wb') as fh:
+            # duplicated header line, a line that is too long and a
+            # truncated last line.
+            fh.write(b'\n'.join(lines[:3] + [lines[0], lines[3] + b' 1'] + lines[4:]))
+            fh.write(b'\n' + lines[5][:40])
+
+        bad = list()
+        reader = LogReader(path, 'tcp', TcpCapsule.COLUMNS,
+                           bad_row=lambda r, l, d: bad.append(r))
+        rows = list(reader)
+
+        self.assertEqual(len(rows), len(lines) - 2)
+        self.assertEqual(sorted(bad), sorted([BAD_VALUE, BAD_LENGTH, BAD_LENGTH]))
+        self.assertEqual(reader.bad_rows, 3)
+
+    def test_compressed(self):
+        expected = list(LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS))
+
+        with open(TCP_LOG, 'rb') as fh:
+            raw = fh.read()
+
+        for suffix, compress in (('.gz', gzip.compress), ('.bz2', bz2.compress)):
+            path = os.path.join(self.tmpdir, 'log_tcp_complete' + suffix)
+            with open(path, 'wb') as fh:
+                fh.write(compress(raw))
+            rows = list(LogReader(path, 'tcp', TcpCapsule.COLUMNS))
+            self.assertEqual(rows, expected)
+
+        # detected by magic bytes, not the file name
+        path = os.path.join(self.tmpdir, 'log_tcp_complete')
+        with open(path, 'wb') as fh:
+            fh.write(gzip.compress(raw))
+        self.assertEqual(list(LogReader(path, 'tcp', TcpCapsule.COLUMNS)), expected)
+
+    def test_find_log(self):
+        self.assertEqual(find_log(['log_tcp_complete.gz'], 'log_tcp_complete'),
+                         'log_tcp_complete.gz')
+        self.assertEqual(find_log(['log_tcp_complete', 'log_tcp_complete.gz'],
+                                  'log_tcp_complete'), 'log_tcp_complete')
+        self.assertIsNone(find_log(['log_udp_complete'], 'log_tcp_complete'))
+
+    def test_empty_log(self):
+        path = os.path.join(self.tmpdir, 'log_udp_complete')
+        open(path, 'w').close()
+        self.assertEqual(list(LogReader(path, 'udp', ('c_ip',))), [])
+
+    def test_read_concurrently(self):
+        tcp = list(LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS))
+        udp = list(LogReader(UDP_LOG, 'udp', UdpCapsule.COLUMNS))
+
+        rows = list(read_concurrently([
+            ('tcp', LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS)),
+            ('udp', LogReader(UDP_LOG, 'udp', UdpCapsule.COLUMNS)),
+        ], batch_rows=2))
+
+        # each log in order, with its raw lines
+        self.assertEqual([x[1] for x in rows if x[0] == 'tcp'], tcp)
+        self.assertEqual([x[1] for x in rows if x[0] == 'udp'], udp)
+        with open(TCP_LOG, 'rb') as fh:
+            self.assertEqual([x[2] for x in rows if x[0] == 'tcp'], fh.read().splitlines()[1:])
+
+        # a reader error is raised, and the threads stop when the caller does
+        drift = read_concurrently([
+            ('tcp', LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS)),
+            ('udp', LogReader(TCP_LOG, 'udp', UdpCapsule.COLUMNS)),
+        ], batch_rows=1, depth=1)
+        with self.assertRaises(TstatSchemaException):
+            list(drift)
+        self.assertFalse([x for x in threading.enumerate() if x.name.startswith('log-reader')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+"""
+Code to replay (backfill) a range of tstat output directories for
+tstat_send --replay.
+
+Directories are picked by the timestamp in their name, or failing that
+the first packet time of the first flow in their logs. They are replayed
+oldest first in contiguous batches spread across worker processes, each
+with its own TstatParse and transport connections. The live processing
+state - the .processed files and the [dedup] index - is left alone.
+"""
+
+import datetime
+import multiprocessing
+import os
+import re
+import time
+
+from .common import ConfigurationCapsule, TstatConfigException, TstatParseException
+from .cull import STATE_FILE, dir_timestamp, find_output_dirs
+from .parse import TstatParse
+from .util import _log
+
+_RANGE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S',
+                  '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+
+
+def _parse_time(value):
+    """Parse a local date/time or epoch seconds."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    for fmt in _RANGE_FORMATS:
+        try:
+            return time.mktime(datetime.datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+
+    raise ValueError('{0} is not a date (YYYY-MM-DD[THH:MM[:SS]]) or epoch time'.format(value))
+
+
+def parse_range(value):
+    """
+    Parse a FROM..TO range into a (start, end) tuple of epoch seconds.
+    Either end can be left out for an open range. A TO date without a
+    time includes the whole day.
+    """
+    if '..' not in value:
+        raise ValueError('{0} is not a FROM..TO range'.format(value))
+
+    start, end = [x.strip() for x in value.split('..', 1)]
+
+    start = _parse_time(start) if start else 0
+    if not end:
+        end = float('inf')
+    elif re.match(r'^\d{4}-\d{2}-\d{2}$', end):
+        end = _parse_time(end) + 86400
+    else:
+        end = _parse_time(end)
+
+    if end <= start:
+        raise ValueError('{0}: the end of the range is before the start'.format(value))
+
+    return start, end
+
+
+def select_dirs(root, start, end, respect_processed=False):
+    """Return the paths of the output directories under root that start
+    within [start, end), oldest first. If respect_processed is set,
+    directories that have already been processed are left out."""
+    ret = list()
+
+    for path in find_output_dirs(root):
+        if respect_processed and os.path.exists(os.path.join(path, STATE_FILE)):
+            continue
+        stamp = dir_timestamp(path)
+        if stamp is not None and start <= stamp < end:
+            ret.append((stamp, path))
+
+    return [x[1] for x in sorted(ret)]
+
+
+def batches(paths, workers, per_worker=4):
+    """Split the paths into contiguous batches, about per_worker per
+    worker so the load evens out."""
+    size = max(1, -(-len(paths) // (workers * per_worker)))
+    return [paths[x:x + size] for x in range(0, len(paths), size)]
+
+
+# the TstatParse of a worker process
+_WORKER = dict()
+
+
+def _init_worker(options, config_path):
+    """Set up the TstatParse of a worker. Errors are returned by every
+    batch rather than raised, or the pool would keep restarting it."""
+    try:
+        _WORKER['parser'] = TstatParse(ConfigurationCapsule(options, _log, config_path))
+    except (TstatConfigException, TstatParseException) as ex:
+        _WORKER['parser'] = None
+        _WORKER['error'] = str(ex)
+
+
+def _replay_batch(paths):
+    """Replay a batch of directories in a worker. Returns the number of
+    directories finished and records sent, and an error message or None."""
+    parser = _WORKER['parser']
+    if parser is None:
+        return 0, 0, _WORKER['error']
+
+    sent = parser.records_sent
+    done = 0
+
+    try:
+        for path in paths:
+            parser.process_output(path, [], os.listdir(path))
+            done += 1
+        # close any aggregation windows at the end of each batch
+        parser.finish()
+    except (TstatParseException, OSError) as ex:
+        # the directories with flows in windows that were not sent are
+        # not finished either
+        done -= parser.held
+        parser.close()
+        return done, parser.records_sent - sent, str(ex)
+
+    return done, parser.records_sent - sent, None
+
+
+class Progress(object):  # pylint: disable=too-few-public-methods
+    """Track and log the progress of a replay."""
+
+    def __init__(self, total, clock=time.time):
+        self.total = total
+        self.done = 0
+        self.records = 0
+        self.errors = list()
+        self._clock = clock
+        self._start = clock()
+
+    def update(self, done, records, error):
+        """Record a finished batch and return a progress message."""
+        self.done += done
+        self.records += records
+        if error is not None:
+            self.errors.append(error)
+
+        elapsed = self._clock() - self._start
+        eta = elapsed / self.done * (self.total - self.done) if self.done else 0
+
+        return 'replay: {d}/{t} directories, {r} records, {e:.0f}s elapsed, ' \
+               'about {a:.0f}s remaining'.format(
+                   d=self.done, t=self.total, r=self.records, e=elapsed, a=eta)
+
+
+def replay(options, config_path, paths, workers=1):
+    """Replay the directories across workers. Returns the Progress."""
+    progress = Progress(len(paths))
+
+    if workers <= 1:
+        _init_worker(options, config_path)
+        for batch in batches(paths, 1):
+            _log('replay.progress', progress.update(*_replay_batch(batch)))
+        return progress
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(options, config_path))
+    try:
+        for result in pool.imap_unordered(_replay_batch, batches(paths, workers)):
+            _log('replay.progress', progress.update(*result))
+    finally:
+        pool.close()
+        pool.join()
+
+    return progress
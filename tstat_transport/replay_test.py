@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tstat_transport.cull import dir_timestamp
+from tstat_transport.replay import (
+    Progress,
+    _init_worker,
+    _replay_batch,
+    batches,
+    parse_range,
+    replay,
+    select_dirs,
+)
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('2020_06_10_12_00.out', '2020_06_11_12_00.out', 'sensor1/live.out'):
+            shutil.copytree(LOG_DIR, os.path.join(self.root, name),
+                            ignore=shutil.ignore_patterns('.processed'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def options(self, **kwargs):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0, replay='..',
+                                respect_processed=False)
+        for k, v in kwargs.items():
+            setattr(ns, k, v)
+        return ns
+
+    def test_parse_range(self):
+        start, end = parse_range('2020-06-10..2020-06-11')
+        self.assertEqual(end - start, 2 * 86400)
+        self.assertEqual(parse_range('100..200'), (100.0, 200.0))
+        self.assertEqual(parse_range('..200'), (0, 200.0))
+        self.assertEqual(parse_range('100..')[1], float('inf'))
+        self.assertEqual(parse_range('2020-06-10T12:00..2020-06-10T13:00')[1] -
+                         parse_range('2020-06-10T12:00..2020-06-10T13:00')[0], 3600)
+        for bad in ('2020-06-10', '200..100', 'yesterday..today'):
+            with self.assertRaises(ValueError):
+                parse_range(bad)
+
+    def test_dir_timestamp(self):
+        self.assertEqual(dir_timestamp('/x/2020_06_10_12_00.out'),
+                         time.mktime((2020, 6, 10, 12, 0, 0, 0, 0, -1)))
+        self.assertEqual(dir_timestamp('/x/12_00_10_Jun_2020.out'),
+                         time.mktime((2020, 6, 10, 12, 0, 0, 0, 0, -1)))
+        # no timestamp in the name - the first flow in the logs
+        self.assertAlmostEqual(dir_timestamp(os.path.join(self.root, 'sensor1/live.out')),
+                               1591902179.768, places=3)
+
+    def test_select_dirs(self):
+        paths = select_dirs(self.root, *parse_range('2020-06-10..2020-06-11'))
+        self.assertEqual(sorted(os.path.basename(x) for x in paths),
+                         ['2020_06_10_12_00.out', '2020_06_11_12_00.out', 'live.out'])
+        self.assertEqual(os.path.basename(paths[0]), '2020_06_10_12_00.out')
+
+        paths = select_dirs(self.root, *parse_range('2020-06-10..2020-06-10'))
+        self.assertEqual([os.path.basename(x) for x in paths],
+                         ['2020_06_10_12_00.out'])
+
+        open(os.path.join(paths[0], '.processed'), 'w').close()
+        self.assertEqual(select_dirs(self.root, *parse_range('2020-06-10..2020-06-10'),
+                                     respect_processed=True), [])
+
+    def test_batches(self):
+        self.assertEqual(batches(list(range(10)), 2, per_worker=2),
+                         [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+        self.assertEqual(batches([], 4), [])
+
+    def test_progress(self):
+        now = [0.0]
+        progress = Progress(4, clock=lambda: now[0])
+        now[0] = 10.0
+        msg = progress.update(1, 50, None)
+        self.assertIn('1/4 directories, 50 records, 10s elapsed, about 30s remaining', msg)
+        progress.update(3, 0, 'failed')
+        self.assertEqual(progress.errors, ['failed'])
+
+    def replay(self, workers):
+        paths = select_dirs(self.root, 0, float('inf'))
+        progress = replay(self.options(), OPTIONS_CONFIG, paths, workers)
+        self.assertEqual(progress.errors, [])
+        self.assertEqual(progress.done, 3)
+        self.assertTrue(progress.records > 0)
+        # the live processing state is untouched
+        for path in paths:
+            self.assertFalse(os.path.exists(os.path.join(path, '.processed')))
+        return progress
+
+    def test_replay(self):
+        self.assertEqual(self.replay(1).records, self.replay(2).records)
+
+    def test_failed_batch(self):
+        _init_worker(self.options(), OPTIONS_CONFIG)
+        paths = [os.path.join(self.root, x) for x in ('2020_06_10_12_00.out', 'gone.out',
+                                                      '2020_06_11_12_00.out')]
+        with contextlib.redirect_stdout(io.StringIO()):
+            done, records, error = _replay_batch(paths)
+
+        # only the directory before the failure is done
+        self.assertEqual(done, 1)
+        self.assertEqual(records, 44)
+        self.assertIn('gone.out', error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Code to process several tstat output roots in one tstat_send process -
+ie: one per capture interface, each with its own sensor/instance ids.
+
+The roots share one TstatParse setup (transport connections, dedup
+index, etc) and take turns a directory at a time. The next directory is
+always taken from the root that has had the least processing time so
+far, so a busy root can not starve the others. Each root can take its
+directories from a schedule.DirectoryQueue rather than os.walk, and the
+run can be limited by a schedule.Budget.
+"""
+
+import os
+import time
+
+
+def parse_root(value):
+    """Parse a DIR[,SENSOR[,INSTANCE]] --root value into a (directory,
+    sensor, instance) tuple. Missing ids are None."""
+    parts = [x.strip() for x in value.split(',')]
+
+    if not parts[0] or len(parts) > 3:
+        raise ValueError('{0} is not a DIR[,SENSOR[,INSTANCE]] root'.format(value))
+
+    parts += [None] * (3 - len(parts))
+    return tuple(x if x else None for x in parts)
+
+
+class Root(object):
+    """One output root and its share of the work."""
+
+    def __init__(self, directory, parser, queue=None):
+        self.directory = directory
+        self.parser = parser
+        self.busy = 0.0
+        self.directories = 0
+        self._queue = queue
+        if queue is None:
+            self._walk = (x for x in os.walk(directory) if x[0].endswith('.out'))
+
+    def next_dir(self):
+        """Return the next (root, dirs, files) entry or None when done."""
+        if self._queue is not None:
+            return self._queue.next_dir()
+        return next(self._walk, None)
+
+    def next_size(self):
+        """Size in bytes of the next directory - 0 if it is not known."""
+        pending = self._queue.peek() if self._queue is not None else None
+        return pending.size if pending is not None else 0
+
+    def backlog(self):
+        """Return a summary of the directories that are left, or None if
+        they are not known."""
+        if self._queue is None:
+            return None
+        return '{0}: {1}'.format(self.directory, self._queue.backlog())
+
+    def stats(self):
+        """Return a summary."""
+        return '{d}: {n} directories, {r} records, {b:.1f}s'.format(
+            d=self.directory, n=self.directories, r=self.parser.records_sent, b=self.busy)
+
+
+class RootScheduler(object):
+    """Fair scheduling of the directories of several roots."""
+
+    def __init__(self, roots, clock=time.time, budget=None):
+        self.roots = list(roots)
+        self.budget = budget
+        self.exhausted = False
+        self._clock = clock
+
+    def run(self, stop=None):
+        """Process the roots until they are all done, the budget would be
+        exceeded or stop() returns True. TstatParseExceptions are passed
+        through."""
+        active = list(self.roots)
+
+        while active:
+            root = min(active, key=lambda x: x.busy)
+
+            size = root.next_size()
+            if self.budget is not None and not self.budget.allows(size):
+                self.exhausted = True
+                break
+
+            entry = root.next_dir()
+            if entry is None:
+                active.remove(root)
+                continue
+
+            start = self._clock()
+            processed = False
+            try:
+                processed = root.parser.process_output(*entry)
+            finally:
+                root.busy += self._clock() - start
+                # the directories that were skipped are not counted
+                if processed:
+                    root.directories += 1
+                    if self.budget is not None:
+                        self.budget.spend(size)
+
+            if stop is not None and stop():
+                break
+
+    def finish(self):
+        """Flush the roots and log the shared stats once."""
+        for root in self.roots:
+            root.parser.finish(report=False)
+        if self.roots:
+            self.roots[0].parser.report()
+
+    def close(self):
+        """Close the roots without sending anything more - see
+        TstatParse.close()."""
+        for root in self.roots:
+            root.parser.close()
+
+    def stats(self):
+        """Return a summary per root."""
+        return '; '.join(x.stats() for x in self.roots)
+
+    def backlog(self):
+        """Return a summary of the directories left per root."""
+        return '; '.join(x for x in (i.backlog() for i in self.roots) if x is not None)
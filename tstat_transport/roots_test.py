@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule
+from tstat_transport.lease import LeaseManager
+from tstat_transport.parse import TstatParse
+from tstat_transport.roots import Root, RootScheduler, parse_root
+from tstat_transport.schedule import Budget, DirectoryQueue
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+
+
+def _config(directory):
+    ns = argparse.Namespace(verbose=False, transport='rabbit', directory=directory,
+                            debug=False, no_transport=True, sensor='SensorName',
+                            instance='instanceID', threshold=0)
+    return ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeParser(object):
+    """Takes cost seconds per directory."""
+
+    def __init__(self, name, cost, clock, order):
+        self.name = name
+        self.cost = cost
+        self.clock = clock
+        self.order = order
+        self.records_sent = 0
+
+    def process_output(self, root, dirs, files):
+        self.clock.now += self.cost
+        self.order.append(self.name)
+        return True
+
+
+class TestRoots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_root(self, name, count):
+        path = os.path.join(self.tmp, name)
+        for i in range(count):
+            os.makedirs(os.path.join(path, '2020_06_10_12_{0:02d}.out'.format(i)))
+        return path
+
+    def test_parse_root(self):
+        self.assertEqual(parse_root('/data/eth0'), ('/data/eth0', None, None))
+        self.assertEqual(parse_root('/data/eth0,sensor1'), ('/data/eth0', 'sensor1', None))
+        self.assertEqual(parse_root('/data/eth0, sensor1, 2'), ('/data/eth0', 'sensor1', '2'))
+        self.assertEqual(parse_root('/data/eth0,,2'), ('/data/eth0', None, '2'))
+        for bad in (',sensor1', 'a,b,c,d'):
+            with self.assertRaises(ValueError):
+                parse_root(bad)
+
+    def test_fair_share(self):
+        clock = Clock()
+        order = list()
+        busy = Root(self.make_root('busy', 10), FakeParser('busy', 10, clock, order))
+        quiet = Root(self.make_root('quiet', 10), FakeParser('quiet', 1, clock, order))
+
+        RootScheduler([busy, quiet], clock=clock).run()
+
+        # the quiet root gets through all of its directories while the
+        # busy one is on its second
+        self.assertEqual(order[:12], ['busy'] + ['quiet'] * 10 + ['busy'])
+        self.assertEqual(busy.directories, 10)
+        self.assertEqual(quiet.busy, 10)
+
+    def test_stop(self):
+        clock = Clock()
+        order = list()
+        roots = [Root(self.make_root(x, 5), FakeParser(x, 1, clock, order)) for x in 'ab']
+        RootScheduler(roots, clock=clock).run(stop=lambda: len(order) == 3)
+        self.assertEqual(order, ['a', 'b', 'a'])
+
+    def test_shared_parser(self):
+        config = _config(None)
+
+        roots = list()
+        for name, sensor in (('eth0', 'sensor0'), ('eth1', None)):
+            path = os.path.join(self.tmp, name)
+            shutil.copytree(LOG_DIR, os.path.join(path, 'logs.out'),
+                            ignore=shutil.ignore_patterns('.processed'))
+            shared = roots[0].parser if roots else None
+            roots.append(Root(path, TstatParse(config.for_root(path, sensor, '1'), shared)))
+
+        eth0, eth1 = roots
+        self.assertIs(eth0.parser._transport, eth1.parser._transport)
+        self.assertEqual(eth0.parser._options.sensor, 'sensor0')
+        # falls back to the --sensor value
+        self.assertEqual(eth1.parser._options.sensor, 'SensorName')
+        self.assertIsNone(config.options.directory)
+
+        scheduler = RootScheduler(roots)
+        scheduler.run()
+        scheduler.finish()
+
+        for root in roots:
+            self.assertTrue(os.path.exists(os.path.join(root.directory, 'logs.out', '.processed')))
+            self.assertEqual(root.directories, 1)
+        self.assertEqual(eth0.parser.records_sent, eth1.parser.records_sent)
+        self.assertIn('eth1: 1 directories', scheduler.stats())
+
+    def test_skipped_not_counted(self):
+        path = os.path.join(self.tmp, 'eth0')
+        for name in ('a.out', 'b.out'):
+            shutil.copytree(LOG_DIR, os.path.join(path, name),
+                            ignore=shutil.ignore_patterns('.processed'))
+        # pending, but held by another worker
+        lease = LeaseManager(ttl=60).claim(os.path.join(path, 'b.out'))
+        self.addCleanup(lease.release)
+
+        budget = Budget(max_bytes=10 ** 9)
+        config = _config(path)
+        config.config.add_section('lease')
+        config.config.set('lease', 'ttl', '60')
+        parser = TstatParse(config)
+        root = Root(path, parser, DirectoryQueue(path, 'oldest'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            RootScheduler([root], budget=budget).run()
+
+        # only a.out - a copy of LOG_DIR - is counted
+        self.assertEqual(root.directories, 1)
+        self.assertEqual(budget.bytes, sum(os.path.getsize(os.path.join(LOG_DIR, x))
+                                           for x in os.listdir(LOG_DIR)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,371 @@
+"""
+Optional on-disk cache of the parsed rows of the tstat logs.
+
+A retry after a transport failure, or a reprocess with --replay, would
+otherwise read and convert the text logs again from scratch. The typed
+rows of each log are written to the cache the first time it is read in
+full, and read back from it instead of the log the next time.
+
+Each log is cached in a file of its own, named by a hash of the path,
+size and mtime of the log, a hash of its header line and the columns
+read - so a log that has changed, or a different [projection], is a
+miss. The file is columnar: a small JSON header and then one block per
+column of packed values (see the array module) - ints in the narrowest
+of 8, 16, 32 or 64 bits that fits the column, floats in 64 bits - or of
+\\0 separated UTF-8 text for strings (and ints too big for 64 bits).
+
+The cache is capped in size by evicting the least recently used files.
+Configured with the optional [cache] stanza:
+
+    [cache]
+    path = /var/cache/tstat_transport
+    # MB
+    max_size = 1024
+"""
+
+import array
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+
+from .common import TstatConfigException
+from .schema import FLOAT, INT
+
+MAGIC = b'TSTATROWS1\n'
+SUFFIX = '.rows'
+
+# header line bytes hashed for the key
+HEADER_BYTES = 65536
+
+_LENGTH = struct.Struct('<I')
+
+# column encodings - array typecodes, narrowest first for ints
+PACKED_INTS = ('b', 'h', 'i', 'q')
+PACKED_FLOAT = 'd'
+TEXT = 'text'
+TEXT_INT = 'text_int'
+
+
+def cache_key(path, log_type, columns):
+    """Return the cache file name for a log, or None if it can not be
+    read. The key changes if the log is rewritten or appended to."""
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as fh:
+            header = fh.readline(HEADER_BYTES)
+    except OSError:
+        return None
+
+    key = hashlib.sha1()
+    for i in (os.path.abspath(path), stat.st_size, stat.st_mtime_ns,
+              hashlib.sha1(header).hexdigest(), log_type, ','.join(columns)):
+        key.update(str(i).encode('utf-8') + b'\0')
+    return key.hexdigest() + SUFFIX
+
+
+def _column(col_type):
+    """Return an empty column to append the values of col_type to."""
+    if col_type == FLOAT:
+        return array.array(PACKED_FLOAT)
+    if col_type == INT:
+        return array.array(PACKED_INTS[-1])
+    return list()
+
+
+def _encode_column(values, col_type):
+    """Return (encoding, bytes) for the values of a column."""
+    if col_type == FLOAT:
+        return PACKED_FLOAT, array.array(PACKED_FLOAT, values).tobytes()
+
+    if col_type == INT:
+        low, high = (min(values), max(values)) if values else (0, 0)
+        for code in PACKED_INTS:
+            bits = array.array(code).itemsize * 8
+            if -2 ** (bits - 1) <= low and high < 2 ** (bits - 1):
+                return code, array.array(code, values).tobytes()
+        return TEXT_INT, '\0'.join(map(str, values)).encode('utf-8')
+
+    return TEXT, '\0'.join(values).encode('utf-8')
+
+
+def _decode_column(encoding, data, rows):
+    """Return the values of a column - an array for packed values."""
+    if encoding in PACKED_INTS or encoding == PACKED_FLOAT:
+        values = array.array(encoding)
+        values.frombytes(data)
+        return values
+
+    if not rows:
+        return list()
+
+    values = str(data, 'utf-8').split('\0')
+    if encoding == TEXT_INT:
+        return list(map(int, values))
+    return values
+
+
+def write_rows(path, columns, types, values, parse_time):
+    """Write the rows of a log to a cache file, given as the list of the
+    values of each of its columns. types is a list of the schema types of
+    the columns."""
+    blocks = list()
+    meta = list()
+
+    for name, col_type, col_values in zip(columns, types, values):
+        encoding, data = _encode_column(col_values, col_type)
+        blocks.append(data)
+        meta.append([name, encoding, len(data)])
+
+    rows = len(values[0]) if values else 0
+    header = json.dumps(dict(rows=rows, parse_time=parse_time, columns=meta))
+    header = header.encode('utf-8')
+
+    with open(path + '.tmp', 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(_LENGTH.pack(len(header)))
+        fh.write(header)
+        for i in blocks:
+            fh.write(i)
+
+    os.rename(path + '.tmp', path)
+
+
+def read_rows(path):
+    """Read a cache file. Returns (a CachedReader of its rows, the parse
+    time recorded when it was written). The columns are decoded up front,
+    and the rows are built from them as they are iterated. Raises
+    ValueError if the file is corrupt."""
+    with open(path, 'rb') as fh:
+        data = memoryview(fh.read())
+
+    if data[:len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + _LENGTH.size:
+        raise ValueError('not a row cache file')
+
+    offset = len(MAGIC) + _LENGTH.size
+    length = _LENGTH.unpack_from(data, len(MAGIC))[0]
+    header = json.loads(str(data[offset:offset + length], 'utf-8'))
+    offset += length
+
+    names = list()
+    columns = list()
+
+    for name, encoding, size in header['columns']:
+        values = _decode_column(encoding, data[offset:offset + size], header['rows'])
+        if len(values) != header['rows']:
+            raise ValueError('column {0} has {1} values'.format(name, len(values)))
+        names.append(name)
+        columns.append(values)
+        offset += size
+
+    if offset != len(data):
+        raise ValueError('trailing data')
+
+    return CachedReader(names, columns, header['rows']), header['parse_time']
+
+
+class CachedReader(object):
+    """
+    A drop in for a reader.LogReader of the rows in a cache file. Bad
+    rows were left out (and quarantined) when the cache was written. The
+    raw lines are not cached, so line is always empty - rendering it from
+    the values would cost about as much as parsing the log.
+    """
+
+    def __init__(self, names, columns, rows):
+        self._names = names
+        self._columns = columns
+        self.rows = rows
+        self.bad_rows = 0
+        self.line = b''
+
+    def __iter__(self):
+        names = self._names
+        for values in zip(*self._columns):
+            yield dict(zip(names, values))
+
+
+class RecordingReader(object):
+    """
+    Wrap a reader.LogReader and write its rows to the cache once they
+    have all been read. The values are appended to a packed array per
+    column as they are read. Nothing is written if the read fails or
+    stops part way.
+    """
+
+    def __init__(self, cache, name, reader, columns):
+        self._cache = cache
+        self._name = name
+        self._reader = reader
+        self._columns = columns
+
+    def __getattr__(self, attr):
+        return getattr(self._reader, attr)
+
+    def __iter__(self):
+        values = None
+        parse_time = 0.0
+        rows_iter = iter(self._reader)
+
+        while True:
+            start = time.perf_counter()
+            row = next(rows_iter, None)
+            parse_time += time.perf_counter() - start
+            if row is None:
+                break
+
+            if values is None:
+                values = [_column(self._reader.schema.column_type(x)) for x in self._columns]
+            for i, name in enumerate(self._columns):
+                try:
+                    values[i].append(row[name])
+                except OverflowError:
+                    # an int too big for 64 bits
+                    values[i] = list(values[i]) + [row[name]]
+            yield row
+
+        schema = self._reader.schema
+        if schema is not None:
+            types = [schema.column_type(x) for x in self._columns]
+            if values is None:
+                values = [_column(x) for x in types]
+            self._cache.store(self._name, self._columns, types, values, parse_time)
+
+
+class RowCache(object):  # pylint: disable=too-many-instance-attributes
+    """A directory of cache files, capped at max_size bytes."""
+
+    def __init__(self, path, max_size=1024 * 1000000, log=None):
+        self._path = path
+        self._max_size = max_size
+        self._log = log
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+        self.evicted = 0
+
+        try:
+            os.makedirs(self._path, exist_ok=True)
+        except OSError as ex:
+            raise TstatConfigException('unable to create cache path {0}: {1}'.format(
+                self._path, str(ex)))
+
+        # name -> [last used, size]
+        self._files = dict()
+        for i in os.scandir(self._path):
+            if i.name.endswith(SUFFIX) and i.is_file():
+                stat = i.stat()
+                self._files[i.name] = [stat.st_mtime, stat.st_size]
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a RowCache from the [cache] config stanza. Returns None if
+        no path is set."""
+        opts = config.get_cache_opts()
+
+        if not opts.get('path'):
+            return None
+
+        try:
+            max_size = float(opts.get('max_size', 1024))
+        except ValueError:
+            raise TstatConfigException('[cache] max_size must be numeric')
+
+        if max_size <= 0:
+            raise TstatConfigException('[cache] max_size must be positive')
+
+        return cls(opts.get('path'), max_size=int(max_size * 1000000), log=config.log)
+
+    @property
+    def size(self):
+        """Bytes in the cache."""
+        return sum(x[1] for x in self._files.values())
+
+    def _warn(self, msg):
+        if self._log is not None:
+            self._log('cache.warn', msg)
+
+    def reader(self, path, log_type, columns, reader):
+        """Return a reader for the rows of a log - a CachedReader if it is
+        in the cache, otherwise reader wrapped to be written to it."""
+        name = cache_key(path, log_type, columns)
+        if name is None:
+            return reader
+
+        with self._lock:
+            cached = name in self._files
+
+        if cached:
+            start = time.perf_counter()
+            try:
+                cached_reader, parse_time = read_rows(os.path.join(self._path, name))
+            except (OSError, ValueError, KeyError) as ex:
+                self._warn('dropping unreadable cache file for {0}: {1}'.format(path, str(ex)))
+                self._remove(name)
+            else:
+                self._used(name)
+                with self._lock:
+                    self.hits += 1
+                    self.saved += max(parse_time - (time.perf_counter() - start), 0)
+                return cached_reader
+
+        with self._lock:
+            self.misses += 1
+        return RecordingReader(self, name, reader, columns)
+
+    def _used(self, name):
+        now = time.time()
+        try:
+            os.utime(os.path.join(self._path, name), (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if name in self._files:
+                self._files[name][0] = now
+
+    def _remove(self, name):
+        try:
+            os.unlink(os.path.join(self._path, name))
+        except OSError:
+            pass
+        with self._lock:
+            self._files.pop(name, None)
+
+    def store(self, name, columns, types, values, parse_time):
+        """Write the rows of a log - the values of each of its columns - to
+        the cache, and evict the least recently used files if it is over
+        max_size."""
+        path = os.path.join(self._path, name)
+
+        try:
+            write_rows(path, columns, types, values, parse_time)
+            size = os.path.getsize(path)
+        except OSError as ex:
+            self._warn('unable to write cache file {0}: {1}'.format(path, str(ex)))
+            return
+
+        with self._lock:
+            self._files[name] = [time.time(), size]
+            total = self.size
+            evict = list()
+            for i in sorted(self._files, key=lambda x: self._files[x][0]):
+                if total <= self._max_size:
+                    break
+                # the newest file goes last, if it is too big on its own
+                total -= self._files[i][1]
+                evict.append(i)
+            self.evicted += len(evict)
+
+        for i in evict:
+            self._remove(i)
+
+    def stats(self):
+        """Return a summary."""
+        lookups = self.hits + self.misses
+        return 'cache: {h} hits, {m} misses ({r:.0%} hit rate), {s:.2f}s parse time saved, ' \
+            '{f} files, {b} bytes, {e} evicted'.format(
+                h=self.hits, m=self.misses, r=self.hits / lookups if lookups else 0,
+                s=self.saved, f=len(self._files), b=self.size, e=self.evicted)
@@ -0,0 +1,167 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException
+from tstat_transport.format import TcpCapsule
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.rowcache import CachedReader, RowCache, read_rows, write_rows
+from tstat_transport.schema import FLOAT, INT, STR
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+class TestRowCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'cache')
+        self.log = os.path.join(self.root, 'log_tcp_complete')
+        shutil.copy(TCP_LOG, self.log)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def config(self, **opts):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        config.config.add_section('cache')
+        for k, v in opts.items():
+            config.config.set('cache', k, v)
+        return config
+
+    def read(self, cache, path=None):
+        path = path or self.log
+        reader = cache.reader(path, 'tcp', TcpCapsule.COLUMNS,
+                              LogReader(path, 'tcp', TcpCapsule.COLUMNS))
+        return reader, list(reader)
+
+    def test_round_trip(self):
+        path = os.path.join(self.root, 'rows')
+        rows = [dict(a=1, b=1.5, c='x y', d=2 ** 70), dict(a=-2, b=0.0, c='', d=3)]
+        write_rows(path, ['a', 'b', 'c', 'd'], [INT, FLOAT, STR, INT],
+                   [[x[i] for x in rows] for i in 'abcd'], 1.5)
+        reader, parse_time = read_rows(path)
+        self.assertEqual((list(reader), reader.rows, parse_time), (rows, 2, 1.5))
+
+        write_rows(path, ['a'], [INT], [[]], 0)
+        reader, parse_time = read_rows(path)
+        self.assertEqual((list(reader), reader.rows, parse_time), ([], 0, 0))
+
+        with open(path, 'ab') as fh:
+            fh.write(b'junk')
+        with self.assertRaises(ValueError):
+            read_rows(path)
+
+    def test_hit_and_miss(self):
+        cache = RowCache.from_config(self.config(path=self.cache_path))
+
+        _, parsed = self.read(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(len(os.listdir(self.cache_path)), 1)
+
+        reader, cached = self.read(cache)
+        self.assertIsInstance(reader, CachedReader)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cached, parsed)
+        self.assertEqual(reader.rows, len(parsed))
+        self.assertIn('1 hits, 1 misses (50% hit rate)', cache.stats())
+
+        # a changed log is a miss
+        with open(self.log, 'ab') as fh:
+            with open(TCP_LOG, 'rb') as src:
+                fh.write(src.read().splitlines(True)[1])
+        _, reread = self.read(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(reread), len(parsed) + 1)
+
+    def test_recorded_columns(self):
+        class BigReader(LogReader):
+            """An int column that overflows its packed array part way."""
+            def __iter__(self):
+                for i, row in enumerate(super(BigReader, self).__iter__()):
+                    if i == 3:
+                        row['c_bytes_uniq'] = 2 ** 70
+                    yield row
+
+        cache = RowCache.from_config(self.config(path=self.cache_path))
+        parsed = list(cache.reader(self.log, 'tcp', TcpCapsule.COLUMNS,
+                                   BigReader(self.log, 'tcp', TcpCapsule.COLUMNS)))
+        self.assertEqual(parsed[3]['c_bytes_uniq'], 2 ** 70)
+
+        reader, cached = self.read(cache)
+        self.assertIsInstance(reader, CachedReader)
+        self.assertEqual(cached, parsed)
+
+    def test_partial_read(self):
+        cache = RowCache.from_config(self.config(path=self.cache_path))
+        reader = cache.reader(self.log, 'tcp', TcpCapsule.COLUMNS,
+                              LogReader(self.log, 'tcp', TcpCapsule.COLUMNS))
+        next(iter(reader))
+        self.assertEqual(os.listdir(self.cache_path), [])
+
+    def test_corrupt(self):
+        cache = RowCache.from_config(self.config(path=self.cache_path))
+        self.read(cache)
+        name = os.listdir(self.cache_path)[0]
+        with open(os.path.join(self.cache_path, name), 'wb') as fh:
+            fh.write(b'junk')
+
+        _, rows = self.read(cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(len(rows), 22)
+
+    def test_eviction(self):
+        cache = RowCache.from_config(self.config(path=self.cache_path))
+        self.read(cache)
+        size = cache.size
+
+        other = os.path.join(self.root, 'other')
+        shutil.copy(TCP_LOG, other)
+
+        # room for only one of the logs - the least recently used goes
+        cache = RowCache(self.cache_path, max_size=size * 1.5)
+        self.read(cache, other)
+        self.assertEqual(cache.evicted, 1)
+        self.assertEqual(len(os.listdir(self.cache_path)), 1)
+
+        self.read(cache, other)
+        self.assertEqual(cache.hits, 1)
+
+    def test_config(self):
+        self.assertIsNone(RowCache.from_config(self.config()))
+
+        with self.assertRaises(TstatConfigException):
+            RowCache.from_config(self.config(path=self.cache_path, max_size='0'))
+
+    def test_parser(self):
+        path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+        config = self.config(path=self.cache_path)
+
+        outputs = list()
+        for _ in range(2):
+            parser = TstatParse(config)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                parser.process_output(path, [], os.listdir(path))
+            outputs.append(out.getvalue())
+            os.unlink(os.path.join(path, TstatParse.COMPLETED))
+
+        # the tcp and (header only) udp logs are read from the cache
+        self.assertEqual(parser._cache.hits, 2)
+        self.assertEqual(outputs[0], outputs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
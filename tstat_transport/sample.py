@@ -0,0 +1,61 @@
+"""
+Deterministic sampling of the flows under the threshold.
+
+The flows under --threshold are otherwise dropped, so the small flows
+are never seen downstream, and lowering the threshold floods the
+broker. With the optional [sample] stanza, 1 in rate of them are sent
+as well:
+
+    [sample]
+    rate = 100
+
+Whether a row is sampled is decided from the raw row, before any capsule
+is built, by a hash of the 5-tuple and first packet time of the flow
+(see format.EntryCapsuleBase.flow_key) - so the same flows are picked on
+every run, and both directions of a flow together. The records of the
+sampled flows carry a "sample_rate" of rate so consumers can scale
+them up, as the [aggregate] rollups and [heavy_hitters] remainders do.
+"""
+
+import hashlib
+
+from .common import TstatConfigException
+
+
+class FlowSampler(object):
+    """Pick 1 in rate flows by a stable hash of their flow_key."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        # 2**64 / rate - a digest under it is sampled
+        self._limit = (1 << 64) // rate
+        self.rows = 0
+        self.flows = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a FlowSampler from the [sample] config stanza. Returns None
+        if the stanza is not present."""
+        if 'sample' not in config.config.sections():
+            return None
+
+        try:
+            rate = int(config.get_sample_opts().get('rate', ''))
+        except ValueError:
+            raise TstatConfigException('[sample] rate must be an integer')
+
+        if rate < 1:
+            raise TstatConfigException('[sample] rate must be 1 or more')
+
+        return cls(rate)
+
+    def keep(self, key):
+        """Is the flow with the flow_key key in the sample?"""
+        self.rows += 1
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') < self._limit
+
+    def stats(self):
+        """Return a summary."""
+        return 'sample: 1 in {r}, {f} flows under the threshold sent from {n} rows'.format(
+            r=self.rate, f=self.flows, n=self.rows)
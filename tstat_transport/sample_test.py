@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import unittest
+
+from tstat_transport.aggregate import Rollup
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException
+from tstat_transport.format import TcpCapsule, capsule_factory, document_template
+from tstat_transport.reader import LogReader
+from tstat_transport.sample import FlowSampler
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+
+
+class TestSample(unittest.TestCase):
+
+    def config(self, threshold=1000, rate=None):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=LOG_DIR,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=threshold)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        if rate is not None:
+            config.config.add_section('sample')
+            config.config.set('sample', 'rate', rate)
+        return config
+
+    def sample(self, config):
+        sampler = FlowSampler.from_config(config)
+        ret = list()
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            ret += capsule_factory(row, 'tcp', config, sampler=sampler)
+        return sampler, ret
+
+    def test_keep(self):
+        sampler = FlowSampler(4)
+        keys = ['10.0.0.{0}|{1}|10.0.1.1|443|tcp|1500000000.0'.format(x % 256, x)
+                for x in range(10000)]
+        picked = [x for x in keys if sampler.keep(x)]
+
+        self.assertTrue(2000 < len(picked) < 3000)
+        self.assertEqual(picked, [x for x in keys if FlowSampler(4).keep(x)])
+        self.assertEqual(sampler.rows, 10000)
+
+    def test_sampled_flows(self):
+        config = self.config(rate='2')
+        sampler, capsules = self.sample(config)
+
+        # every flow is under the threshold, and both directions of the
+        # sampled ones are sent
+        self.assertTrue(0 < len(capsules) < 44)
+        self.assertEqual(len(capsules) % 2, 0)
+        self.assertEqual(sampler.flows, len(capsules))
+        self.assertIn('{0} flows under the threshold sent from 22 rows'.format(
+            len(capsules)), sampler.stats())
+
+        for capsule in capsules:
+            self.assertEqual(capsule.sample_rate, 2)
+            self.assertEqual(capsule.to_json_packet()['sample_rate'], 2)
+            self.assertEqual(json.loads(capsule.to_json_string()), capsule.to_json_packet())
+
+        # the same flows on every run
+        _, again = self.sample(config)
+        self.assertEqual([x.to_json_string() for x in capsules],
+                         [x.to_json_string() for x in again])
+
+    def test_threshold(self):
+        # flows over the threshold are sent as is
+        _, capsules = self.sample(self.config(threshold=0, rate='1000000'))
+        self.assertEqual(len(capsules), 44)
+        self.assertNotIn('sample_rate', capsules[0].to_json_packet())
+        self.assertNotIn('sample_rate', capsules[0].to_json_string())
+
+    def test_rollup(self):
+        config = self.config(rate='3')
+        _, capsules = self.sample(config)
+        rollup = Rollup([], 0, 600, document_template(None, None, config))
+        rollup.add(capsules[0])
+        self.assertEqual(rollup.flows, 3)
+        self.assertEqual(rollup.bits, capsules[0].num_bits * 3)
+
+    def test_config(self):
+        self.assertIsNone(FlowSampler.from_config(self.config()))
+
+        for i in ('', '0', 'ten'):
+            with self.assertRaises(TstatConfigException):
+                FlowSampler.from_config(self.config(rate=i))
+
+
+if __name__ == '__main__':
+    unittest.main()
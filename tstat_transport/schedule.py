@@ -0,0 +1,149 @@
+"""
+Code to order the pending tstat output directories and work through
+them within a per-run budget.
+
+Rather than taking the directories in os.walk order until the tree is
+exhausted, the directories that have not been processed are collected
+up front and ordered by a policy:
+
+    newest       newest first - after an outage the fresh data goes out
+                 first, and the backlog is worked down behind it
+    oldest       oldest first
+    interleaved  alternately the newest and the oldest remaining
+
+A Budget of run time and/or log bytes stops the run before a directory
+that would go over it is started, so overlapping cron runs are avoided
+and what is left is reported as the backlog.
+"""
+
+import os
+import time
+
+from .cull import STATE_FILE, dir_timestamp, find_output_dirs
+
+ORDERS = ('newest', 'oldest', 'interleaved')
+
+
+class PendingDir(object):  # pylint: disable=too-few-public-methods
+    """An output directory that has not been processed yet."""
+
+    def __init__(self, path, stamp, size, files):
+        self.path = path
+        self.stamp = stamp
+        self.size = size
+        self.files = files
+
+    def __repr__(self):
+        return 'PendingDir({0}, stamp={1}, size={2})'.format(self.path, self.stamp, self.size)
+
+
+def pending_dirs(root):
+    """Return PendingDirs for the .out directories under root that have no
+    state file. The stamp is the start time of the directory, or its mtime
+    if that can not be worked out, and the size is that of its files."""
+    ret = list()
+
+    for path in find_output_dirs(root):
+        try:
+            entries = [x for x in os.scandir(path) if x.is_file(follow_symlinks=False)]
+        except OSError:
+            continue
+
+        files = [x.name for x in entries]
+        if STATE_FILE in files:
+            continue
+
+        stamp = dir_timestamp(path)
+        if stamp is None:
+            stamp = os.stat(path).st_mtime
+
+        ret.append(PendingDir(path, stamp, sum(x.stat().st_size for x in entries), files))
+
+    return ret
+
+
+def ordered(dirs, order):
+    """Return the PendingDirs in the order of a policy in ORDERS."""
+    oldest = sorted(dirs, key=lambda x: (x.stamp, x.path))
+
+    if order == 'oldest':
+        return oldest
+    elif order == 'newest':
+        return oldest[::-1]
+    elif order == 'interleaved':
+        ret = list()
+        while oldest:
+            ret.append(oldest.pop())
+            if oldest:
+                ret.append(oldest.pop(0))
+        return ret
+
+    raise ValueError('{0} is not one of: {1}'.format(order, ', '.join(ORDERS)))
+
+
+class Budget(object):
+    """A limit on the run time in seconds and/or the log bytes processed."""
+
+    def __init__(self, max_time=None, max_bytes=None, clock=time.time):
+        self.max_time = max_time
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._start = clock()
+        self.bytes = 0
+
+    def elapsed(self):
+        """Seconds since the start of the run."""
+        return self._clock() - self._start
+
+    def allows(self, size):
+        """
+        Is there room to process a directory of size bytes? The time it
+        will take is estimated from the rate so far. The first directory
+        is always allowed so that a run makes progress.
+        """
+        if not self.bytes:
+            return self.max_time is None or self.elapsed() < self.max_time
+
+        if self.max_bytes is not None and self.bytes + size > self.max_bytes:
+            return False
+
+        if self.max_time is not None:
+            elapsed = self.elapsed()
+            if elapsed + size * elapsed / self.bytes > self.max_time:
+                return False
+
+        return True
+
+    def spend(self, size):
+        """Count a processed directory of size bytes."""
+        self.bytes += size
+
+
+class DirectoryQueue(object):
+    """The pending directories of a root, in order. A drop in for the
+    os.walk of a roots.Root."""
+
+    def __init__(self, root, order):
+        self._dirs = ordered(pending_dirs(root), order)
+        self.total = len(self._dirs)
+
+    def peek(self):
+        """The next PendingDir, or None when done."""
+        return self._dirs[0] if self._dirs else None
+
+    def next_dir(self):
+        """Return the next (root, dirs, files) entry or None when done."""
+        if not self._dirs:
+            return None
+        pending = self._dirs.pop(0)
+        return pending.path, list(), pending.files
+
+    def backlog(self, now=None):
+        """Return a summary of the directories that are left."""
+        if not self._dirs:
+            return 'no backlog'
+
+        now = now if now is not None else time.time()
+        oldest = min(x.stamp for x in self._dirs)
+        return 'backlog: {n} directories, {b} bytes, oldest {a:.0f}s old'.format(
+            n=len(self._dirs), b=sum(x.size for x in self._dirs), a=now - oldest)
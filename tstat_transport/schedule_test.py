@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tstat_transport.roots import Root, RootScheduler
+from tstat_transport.schedule import Budget, DirectoryQueue, PendingDir, ordered, pending_dirs
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeParser(object):
+    """Takes a second per KB of logs."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.order = list()
+        self.records_sent = 0
+
+    def process_output(self, root, dirs, files):
+        self.clock.now += os.path.getsize(os.path.join(root, 'log_tcp_complete')) / 1000.0
+        self.order.append(os.path.basename(root))
+        return True
+
+
+def stamp(name):
+    return time.mktime(time.strptime(name, '%Y_%m_%d_%H_%M.out'))
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.names = ['2020_06_10_12_{0:02d}.out'.format(x) for x in range(0, 60, 10)]
+        for name in self.names:
+            path = os.path.join(self.root, 'eth0', name)
+            os.makedirs(path)
+            with open(os.path.join(path, 'log_tcp_complete'), 'w') as fh:
+                fh.write('x' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_ordered(self):
+        dirs = [PendingDir(str(x), x, 0, list()) for x in (3, 1, 5, 2, 4)]
+        self.assertEqual([x.stamp for x in ordered(dirs, 'oldest')], [1, 2, 3, 4, 5])
+        self.assertEqual([x.stamp for x in ordered(dirs, 'newest')], [5, 4, 3, 2, 1])
+        self.assertEqual([x.stamp for x in ordered(dirs, 'interleaved')], [5, 1, 4, 2, 3])
+        with self.assertRaises(ValueError):
+            ordered(dirs, 'random')
+
+    def test_pending_dirs(self):
+        with open(os.path.join(self.root, 'eth0', self.names[0], '.processed'), 'w') as fh:
+            fh.write('processed')
+
+        dirs = sorted(pending_dirs(self.root), key=lambda x: x.stamp)
+        self.assertEqual([os.path.basename(x.path) for x in dirs], self.names[1:])
+        self.assertEqual(dirs[0].stamp, stamp(self.names[1]))
+        self.assertEqual(dirs[0].size, 1000)
+        self.assertEqual(dirs[0].files, ['log_tcp_complete'])
+
+    def test_budget(self):
+        clock = Clock()
+        budget = Budget(max_time=10, max_bytes=3000, clock=clock)
+
+        self.assertTrue(budget.allows(5000))
+        budget.spend(1000)
+        clock.now = 4
+        # 1000 more bytes would take another 4s
+        self.assertTrue(budget.allows(1000))
+        self.assertFalse(budget.allows(1600))
+        budget.spend(1000)
+        clock.now = 5
+        self.assertFalse(budget.allows(1001))
+
+        self.assertTrue(Budget(max_time=10, clock=clock).allows(0))
+        clock.now = 20
+        self.assertTrue(Budget(max_bytes=10, clock=clock).allows(100))
+
+    def test_deadline(self):
+        clock = Clock()
+        parser = FakeParser(clock)
+        queue = DirectoryQueue(os.path.join(self.root, 'eth0'), 'newest')
+        self.assertEqual(queue.total, 6)
+
+        scheduler = RootScheduler([Root(self.root, parser, queue)], clock=clock,
+                                  budget=Budget(max_time=3.5, clock=clock))
+        scheduler.run()
+
+        self.assertTrue(scheduler.exhausted)
+        self.assertEqual(parser.order, self.names[::-1][:3])
+
+        backlog = scheduler.backlog()
+        self.assertIn('backlog: 3 directories, 3000 bytes', backlog)
+        self.assertEqual(queue.backlog(now=stamp(self.names[0]) + 60),
+                         'backlog: 3 directories, 3000 bytes, oldest 60s old')
+
+        # the rest fit without a budget
+        scheduler = RootScheduler([Root(self.root, parser, queue)], clock=clock)
+        scheduler.run()
+        self.assertFalse(scheduler.exhausted)
+        self.assertEqual(parser.order[3:], self.names[:3][::-1])
+        self.assertEqual(queue.backlog(), 'no backlog')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+"""
+Column schemas for the tstat logs.
+
+Every column of a log gets a single converter that is picked once per
+file - either from the built in tables below or inferred from the first
+rows of the file - rather than guessing the type of every value when it
+is accessed.
+"""
+
+from .common import TstatParseException
+
+INT = 'int'
+FLOAT = 'float'
+STR = 'str'
+
+INFER_ROWS = 20
+
+
+class TstatSchemaException(TstatParseException):
+    """Raised when a log does not match the schema it is expected to have."""
+    pass
+
+
+def _to_float(val):
+    """Floats are rounded to three decimal places to avoid small values
+    being rendered in scientific notation."""
+    return round(float(val), 3)
+
+
+def _to_str(val):
+    """Values may come from the bytes-level reader."""
+    if isinstance(val, bytes):
+        return val.decode('utf-8', 'replace')
+    return val
+
+
+CONVERTERS = {
+    INT: int,
+    FLOAT: _to_float,
+    STR: _to_str,
+}
+
+
+def _directional(col_type, *names):
+    """Expand column names to their c_ and s_ variants."""
+    ret = dict()
+    for i in names:
+        ret['c_' + i] = col_type
+        ret['s_' + i] = col_type
+    return ret
+
+
+def _static(col_type, *names):
+    return dict((i, col_type) for i in names)
+
+
+TCP_TYPES = dict()
+TCP_TYPES.update(_directional(STR, 'ip', 'tls_SNI', 'tls_SCN'))
+TCP_TYPES.update(_directional(
+    INT, 'port', 'pkts_all', 'rst_cnt', 'ack_cnt', 'ack_cnt_p', 'bytes_uniq',
+    'pkts_data', 'bytes_all', 'pkts_retx', 'bytes_retx', 'pkts_ooo', 'syn_cnt',
+    'fin_cnt', 'isint', 'iscrypto', 'rtt_cnt', 'ttl_min', 'ttl_max', 'f1323_opt',
+    'tm_opt', 'win_scl', 'sack_opt', 'sack_cnt', 'mss', 'mss_max', 'mss_min',
+    'win_max', 'win_min', 'win_0', 'cwin_max', 'cwin_min', 'cwin_ini', 'pkts_rto',
+    'pkts_fs', 'pkts_reor', 'pkts_dup', 'pkts_unk', 'pkts_fc', 'pkts_unrto',
+    'pkts_unfs', 'syn_retx', 'pkts_push', 'npnalpn', 'appdataB'))
+TCP_TYPES.update(_directional(
+    FLOAT, 'first', 'last', 'first_ack', 'rtt_avg', 'rtt_min', 'rtt_max', 'rtt_std',
+    'last_handshakeT', 'appdataT'))
+TCP_TYPES.update(_static(
+    INT, 'con_t', 'p2p_t', 'http_t', 'p2p_st', 'ed2k_data', 'ed2k_sig', 'ed2k_c2s',
+    'ed2k_c2c', 'ed2k_chat', 'http_req_cnt', 'http_res_cnt', 'c_tls_sesid'))
+TCP_TYPES.update(_static(FLOAT, 'first', 'last', 'durat', 'req_tm', 'res_tm'))
+TCP_TYPES.update(_static(STR, 'http_res', 'fqdn', 'dns_rslv'))
+
+UDP_TYPES = dict()
+UDP_TYPES.update(_directional(STR, 'ip'))
+UDP_TYPES.update(_directional(
+    INT, 'port', 'bytes_all', 'pkts_all', 'isint', 'iscrypto', 'type'))
+UDP_TYPES.update(_directional(FLOAT, 'first_abs', 'durat'))
+UDP_TYPES.update(_static(STR, 'fqdn'))
+
+# log_video_complete is the tcp layout plus the video columns
+VIDEO_TYPES = dict(TCP_TYPES)
+VIDEO_TYPES.update(_static(
+    INT, 'vd_type_cont', 'vd_type_pay', 'yt_itag', 'vd_width', 'vd_height', 'yt_seek',
+    'yt_red_mode', 'yt_red_cnt', 'yt_mobile', 'yt_stream'))
+VIDEO_TYPES.update(_static(FLOAT, 'vd_dur', 'vd_rate_tot'))
+VIDEO_TYPES.update(_static(STR, 'yt_id16_46', 'yt_id11'))
+
+# log type -> column types, see logtypes.register(). Columns that are not
+# in the table are inferred.
+SCHEMAS = dict(
+    tcp=TCP_TYPES,
+    udp=UDP_TYPES,
+    video=VIDEO_TYPES,
+    tcp_nocomplete=TCP_TYPES,
+)
+
+
+def sanitize_key(key):
+    """Remove any jank from a log header key so we have a 'pure' key name
+    stripped of garbage and the :nn index part.
+
+    The headers start and look like this:
+
+    #15#c_ip:1 c_port:2 c_pkts_all:3
+
+    If this finds a # character in the key, it shaves everything before
+    the right-most # character off. Then a split is done on ':' to produce
+    the "pure" key.
+    """
+    if key.rfind('#') > -1:
+        key = key[key.rfind('#') + 1:]
+    return key.split(':')[0]
+
+
+def infer_type(values):
+    """Return the narrowest type that every one of the sample values
+    can be converted to."""
+    for col_type in (INT, FLOAT):
+        try:
+            for i in values:
+                CONVERTERS[col_type](i)
+        except ValueError:
+            continue
+        if values:
+            return col_type
+    return STR
+
+
+class LogSchema(object):
+    """
+    The typed layout of a single log file.
+
+    Built from the header line of the file, limited to the columns that
+    will actually be used. Raises TstatSchemaException if any of those
+    columns are missing from the header - which generally means the log
+    was written by a tstat version with a different layout.
+    """
+
+    def __init__(self, log_type, header, columns=None):
+        self.log_type = log_type
+        self.fields = [sanitize_key(x) for x in header]
+
+        index = dict((name, i) for i, name in enumerate(self.fields))
+
+        if columns is None:
+            columns = self.fields
+
+        missing = [x for x in columns if x not in index]
+        if missing:
+            msg = 'schema drift: the {t} log is missing columns {m} - '.format(
+                t=log_type, m=', '.join(missing))
+            msg += 'was it written by an unsupported tstat version?'
+            raise TstatSchemaException(msg)
+
+        self.columns = tuple(columns)
+        self._types = dict(SCHEMAS.get(log_type, {}))
+        self._indexes = [index[x] for x in self.columns]
+        self._converters = None
+
+        self.pending = [x for x in self.columns if x not in self._types]
+        if not self.pending:
+            self._compile()
+
+    def _compile(self):
+        self._converters = [
+            (name, i, CONVERTERS[self._types[name]])
+            for name, i in zip(self.columns, self._indexes)
+        ]
+
+    def infer(self, rows):
+        """Infer the types of any columns not in the built in table from
+        a sample of rows. The inferred types are verified as every
+        following row is converted."""
+        for name in self.pending:
+            i = self.fields.index(name)
+            self._types[name] = infer_type([x[i] for x in rows])
+        self.pending = []
+        self._compile()
+
+    def column_type(self, name):
+        """Return the type name of a column."""
+        return self._types.get(name)
+
+    def valid_length(self, values):
+        """Does a split log line have the same number of values as the
+        header? Some logs have a bogus last line, and a line that is too
+        long usually means some kind of append error."""
+        return len(values) == len(self.fields)
+
+    def convert(self, values):
+        """Convert a split log line to a dict of typed values. Raises
+        ValueError naming the column if a value does not match its type."""
+        row = dict()
+        for name, i, conv in self._converters:
+            try:
+                row[name] = conv(values[i])
+            except ValueError:
+                raise ValueError('column {c}: expected {t}, got {v!r}'.format(
+                    c=name, t=self._types[name], v=values[i]))
+        return row
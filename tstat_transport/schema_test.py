@@ -0,0 +1,61 @@
+import csv
+import unittest
+
+from tstat_transport.format import TcpCapsule
+from tstat_transport.schema import (
+    FLOAT,
+    INT,
+    STR,
+    LogSchema,
+    TstatSchemaException,
+    sanitize_key,
+)
+
+TCP_LOG = 'test_data/parse_data.out/log_tcp_complete'
+
+
+class TestSchemaMethods(unittest.TestCase):
+
+    def __rows__(self, path):
+        with open(path, 'r') as csvfile:
+            return list(csv.reader(csvfile, delimiter=' ', quoting=csv.QUOTE_NONE))
+
+    def test_sanitize_key(self):
+        self.assertEqual(sanitize_key('#15#c_ip:1'), 'c_ip')
+        self.assertEqual(sanitize_key('#c_ip:1'), 'c_ip')
+        self.assertEqual(sanitize_key('durat:31'), 'durat')
+
+    def test_typed_rows(self):
+        rows = self.__rows__(TCP_LOG)
+        schema = LogSchema('tcp', rows[0], TcpCapsule.COLUMNS)
+        self.assertEqual(schema.pending, [])
+        row = schema.convert(rows[1])
+        self.assertEqual(set(row.keys()), set(TcpCapsule.COLUMNS))
+        self.assertIsInstance(row['c_ip'], str)
+        self.assertIsInstance(row['c_port'], int)
+        self.assertIsInstance(row['durat'], float)
+        self.assertIsInstance(row['s_rtt_avg'], float)
+
+    def test_inferred_columns(self):
+        rows = self.__rows__(TCP_LOG)
+        schema = LogSchema('unknown', rows[0], ('c_ip', 'c_port', 'first'))
+        self.assertEqual(len(schema.pending), 3)
+        schema.infer(rows[1:])
+        self.assertEqual(schema.column_type('c_ip'), STR)
+        self.assertEqual(schema.column_type('c_port'), INT)
+        self.assertEqual(schema.column_type('first'), FLOAT)
+
+    def test_schema_drift(self):
+        rows = self.__rows__(TCP_LOG)
+        with self.assertRaises(TstatSchemaException):
+            LogSchema('tcp', rows[0][:20], TcpCapsule.COLUMNS)
+
+        schema = LogSchema('tcp', rows[0], TcpCapsule.COLUMNS)
+        # a duplicated header line
+        with self.assertRaises(ValueError):
+            schema.convert(rows[0])
+        self.assertFalse(schema.valid_length(rows[1][:-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+Optional per directory summary of all of the flows in the logs.
+
+The threshold drops most flows, so the archive does not otherwise see
+the overall traffic a sensor observed. The summary is accumulated from
+every flow (both directions) as the rows are formatted - before the
+threshold, dedup or stages - and sent as extra "summary" records per
+directory, one per log type (labelled with its flow_type) with:
+
+    * flow counts, bytes and packets per direction
+    * log2 histograms of the flow size in bytes, the duration in ms and
+      the average rtt in ms, as [upper bound, count] pairs - a bucket
+      counts the values from half its upper bound up to it, and the
+      first one (upper bound 1) the values under 1.
+
+The values are buffered and folded into the totals and histograms a
+block at a time with builtins (sum, map, Counter) rather than one at a
+time, which keeps the cost per flow down. Configured with the optional
+[summary] stanza:
+
+    [summary]
+    # the histograms to include - all of them by default
+    histograms = size, duration, rtt
+"""
+
+import collections
+import itertools
+import json
+import operator
+import os
+
+from .common import TstatConfigException
+from .format import DIRECTIONS, document_template
+
+HISTOGRAMS = ('size', 'duration', 'rtt')
+
+# flows buffered per log type and direction before they are folded in
+FOLD_SIZE = 4096
+
+
+class Histogram(object):
+    """Counts of values in power of 2 buckets."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def update(self, values):
+        """Count an iterable of ints of 0 or more."""
+        self.counts.update(map(int.bit_length, values))
+
+    def to_list(self):
+        """The [upper bound, count] pairs, smallest first."""
+        return [[2 ** i, self.counts[i]] for i in sorted(self.counts)]
+
+
+class _LogSummary(object):
+    """The totals and histograms of one log type."""
+
+    def __init__(self, histograms, flow_type):
+        self.flow_type = flow_type
+        self.start = None
+        self.end = None
+        self.totals = dict((x, [0, 0, 0]) for x in DIRECTIONS)
+        self.histograms = collections.OrderedDict((x, Histogram()) for x in histograms)
+        self.buffers = dict((x, list()) for x in DIRECTIONS)
+
+    def fold(self, direction):
+        """Fold the buffered (bits, packets, duration, rtt, start, end)
+        values of a direction into the totals, histograms and time span."""
+        buf = self.buffers[direction]
+        if not buf:
+            return
+
+        bits, packets, durations, rtts, starts, ends = zip(*buf)
+        self.buffers[direction] = list()
+
+        totals = self.totals[direction]
+        totals[0] += len(bits)
+        totals[1] += sum(bits) // 8
+        totals[2] += sum(packets)
+
+        histograms = self.histograms
+        if 'size' in histograms:
+            histograms['size'].update(map(operator.rshift, bits, itertools.repeat(3)))
+        if 'duration' in histograms:
+            histograms['duration'].update(
+                map(int, map(operator.mul, durations, itertools.repeat(1000))))
+        if 'rtt' in histograms:
+            # tstat logs an average of 0 if there were no rtt samples
+            histograms['rtt'].update(map(int, filter(None, rtts)))
+
+        start, end = min(starts), max(ends)
+        self.start = start if self.start is None else min(self.start, start)
+        self.end = end if self.end is None else max(self.end, end)
+
+    def to_json_packet(self):
+        ret = collections.OrderedDict()
+        for direction in DIRECTIONS:
+            flows, num_bytes, packets = self.totals[direction]
+            ret[direction] = collections.OrderedDict(
+                [('num_flows', flows), ('num_bytes', num_bytes), ('num_packets', packets)])
+        ret['histograms'] = collections.OrderedDict(
+            (k, v.to_list()) for k, v in self.histograms.items())
+        return ret
+
+
+class SummaryRecord(object):
+    """The summary record of one log type of a directory."""
+
+    def __init__(self, directory, template, log_type, log):
+        self._directory = directory
+        self._template = template
+        self._log_type = log_type
+        self._log = log
+
+    def to_json_packet(self):
+        """Generate the summary document."""
+        return collections.OrderedDict(
+            [
+                ('type', 'summary'),
+                ('interval', 600),
+                ('values', collections.OrderedDict(
+                    [(self._log_type, self._log.to_json_packet())])),
+                ('meta', collections.OrderedDict(
+                    [
+                        ('directory', os.path.basename(self._directory)),
+                        ('sensor_id', self._template.sensor_id),
+                        ('instance_id', self._template.instance_id),
+                        ('flow_type', self._log.flow_type),
+                    ]
+                )),
+                ('start', self._log.start),
+                ('end', self._log.end),
+            ]
+        )
+
+    def to_json_string(self):
+        """Return the document serialized to a JSON string."""
+        return json.dumps(self.to_json_packet())
+
+
+class DirectorySummary(object):
+    """The summary of the flows of one directory."""
+
+    def __init__(self, directory, template, histograms=HISTOGRAMS, log_types=()):
+        self.directory = directory
+        self._template = template
+        self._histograms = histograms
+        self._rtt = 'rtt' in histograms
+        # the order of the records - the logs are read concurrently
+        self._order = list(log_types)
+        self._logs = dict()
+        self.flows = 0
+
+    def add(self, capsule):
+        """Count one direction of a flow."""
+        log = self._logs.get(capsule.log_type)
+        if log is None:
+            log = self._logs[capsule.log_type] = _LogSummary(self._histograms,
+                                                             capsule.FLOW_TYPE)
+
+        rtt = capsule.rtt if self._rtt else None
+        buf = log.buffers[capsule.direction]
+        buf.append((capsule.num_bits, capsule.num_packets, capsule.duration,
+                    rtt[1] if rtt is not None else None, capsule.start, capsule.end))
+        self.flows += 1
+
+        if len(buf) >= FOLD_SIZE:
+            log.fold(capsule.direction)
+
+    def records(self):
+        """Return a SummaryRecord per log type with flows, in the order of
+        the log types passed in (then the order they were seen)."""
+        for log in self._logs.values():
+            for direction in DIRECTIONS:
+                log.fold(direction)
+
+        order = self._order
+        return [SummaryRecord(self.directory, self._template, x, self._logs[x])
+                for x in sorted(self._logs, key=lambda x: order.index(x) if x in order
+                                else len(order))]
+
+
+class Summarizer(object):
+    """Hand out a DirectorySummary per directory."""
+
+    def __init__(self, config, histograms=HISTOGRAMS):
+        self._config = config
+        self._histograms = tuple(histograms)
+        self.directories = 0
+        self.flows = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a Summarizer from the [summary] config stanza. Returns None
+        if the stanza is not present."""
+        if 'summary' not in config.config.sections():
+            return None
+
+        opts = config.get_summary_opts()
+        histograms = HISTOGRAMS
+
+        if opts.get('histograms') is not None:
+            histograms = [x.strip() for x in opts['histograms'].split(',') if x.strip()]
+            bad = [x for x in histograms if x not in HISTOGRAMS]
+            if bad:
+                raise TstatConfigException('[summary] histograms must be some of: {0}'.format(
+                    ', '.join(HISTOGRAMS)))
+
+        return cls(config, histograms)
+
+    def open(self, directory, log_types=()):
+        """Return a DirectorySummary for a directory, whose records are
+        sent in the order of log_types."""
+        return DirectorySummary(directory, document_template(None, None, self._config),
+                                self._histograms, log_types)
+
+    def close(self, summary):
+        """Count a finished DirectorySummary."""
+        self.directories += 1
+        self.flows += summary.flows
+
+    def stats(self):
+        """Return a summary."""
+        return 'summary: {f} flows in {d} directories'.format(
+            f=self.flows, d=self.directories)
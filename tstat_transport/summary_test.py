@@ -0,0 +1,107 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule, TstatConfigException
+from tstat_transport.format import TcpCapsule, UdpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.summary import Histogram, Summarizer
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+LOG_DIR = 'test_data/parse_data.out'
+TCP_LOG = os.path.join(LOG_DIR, 'log_tcp_complete')
+UDP_LOG = os.path.join(LOG_DIR, 'log_udp_complete')
+
+
+class TestSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def config(self, threshold=0, histograms=None):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory=self.root,
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=threshold)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        config.config.add_section('summary')
+        if histograms is not None:
+            config.config.set('summary', 'histograms', histograms)
+        return config
+
+    def test_histogram(self):
+        hist = Histogram()
+        hist.update([0, 1, 2, 3, 4, 1000, 1023, 1024, 1025])
+        self.assertEqual(hist.to_list(), [[1, 1], [2, 1], [4, 2], [8, 1], [1024, 2],
+                                          [2048, 2]])
+
+    def test_totals(self):
+        config = self.config(threshold=1000)
+        summary = Summarizer.from_config(config).open(LOG_DIR)
+
+        capsules = list()
+        for log_type, path, capsule in (('tcp', TCP_LOG, TcpCapsule), ('udp', UDP_LOG, UdpCapsule)):
+            for row in LogReader(path, log_type, capsule.COLUMNS):
+                # nothing passes the threshold, but everything is counted
+                self.assertEqual(capsule_factory(row, log_type, config, summary=summary), [])
+                capsules += capsule_factory(row, log_type, self.config())
+
+        # the udp log has no rows
+        records = summary.records()
+        self.assertEqual(len(records), 1)
+
+        doc = json.loads(records[0].to_json_string())
+        self.assertEqual(doc['type'], 'summary')
+        self.assertEqual(doc['meta']['directory'], 'parse_data.out')
+        self.assertEqual(doc['meta']['sensor_id'], 'SensorName')
+        self.assertEqual(summary.flows, len(capsules))
+        self.assertEqual(doc['start'], min(x.start for x in capsules))
+
+        tcp = [x for x in capsules if x.protocol == 'tcp' and x.direction == 'in']
+        self.assertEqual(doc['values']['tcp']['in'], dict(
+            num_flows=len(tcp), num_bytes=sum(x.num_bits // 8 for x in tcp),
+            num_packets=sum(x.num_packets for x in tcp)))
+        self.assertEqual(sum(x[1] for x in doc['values']['tcp']['histograms']['size']),
+                         len([x for x in capsules if x.protocol == 'tcp']))
+        self.assertTrue(doc['values']['tcp']['histograms']['rtt'])
+        self.assertEqual(doc['meta']['flow_type'], 'tstat')
+
+    def test_config(self):
+        summarizer = Summarizer.from_config(self.config(histograms='size'))
+        summary = summarizer.open(LOG_DIR)
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            capsule_factory(row, 'tcp', self.config(), summary=summary)
+        self.assertEqual(list(summary.records()[0].to_json_packet()['values']['tcp']['histograms']),
+                         ['size'])
+
+        with self.assertRaises(TstatConfigException):
+            Summarizer.from_config(self.config(histograms='size, jitter'))
+
+    def test_parser(self):
+        path = os.path.join(self.root, 'logs.out')
+        shutil.copytree(LOG_DIR, path, ignore=shutil.ignore_patterns('.processed'))
+        parser = TstatParse(self.config(threshold=1000))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            parser.process_output(path, [], os.listdir(path))
+
+        # only the summary is sent, in a message of its own
+        messages = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(len(messages), 1)
+        self.assertEqual([x['type'] for x in messages[0]], ['summary'])
+        self.assertEqual(list(messages[0][0]['values']), ['tcp'])
+        self.assertTrue(messages[0][0]['values']['tcp']['out']['num_bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,11 +2,17 @@
 Classes to handle the sending of the json-formatted by the appropriate transport layers.
 """
 
+import gzip
+import json
 import logging
 import warnings
 import ssl
+import time
+import zlib
 
-from .util import log
+from .pool import BrokerPool
+from .ratelimit import RateLimiter
+from .util import log, split_endpoints
 import pika
 from pika.adapters.blocking_connection import BlockingConnection as PikaConnection
 from .common import (
@@ -18,6 +24,8 @@ from .common import (
 
 TRANSPORT_DEFAULT = 'rabbit'
 
+SHARD_KEYS = ('pair', 'src_ip', 'dst_ip')
+
 
 class BaseTransport(TstatBase):
     """Base class for the transport-specific classes."""
@@ -25,8 +33,10 @@ class BaseTransport(TstatBase):
     def __init__(self, config_capsule, init_user_pass=False):
         super(BaseTransport, self).__init__(config_capsule)
 
-        self._host = self._config.get_cfg_val('host')
         self._port = self._config.get_cfg_val('port', as_int=True)
+        # host can be a comma separated list of host[:port] brokers.
+        self._endpoints = split_endpoints(self._config.get_cfg_val('host'), self._port)
+        self._host = self._endpoints[0][0]
 
         # Initialize user/pass from ini file if transport needs it.
         if init_user_pass:
@@ -34,6 +44,28 @@ class BaseTransport(TstatBase):
             self._password = self._safe_cfg_val('password')
 
         self._payload = None
+        self._shard = None
+
+        # --replay publishes compressed, to an alternate routing key/queue
+        # so a backfill can be consumed separately from the live data.
+        self._replay = getattr(self._options, 'replay', None) is not None
+
+        # Optionally partition the payload into shards by a hash of the
+        # endpoints so consumers can scale out.
+        self._shards = self._optional_cfg_val('shards', 1, as_int=True)
+        self._shard_key = self._optional_cfg_val('shard_key', 'pair')
+
+        if self._shards < 1:
+            raise TstatTransportException('[shards] must be 1 or more')
+        if self._shard_key not in SHARD_KEYS:
+            raise TstatTransportException('[shard_key] must be one of: {0}'.format(
+                ', '.join(SHARD_KEYS)))
+
+        # Optionally cap the send rate - see the ratelimit module.
+        try:
+            self._limiter = RateLimiter.from_config(self._config)
+        except TstatConfigException as ex:
+            raise TstatTransportException(str(ex))
 
         # Flip on logging.DEBUG to diagnose issues with the
         # transport subclasses (rabbit connection issues, etc).
@@ -52,6 +84,20 @@ class BaseTransport(TstatBase):
                 value, self._options.transport)
             raise TstatTransportException(msg)
 
+    def _optional_cfg_val(self, value, default, **kwargs):
+        """
+        Get an optional transport specific config value, returning
+        default if it is not set.
+        """
+        try:
+            return self._config.get_cfg_val(value, **kwargs)
+        except TstatConfigException:
+            if self._config.config.has_option(self._options.transport, value):
+                msg = '[{0}] config value is not valid for transport [{1}]'.format(
+                    value, self._options.transport)
+                raise TstatTransportException(msg)
+            return default
+
     def send(self):
         """
         Transport/driver specific code to send the payload.
@@ -59,14 +105,57 @@ class BaseTransport(TstatBase):
         """
         raise NotImplementedError
 
-    def set_payload(self, p_load):
+    def set_payload(self, p_load, shard=None):
         """
-        Method to set the payload to be sent across the wire.
+        Method to set the payload to be sent across the wire, and
+        the shard it belongs to (see shard_for()).
 
         Can be overridden in subclasses in case there needs to be
         any additional massaging of the payload before sending.
         """
         self._payload = p_load
+        self._shard = shard
+
+    def shard_for(self, obj):
+        """
+        Return the shard number for a capsule. The hash is stable across
+        runs, and with the default "pair" key both directions of a flow
+        between two endpoints go to the same shard. Records without
+        endpoints (rollups, remainders and summaries) are hashed by their
+        meta stanza and start time instead - ie: the group key of a
+        rollup, or the directory of a summary - so they are spread across
+        the shards too.
+        """
+        if self._shards == 1:
+            return 0
+
+        if hasattr(obj, 'meta_map'):
+            meta = obj.meta_map()
+            if self._shard_key == 'pair':
+                key = '|'.join(sorted((str(meta.get('src_ip')), str(meta.get('dst_ip')))))
+            else:
+                key = str(meta.get(self._shard_key))
+        else:
+            doc = obj.to_json_packet()
+            key = json.dumps([doc.get('meta'), doc.get('start')], sort_keys=True)
+
+        return zlib.crc32(key.encode('utf-8')) % self._shards
+
+    @property
+    def shards(self):
+        """Number of shards the payload is partitioned into."""
+        return self._shards
+
+    def close(self):
+        """Close any connections - they are opened again if the transport
+        is used after that. Extend in subclass."""
+        pass
+
+    def stats(self):
+        """Return a summary of what was sent, or None. Extend in subclass."""
+        if self._limiter is not None:
+            return self._limiter.stats()
+        return None
 
     def warn(self, msg):  # pylint: disable=no-self-use
         """Emit a warning."""
@@ -79,8 +168,20 @@ class RabbitMQTransport(BaseTransport):
 
     If connection requires special ssl_options, these can be set in the
     optional [ssl_options] stanza in the configuration file.
+
+    If more than one broker is given in the host value, the payloads are
+    spread round robin across them, and a broker that fails is ejected
+    from the pool until a reconnect to it succeeds (see BrokerPool).
     """
 
+    # errors that mean the connection to a broker is no good, as opposed
+    # to the broker refusing a message (UnroutableError, NackError).
+    CONNECTION_ERRORS = (
+        pika.exceptions.AMQPConnectionError,
+        pika.exceptions.AMQPChannelError,
+        OSError,
+    )
+
     def __init__(self, config_capsule):
         super(RabbitMQTransport, self).__init__(config_capsule, init_user_pass=True)
 
@@ -88,12 +189,25 @@ class RabbitMQTransport(BaseTransport):
         # allow any configuration errors to be raised first.
 
         self._use_ssl = self._safe_cfg_val('use_ssl', as_bool=True)
-        self._connect_info = self._connection_params()
+        self._vhost = self._safe_cfg_val('vhost')
+        self._heartbeat = self._optional_cfg_val('heartbeat', None, as_int=True)
+        self._min_backoff = self._optional_cfg_val('min_backoff', 1, as_int=True)
+        self._max_backoff = self._optional_cfg_val('max_backoff', 60, as_int=True)
+        self._connect_info = [self._connection_params(h, p) for h, p in self._endpoints]
 
         self._queue = self._safe_cfg_val('queue')
         self._exchange = self._safe_cfg_val('exchange')
         self._routing_key = self._safe_cfg_val('routing_key')
 
+        if self._replay:
+            self._queue = self._optional_cfg_val('replay_queue', self._queue + '.replay')
+            self._routing_key = self._optional_cfg_val(
+                'replay_routing_key', self._routing_key + '.replay')
+
+        self._pool = BrokerPool(
+            self._endpoints, self._connect, connection_errors=self.CONNECTION_ERRORS,
+            min_backoff=self._min_backoff, max_backoff=self._max_backoff, log=self._log)
+
         # if _options.no_transport is set, let the configuration
         # validate and exit.
 
@@ -101,85 +215,168 @@ class RabbitMQTransport(BaseTransport):
             self._log('rabbit.init', '--no-transport set, not opening connections')
             return
 
-        try:
-            self._connection = PikaConnection(self._connect_info)
-        except pika.exceptions.ConnectionClosed:
-            msg = 'unable to connect to rabbit at: {0}'.format(self._connect_info)
+        if not self._pool.connect_all():
+            msg = 'unable to connect to rabbit at: {0}'.format(
+                ', '.join('{0} ({1})'.format(x, x.last_error) for x in self._pool.endpoints))
             msg += ' - retry with --debug flag to see verbose connection output'
             self._log('rabbit.init.error', msg)
             raise TstatTransportException(msg)
 
-        if not self._connection.is_open:
-            msg = 'connection object successfully initialized, but no longer open.'
-            raise TstatTransportException(msg)
+        self._log('rabbit.init.connection', 'status - {0} of {1} brokers connected'.format(
+            len(self._pool.healthy()), len(self._pool.endpoints)))
+
+    def _connect(self, endpoint):
+        """Open a connection and channel to a broker, declare the queues
+        and enable delivery confirmation. Passed to the BrokerPool."""
+        connection = PikaConnection(self._connect_info[self._pool.endpoints.index(endpoint)])
 
-        self._log('rabbit.init.connection', 'status - is_open: {0}'.format(
-            self._connection.is_open))
+        if not connection.is_open:
+            raise pika.exceptions.AMQPConnectionError(
+                'connection object successfully initialized, but no longer open.')
 
-        # set up the channel
-        self._channel = self._connection.channel()
-        # just set the queue, presume opts set on server.
-        self._channel.queue_declare(
-            queue=self._queue, **self._config.get_rabbit_queue_opts())
-        # enable message delivery confirmation
-        self._channel.confirm_delivery()
+        connection.add_on_connection_blocked_callback(self._on_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_unblocked)
 
-    def _connection_params(self):
+        try:
+            channel = connection.channel()
+            # just set the queue, presume opts set on server.
+            if self._shards == 1:
+                channel.queue_declare(queue=self._queue, **self._config.get_rabbit_queue_opts())
+            else:
+                self._declare_shards(channel)
+            # enable message delivery confirmation
+            channel.confirm_delivery()
+        except Exception:
+            connection.close()
+            raise
+
+        return connection, channel
+
+    def _on_blocked(self, connection, method):  # pylint: disable=unused-argument
+        """The broker is low on resources - slow down."""
+        self._log('rabbit.blocked', 'broker sent connection.blocked: {0}'.format(
+            getattr(method.method, 'reason', '')))
+        if self._limiter is not None:
+            self._limiter.blocked()
+
+    def _on_unblocked(self, connection, method):  # pylint: disable=unused-argument
+        self._log('rabbit.unblocked', 'broker sent connection.unblocked')
+        if self._limiter is not None:
+            self._limiter.unblocked()
+
+    @property
+    def _connection(self):
+        """Connection to the first healthy broker."""
+        healthy = self._pool.healthy()
+        return healthy[0].connection if healthy else None
+
+    @property
+    def _channel(self):
+        """Channel to the first healthy broker."""
+        healthy = self._pool.healthy()
+        return healthy[0].channel if healthy else None
+
+    def _shard_name(self, name, shard):
+        """Per shard queue/routing key name - ie: netsage_tstat.3"""
+        if self._shards == 1 or shard is None:
+            return name
+        return '{0}.{1}'.format(name, shard)
+
+    def _declare_shards(self, channel):
+        """Declare the per shard queues, and bind them to the exchange if
+        one is set (the default exchange routes on queue name)."""
+        for i in range(self._shards):
+            queue = self._shard_name(self._queue, i)
+            channel.queue_declare(queue=queue, **self._config.get_rabbit_queue_opts())
+            if self._exchange:
+                channel.queue_bind(
+                    queue=queue, exchange=self._exchange,
+                    routing_key=self._shard_name(self._routing_key, i))
+
+    def _connection_params(self, host, port):
         """Generate pika connection parameters object/options."""
 
         credentials = pika.PlainCredentials(self._username, self._password)
 
+        kwargs = dict(
+            host=host,
+            port=port,
+            virtual_host=self._vhost,
+            credentials=credentials,
+        )
+
+        if self._heartbeat is not None:
+            kwargs['heartbeat'] = self._heartbeat
+
         if self._use_ssl:
             config_options = self._config.get_ssl_opts()
             options = ssl.SSLContext()
             if config_options is not None:
                 options = ssl.wrap_socket(**config_options)
 
-            ssl_options = pika.SSLOptions(options, self._host)
-            params = pika.ConnectionParameters(
-                    host=self._host,
-                    port=self._port,
-                    virtual_host=self._safe_cfg_val('vhost'),
-                    credentials=credentials,
-                    ssl_options=ssl_options
-                )
-        else:
-            params = pika.ConnectionParameters(
-                host=self._host,
-                port=self._port,
-                virtual_host=self._safe_cfg_val('vhost'),
-                credentials=credentials)
+            kwargs['ssl_options'] = pika.SSLOptions(options, host)
+
+        params = pika.ConnectionParameters(**kwargs)
 
         self._verbose_log('_connection_params.end', params)
 
         return params
 
+    def _publish(self, channel, body, encoding):
+        channel.basic_publish(
+            exchange=self._exchange,
+            routing_key=self._shard_name(self._routing_key, self._shard),
+            body=body,
+            properties=pika.BasicProperties(
+                content_type='application/json',
+                content_encoding=encoding,
+                delivery_mode=1,
+            ),
+            mandatory=True
+        )
+
     def send(self):
-        """Send the payload to the remote server."""
+        """Send the payload to a broker in the pool."""
 
         self._verbose_log('rabbit.send', 'publishing message')
 
-        if self._connection.is_open:
-            try:
-                self._channel.basic_publish(
-                    exchange=self._exchange,
-                    routing_key=self._routing_key,
-                    body=self._payload,
-                    properties=pika.BasicProperties(
-                        content_type='application/json',
-                        delivery_mode=1,
-                    ),
-                mandatory=True
-                )
-                self._log('rabbit.send', 'basic_publish success')
-            except:
-                msg = 'could not confirm publish success'
-                self._log('rabbit.send.error', msg)
-                raise TstatTransportException(msg)
+        if self._replay:
+            body, encoding = gzip.compress(self._payload.encode('utf-8')), 'gzip'
         else:
-            msg = 'rabbit mq connection is no longer open - send failed.'
+            body, encoding = self._payload, None
+
+        if self._limiter is not None:
+            self._limiter.acquire(len(body))
+
+        start = time.time()
+        try:
+            endpoint = self._pool.publish(
+                lambda channel: self._publish(channel, body, encoding), len(body))
+        except TstatTransportException as ex:
+            msg = 'send failed - {0}'.format(str(ex))
             self._log('rabbit.send.error', msg)
             raise TstatTransportException(msg)
+        except Exception:
+            msg = 'could not confirm publish success'
+            self._log('rabbit.send.error', msg)
+            raise TstatTransportException(msg)
+
+        # the publish blocks until it is confirmed
+        if self._limiter is not None:
+            self._limiter.observe(time.time() - start)
+
+        self._log('rabbit.send', 'basic_publish success to {endpoint}', endpoint=endpoint)
+
+    def close(self):
+        """Close the broker connections."""
+        self._pool.close()
+
+    def stats(self):
+        """Return the per broker summary."""
+        ret = 'rabbit: {0}'.format(self._pool.stats())
+        if self._limiter is not None:
+            ret += ', ' + self._limiter.stats()
+        return ret
 
 
 TRANSPORT_MAP = dict(
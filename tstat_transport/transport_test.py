@@ -0,0 +1,115 @@
+import argparse
+import unittest
+
+from tstat_transport.common import ConfigurationCapsule
+from tstat_transport.format import TcpCapsule, capsule_factory
+from tstat_transport.parse import TstatParse
+from tstat_transport.reader import LogReader
+from tstat_transport.transport import RabbitMQTransport
+from tstat_transport.util import _log
+
+OPTIONS_CONFIG = 'test_data/test_config.ini'
+TCP_LOG = 'test_data/parse_data.out/log_tcp_complete'
+
+
+class TestTransportMethods(unittest.TestCase):
+
+    def __load__config__(self, **rabbit_opts):
+        ns = argparse.Namespace(verbose=False, transport='rabbit', directory='test_data',
+                                debug=False, no_transport=True, sensor='SensorName',
+                                instance='instanceID', threshold=0)
+        config = ConfigurationCapsule(ns, _log, OPTIONS_CONFIG)
+        for k, v in rabbit_opts.items():
+            config.config.set('rabbit', k, v)
+        return config
+
+    def __capsules__(self, config):
+        capsules = list()
+        for row in LogReader(TCP_LOG, 'tcp', TcpCapsule.COLUMNS):
+            capsules += capsule_factory(row, 'tcp', config)
+        return capsules
+
+    def test_unsharded(self):
+        config = self.__load__config__()
+        transport = RabbitMQTransport(config)
+        self.assertEqual(transport.shards, 1)
+        self.assertEqual(transport._shard_name('netsage_tstat', 3), 'netsage_tstat')
+
+    def test_shard_for(self):
+        config = self.__load__config__(shards='4')
+        transport = RabbitMQTransport(config)
+        self.assertEqual(transport.shards, 4)
+        self.assertEqual(transport._shard_name('netsage_tstat', 3), 'netsage_tstat.3')
+
+        pairs = dict()
+        for capsule in self.__capsules__(config):
+            shard = transport.shard_for(capsule)
+            self.assertTrue(0 <= shard < 4)
+            meta = capsule.meta_map()
+            pair = tuple(sorted((meta['src_ip'], meta['dst_ip'])))
+            # both directions of a pair land on the same shard
+            self.assertEqual(pairs.setdefault(pair, shard), shard)
+
+        class Flow(object):
+            def __init__(self, src_ip, dst_ip):
+                self._meta = dict(src_ip=src_ip, dst_ip=dst_ip)
+
+            def meta_map(self):
+                return self._meta
+
+        shards = set(transport.shard_for(Flow('10.0.0.{0}'.format(i), '10.1.0.1'))
+                     for i in range(64))
+        self.assertEqual(shards, set(range(4)))
+
+        class Record(object):
+            def __init__(self, directory):
+                self._doc = dict(type='summary', meta=dict(directory=directory), start=0)
+
+            def to_json_packet(self):
+                return self._doc
+
+        # records without endpoints are spread by their meta, not all on 0
+        shards = [transport.shard_for(Record('{0}.out'.format(i))) for i in range(64)]
+        self.assertEqual(set(shards), set(range(4)))
+        self.assertEqual(shards, [transport.shard_for(Record('{0}.out'.format(i)))
+                                  for i in range(64)])
+
+    def test_closed_by_parser(self):
+        parser = TstatParse(self.__load__config__())
+        closed = list()
+        parser._transport._pool.close = lambda: closed.append(True)
+        parser.finish(report=False)
+        self.assertEqual(closed, [True])
+
+    def test_broker_list(self):
+        config = self.__load__config__(host='localhost, 127.0.0.1:5673')
+        transport = RabbitMQTransport(config)
+        params = transport._connect_info
+        self.assertEqual([(x.host, x.port) for x in params],
+                         [('localhost', 5672), ('127.0.0.1', 5673)])
+        # heartbeat from the config is passed to the connection
+        self.assertEqual([x.heartbeat for x in params], [300, 300])
+        self.assertEqual(len(transport._pool.endpoints), 2)
+        self.assertIsNone(transport._channel)
+
+    def test_replay_routing(self):
+        config = self.__load__config__()
+        config.options.replay = '2020-06-10..'
+        transport = RabbitMQTransport(config)
+        self.assertEqual(transport._queue, 'netsage_tstat.replay')
+        self.assertEqual(transport._routing_key, 'netsage_tstat.replay')
+
+        config = self.__load__config__(replay_routing_key='backfill')
+        config.options.replay = '2020-06-10..'
+        self.assertEqual(RabbitMQTransport(config)._routing_key, 'backfill')
+
+    def test_invalid_shards(self):
+        from tstat_transport.common import TstatTransportException
+        with self.assertRaises(TstatTransportException):
+            RabbitMQTransport(self.__load__config__(shards='many'))
+        with self.assertRaises(TstatTransportException):
+            RabbitMQTransport(self.__load__config__(shard_key='port'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,10 +2,14 @@
 Utility code for tstat_transport package and client programs.
 """
 
+import json
 import logging
 import time
 import signal
 import socket
+import sys
+import threading
+import traceback
 
 
 class GracefulInterruptHandler(object):  # pylint: disable=too-few-public-methods
@@ -48,25 +52,182 @@ class GracefulInterruptHandler(object):  # pylint: disable=too-few-public-method
         return True
 
 
+# the stderr/file log line - the event name is kept as data and only
+# rendered here.
+TEXT_FORMAT = '{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {extra[event]} | {message}'
+
+LOG_FORMATS = ('text', 'json')
+
+# event -> N to only log 1 in N of the event, see configure_log()
+_SAMPLING = dict()
+_COUNTS = dict()
+_BOUND = dict()
+# guards _SAMPLING/_COUNTS - the logs of a directory are read in threads
+_LOCK = threading.Lock()
+
+# set once the handlers are _RecordSinks, which render the messages
+_DEFERRED = False
+
+
+class _RecordSink(object):
+    """
+    A loguru sink that renders the records itself - the message template
+    with its fields, then the text line or JSON object. loguru calls
+    write() from its background thread when the handler is enqueued, so
+    none of this is done by the thread that logged the record.
+    """
+
+    def __init__(self, stream, serialize=False, close=False):
+        self._stream = stream
+        self._serialize = serialize
+        self._close = close
+
+    def write(self, message):
+        """Render and write a record."""
+        record = message.record
+        extra = dict(record['extra'])
+        fields = extra.pop('fields', None)
+        text = record['message']
+        if fields:
+            text = text.format(**dict((x, extra[x]) for x in fields))
+
+        line = TEXT_FORMAT.format_map(dict(record, message=text, extra=extra))
+        if record['exception']:
+            line += '\n' + ''.join(traceback.format_exception(*record['exception'])).rstrip()
+
+        if self._serialize:
+            line = json.dumps(dict(text=line, record=dict(
+                time=record['time'].isoformat(), level=record['level'].name, message=text,
+                extra=extra, name=record['name'], function=record['function'],
+                line=record['line'], process=record['process'].id,
+                thread=record['thread'].id)), default=str)
+
+        self._stream.write(line + '\n')
+        self._stream.flush()
+
+    def stop(self):
+        """Called by loguru when the handler is removed."""
+        if self._close:
+            self._stream.close()
+
+
 def setup_log(log_path=None):
     """
     Usage:
     _log('main.start', 'happy simple log event')
-    _log('launch', 'more={0}, complex={1} log=event'.format(100, 200))
+    _log('launch', 'more={more}, complex={complex} log=event', more=100, complex=200)
+
+    Called on import, so only adds to the loguru handlers - an application
+    using the package keeps its own. tstat_send takes the log over with
+    configure_log().
     """
     # pylint: disable=redefined-variable-type
     from loguru import logger
     if log_path is not None:
         logger.add('{0}/tstat_transport.log'.format(log_path))
-    logger.level("INFO")
     return logger
 
 
 log = setup_log()  # pylint: disable=invalid-name
 
 
-def _log(event, msg, modern=False):
-    log.info(msg)
+def _reset_log(log_path=None, fmt='text', enqueue=True):
+    """
+    Replace the loguru handlers with stderr (and log_path) _RecordSinks.
+    The records are rendered and written by a background thread (enqueue)
+    so neither that nor a slow disk holds up the caller. With fmt 'json'
+    each record is written as a JSON object with the event and fields in
+    extra.
+    """
+    log.remove()
+    log.configure(extra=dict(event='', sampled=None, fields=None))
+    log.add(_RecordSink(sys.stderr, fmt == 'json'), format='{message}', enqueue=enqueue)
+    if log_path is not None:
+        stream = open('{0}/tstat_transport.log'.format(log_path), 'a')
+        log.add(_RecordSink(stream, fmt == 'json', close=True), format='{message}',
+                enqueue=enqueue)
+    global _DEFERRED  # pylint: disable=global-statement
+    _DEFERRED = True
+    _BOUND.clear()
+
+
+def configure_log(opts):
+    """
+    Set up the log from the options of the [logging] config stanza:
+
+        [logging]
+        # text or json
+        format = text
+        # also write tstat_transport.log in this directory
+        path = /var/log/tstat_transport
+        # write from a background thread
+        queue = true
+        # only log 1 in N of these events
+        sample = rabbit.send:100, _process_payload.run:100
+
+    The handlers added on import, or by the application, are replaced.
+    Raises ValueError on a bad value.
+    """
+    fmt = opts.get('format', 'text').strip()
+    if fmt not in LOG_FORMATS:
+        raise ValueError('[logging] format must be one of: {0}'.format(', '.join(LOG_FORMATS)))
+
+    queue = opts.get('queue', 'true').strip().lower()
+    if queue not in ('true', 'false'):
+        raise ValueError('[logging] queue must be true or false')
+
+    sampling = dict()
+    for entry in [x.strip() for x in opts.get('sample', '').split(',') if x.strip()]:
+        event, _, every = entry.rpartition(':')
+        try:
+            sampling[event.strip()] = int(every)
+        except ValueError:
+            sampling[event.strip()] = 0
+        if not event.strip() or sampling[event.strip()] <= 0:
+            raise ValueError('[logging] sample must be a list of event:N with N > 0')
+
+    _reset_log(opts.get('path') or None, fmt, queue == 'true')
+    set_sampling(sampling)
+
+
+def set_sampling(sampling):
+    """Only log 1 in N of the events in the sampling dict of event -> N.
+    The sampled records have the N in their sampled field."""
+    with _LOCK:
+        _SAMPLING.clear()
+        _SAMPLING.update(sampling)
+        _COUNTS.clear()
+    _BOUND.clear()
+
+
+def _log(event, msg, modern=False, **fields):  # pylint: disable=unused-argument
+    """
+    Log an event. If fields are passed, msg is a str.format() template
+    for them that is only rendered if the record is written, and the
+    fields are kept in the record as data. Once configure_log() has set
+    up the handlers, the fields are passed through and the template is
+    rendered by the sink, off the calling thread.
+    """
+    every = _SAMPLING.get(event)
+    if every is not None:
+        with _LOCK:
+            count = _COUNTS.get(event, 0)
+            _COUNTS[event] = count + 1
+        if count % every:
+            return
+
+    if fields and _DEFERRED:
+        log.bind(event=event, sampled=every, fields=tuple(fields), **fields).info(msg)
+        return
+
+    if fields:
+        log.info(msg, event=event, sampled=every, **fields)
+        return
+
+    bound = _BOUND.get((event, every))
+    if bound is None:
+        bound = _BOUND[(event, every)] = log.bind(event=event, sampled=every)
+    bound.info(msg)
 
 
 def valid_hostname(hostname):
@@ -76,3 +237,27 @@ def valid_hostname(hostname):
         return True
     except socket.gaierror:
         return False
+
+
+def split_endpoints(hosts, default_port):
+    """
+    Split a comma separated list of host[:port] values into a list of
+    (host, port) tuples. IPv6 literals with a port must be bracketed -
+    ie: [::1]:5672. Raises ValueError on a bad port.
+    """
+    ret = list()
+
+    for entry in [x.strip() for x in hosts.split(',') if x.strip()]:
+        port = default_port
+        if entry.startswith('['):
+            host, _, rest = entry[1:].partition(']')
+            if rest.startswith(':'):
+                port = int(rest[1:])
+        elif entry.count(':') == 1:
+            host, port = entry.split(':')
+            port = int(port)
+        else:
+            host = entry
+        ret.append((host, port))
+
+    return ret
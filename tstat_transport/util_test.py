@@ -0,0 +1,104 @@
+import contextlib
+import io
+import json
+import unittest
+
+from tstat_transport import util
+from tstat_transport.util import _log, configure_log, log, set_sampling, setup_log
+
+
+class Unprintable(object):
+    def __init__(self):
+        self.rendered = 0
+
+    def __str__(self):
+        self.rendered += 1
+        return 'unprintable'
+
+
+class TestLogMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.records = list()
+        self.sink = log.add(lambda m: self.records.append(m.record), format='{message}')
+
+    def tearDown(self):
+        set_sampling(dict())
+        log.remove(self.sink)
+        # as before configure_log()
+        util._DEFERRED = False
+
+    def test_fields(self):
+        _log('test.fields', 'sent {records} records to {broker}', records=3, broker='b1')
+        _log('test.plain', 'braces {0} are left alone')
+
+        self.assertEqual(self.records[0]['message'], 'sent 3 records to b1')
+        self.assertEqual(self.records[0]['extra']['event'], 'test.fields')
+        self.assertEqual(self.records[0]['extra']['records'], 3)
+        self.assertEqual(self.records[1]['message'], 'braces {0} are left alone')
+        self.assertEqual(self.records[1]['extra']['event'], 'test.plain')
+
+    def test_sampling(self):
+        set_sampling({'test.hot': 4})
+        obj = Unprintable()
+
+        for i in range(10):
+            _log('test.hot', 'publish {n} {obj}', n=i, obj=obj)
+        _log('test.cold', 'not sampled')
+
+        self.assertEqual([x['extra']['n'] for x in self.records[:-1]], [0, 4, 8])
+        self.assertEqual(self.records[0]['extra']['sampled'], 4)
+        self.assertIsNone(self.records[-1]['extra']['sampled'])
+        # the skipped records were never rendered
+        self.assertEqual(obj.rendered, 3)
+
+    def test_setup_is_additive(self):
+        # as on import - the handlers that are already there are kept
+        setup_log()
+        _log('test.kept', 'still logged')
+        self.assertEqual(self.records[-1]['message'], 'still logged')
+
+    def test_configure(self):
+        with self.assertRaises(ValueError):
+            configure_log(dict(format='xml'))
+        with self.assertRaises(ValueError):
+            configure_log(dict(sample='rabbit.send:0'))
+        with self.assertRaises(ValueError):
+            configure_log(dict(sample='rabbit.send'))
+
+        lines = list()
+        try:
+            configure_log(dict(format='json', queue='false', sample='test.hot:2'))
+            log.add(lines.append, serialize=True)
+            for i in range(3):
+                _log('test.hot', 'n={n}', n=i)
+        finally:
+            configure_log(dict(queue='false'))
+            self.sink = log.add(lambda m: None)
+
+        docs = [json.loads(x)['record'] for x in lines]
+        self.assertEqual([x['extra']['n'] for x in docs], [0, 2])
+        self.assertEqual(docs[0]['extra']['event'], 'test.hot')
+
+    def test_rendered_by_sink(self):
+        err = io.StringIO()
+        obj = Unprintable()
+        records = list()
+        try:
+            with contextlib.redirect_stderr(err):
+                configure_log(dict(queue='true'))
+            log.add(lambda m: records.append(m.record), format='{message}')
+            _log('test.deferred', 'sent {n} to {obj}', n=3, obj=obj)
+            log.complete()
+        finally:
+            configure_log(dict(queue='false'))
+            self.sink = log.add(lambda m: None)
+
+        # the fields are passed through, and rendered by the sink
+        self.assertEqual(records[0]['message'], 'sent {n} to {obj}')
+        self.assertEqual(records[0]['extra']['n'], 3)
+        self.assertIn('| test.deferred | sent 3 to unprintable', err.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()